@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Activity, FieldsActivity, OptionsForSelect
+from .models import Activity, FieldsActivity, Job, OptionsForSelect
 
 
 class OptionsForSelectAdmin(admin.ModelAdmin):
@@ -8,6 +8,14 @@ class OptionsForSelectAdmin(admin.ModelAdmin):
     list_filter = ('fields',)
 
 
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'portal', 'status', 'attempts', 'created',
+                    'get_wait_time', 'get_run_time')
+    list_filter = ('status', 'name', 'portal')
+    search_fields = ('error',)
+
+
 admin.site.register(Activity)
 admin.site.register(FieldsActivity)
+admin.site.register(Job, JobAdmin)
 admin.site.register(OptionsForSelect, OptionsForSelectAdmin)
@@ -0,0 +1,235 @@
+import logging
+from http import HTTPStatus
+
+from asgiref.sync import sync_to_async
+from core.bitrix24.bitrix24 import DealB24, QuoteB24
+from core.bitrix24.client import get_async_client
+from core.locks import LockTimeoutError, named_lock_async
+from core.models import Portals
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from settings.cache import get_portal_settings
+from settings.models import SettingsPortal
+
+from . import coalescing
+from .jobs import enqueue
+from .messages import MESSAGES_FOR_BP, MESSAGES_FOR_LOG
+from .views import (CALCULATION_ATTEMPTS, CALCULATION_LOCK_TIMEOUT,
+                    SEND_TO_DB_ATTEMPTS, add_volume, calculate_products,
+                    check_initial_data, check_inn, create_portal,
+                    get_calculation_key, get_logger, get_product_rows,
+                    get_volume, run_in_thread, start_app)
+
+
+async def run_sync(func, *args):
+    """Выполнить синхронную функцию в пуле потоков.
+
+    Работа с БД и копиями данных портала выполняется вне цикла событий,
+    соединения потока с БД закрываются после выполнения.
+    """
+    return await sync_to_async(run_in_thread, thread_sensitive=False)(
+        func, *args)
+
+
+@csrf_exempt
+async def send_to_db(request):
+    """Асинхронная view-функция активити 'Передача объемов в БД'."""
+    logger_send = get_logger('send_to_db', logging.DEBUG)
+    started = await init_app(request, logger_send)
+    if isinstance(started, HttpResponse):
+        return started
+    initial_data, portal, settings_portal, obj_id, company_id = started
+    if settings_portal.run_in_background:
+        job = await run_sync(enqueue, portal, 'send_to_db', initial_data,
+                             SEND_TO_DB_ATTEMPTS)
+        logger_send.info(MESSAGES_FOR_LOG['job_enqueued'].format(job.pk))
+        return HttpResponse(status=200)
+    obj = await create_obj_and_get_all_products(portal, obj_id, initial_data,
+                                                logger_send)
+    if not obj:
+        return HttpResponse(status=200)
+    result = await run_sync(add_volume, portal, settings_portal, initial_data,
+                            obj, company_id, logger_send)
+    if result:
+        await response_for_bp(portal, initial_data['event_token'], *result)
+    return HttpResponse(status=200)
+
+
+@csrf_exempt
+async def get_from_db(request):
+    """Асинхронная view-функция активити 'Получение объемов из БД'."""
+    logger_get = get_logger('get_from_db', logging.DEBUG)
+    started = await init_app(request, logger_get)
+    if isinstance(started, HttpResponse):
+        return started
+    initial_data, portal, settings_portal, obj_id, company_id = started
+    await response_for_bp(portal, initial_data['event_token'],
+                          *await run_sync(get_volume, portal, company_id,
+                                          logger_get))
+    return HttpResponse(status=200)
+
+
+@csrf_exempt
+async def check_company_inn(request):
+    """Асинхронная view-функция активити 'Проверка компании по ИНН'."""
+    if request.method != 'POST':
+        return HttpResponse(status=HTTPStatus.BAD_REQUEST)
+    initial_data = {
+        'member_id': request.POST.get('auth[member_id]'),
+        'event_token': request.POST.get('event_token'),
+        'document_type': request.POST.get('document_type[2]'),
+        'company_inn': request.POST.get('properties[company_inn]'),
+    }
+    try:
+        portal, settings_portal = await run_sync(get_portal_settings,
+                                                 initial_data['member_id'])
+        await run_sync(portal.check_auth)
+    except ObjectDoesNotExist:
+        return HttpResponse(status=200)
+    await response_for_bp(portal, initial_data['event_token'],
+                          *await run_sync(check_inn, portal, settings_portal,
+                                          initial_data.get('company_inn')))
+    return HttpResponse(status=200)
+
+
+@csrf_exempt
+async def calculation(request):
+    """Асинхронная view-функция активити 'Расчет скидок'."""
+    logger_calc = get_logger('calculation', logging.INFO)
+    started = await init_app(request, logger_calc)
+    if isinstance(started, HttpResponse):
+        return started
+    initial_data, portal, settings_portal, obj_id, company_id = started
+    if settings_portal.run_in_background:
+        job = await run_sync(enqueue, portal, 'calculation', initial_data,
+                             CALCULATION_ATTEMPTS)
+        logger_calc.info(MESSAGES_FOR_LOG['job_enqueued'].format(job.pk))
+        return HttpResponse(status=200)
+    # Повторный запрос по тому же объекту ждет выполняемый расчет
+    entry, leader = coalescing.acquire(
+        get_calculation_key(portal, initial_data, obj_id, company_id),
+        initial_data['event_token'])
+    if not leader:
+        logger_calc.info(MESSAGES_FOR_LOG['calculation_coalesced'].format(
+            obj_id))
+        response = await coalescing.wait_response_async(entry)
+        if response:
+            await response_for_bp(portal, initial_data['event_token'],
+                                  *response)
+            logger_calc.info(MESSAGES_FOR_LOG['stop_app'])
+            return HttpResponse(status=200)
+    try:
+        # Расчеты одного объекта в разных процессах выполняются по очереди
+        async with named_lock_async('calculation', portal.member_id,
+                                    initial_data['document_type'], obj_id,
+                                    timeout=CALCULATION_LOCK_TIMEOUT):
+            await calculate_obj(portal, settings_portal, initial_data,
+                                obj_id, company_id, logger_calc)
+    except LockTimeoutError as ex:
+        logger_calc.error(MESSAGES_FOR_LOG['lock_timeout'].format(ex))
+        logger_calc.info(MESSAGES_FOR_LOG['stop_app'])
+        await response_for_bp(portal, initial_data['event_token'],
+                              MESSAGES_FOR_BP['lock_timeout'])
+    finally:
+        if leader:
+            coalescing.release(entry)
+    return HttpResponse(status=200)
+
+
+async def calculate_obj(portal: Portals, settings_portal: SettingsPortal,
+                        initial_data: dict[str, any], obj_id: int,
+                        company_id: int, logger_calc) -> None:
+    """Функция расчета скидок и записи товаров сделки или предложения."""
+    obj = await create_obj_and_get_all_products(portal, obj_id, initial_data,
+                                                logger_calc)
+    if not obj:
+        return
+    changed_products = await run_sync(
+        calculate_products, portal, settings_portal, initial_data, obj,
+        company_id, logger_calc)
+    if changed_products is None:
+        return
+    # Если цены не изменились, товары в сделку не передаем
+    if not changed_products:
+        logger_calc.info(MESSAGES_FOR_LOG['products_not_changed'])
+        await response_for_bp(portal, initial_data['event_token'],
+                              MESSAGES_FOR_BP['calculation_not_changed'])
+        logger_calc.info(MESSAGES_FOR_LOG['stop_block'])
+        logger_calc.info(MESSAGES_FOR_LOG['stop_app'])
+        return
+    logger_calc.info(MESSAGES_FOR_LOG['products_changed'].format(
+        ', '.join(str(product_id) for product_id in changed_products)))
+    try:
+        await obj.set_products_async(get_product_rows(obj,
+                                                      changed_products))
+    except RuntimeError:
+        logger_calc.error(MESSAGES_FOR_LOG['impossible_send_to_deal'])
+        logger_calc.info(MESSAGES_FOR_LOG['stop_app'])
+        await response_for_bp(portal, initial_data['event_token'],
+                              MESSAGES_FOR_BP['impossible_send_to_deal'])
+        return
+    await response_for_bp(portal, initial_data['event_token'],
+                          MESSAGES_FOR_BP['calculation_ok'])
+    logger_calc.info(MESSAGES_FOR_LOG['stop_block'])
+    logger_calc.info(MESSAGES_FOR_LOG['stop_app'])
+
+
+async def response_for_bp(portal, event_token, log_message,
+                          return_values=None):
+    """Метод отправки параметров ответа в БП, не блокирующий цикл событий."""
+    coalescing.record_response(event_token, log_message, return_values)
+    await get_async_client(portal).call('bizproc.event.send', {
+        'event_token': event_token,
+        'log_message': log_message,
+        'return_values': return_values,
+    })
+
+
+async def init_app(request, logger) -> tuple or HttpResponse:
+    """Функция получения и проверки начальных данных активити.
+
+    Возвращает начальные данные, портал, его настройки, ID объекта и
+    компании.
+    """
+    initial_data = start_app(request, logger)
+    if isinstance(initial_data, HttpResponse):
+        return initial_data
+    portal_settings = await run_sync(create_portal, initial_data, logger)
+    if isinstance(portal_settings, HttpResponse):
+        return portal_settings
+    portal, settings_portal = portal_settings
+    ids = await run_sync(check_initial_data, portal, initial_data, logger)
+    if isinstance(ids, HttpResponse):
+        return ids
+    return (initial_data, portal, settings_portal, *ids)
+
+
+async def create_obj_and_get_all_products(
+        portal: Portals, obj_id: int, initial_data: dict[str, any],
+        logger) -> DealB24 or QuoteB24 or None:
+    """Функция создания сделки или предложения и получения всех товаров."""
+    if initial_data['document_type'] == 'DEAL':
+        obj = DealB24(portal, obj_id, select=['ASSIGNED_BY_ID'])
+    else:
+        obj = QuoteB24(portal, obj_id, select=['ASSIGNED_BY_ID'])
+    try:
+        await obj.get_all_products_async()
+    except Exception as ex:
+        logger.error(MESSAGES_FOR_LOG['impossible_get_products'])
+        logger.info(MESSAGES_FOR_LOG['stop_app'])
+        await response_for_bp(
+            portal, initial_data['event_token'],
+            MESSAGES_FOR_BP['impossible_get_products'] + ex.args[0],
+            return_values={'errors': MESSAGES_FOR_BP[
+                'impossible_get_products']})
+        return None
+    if obj.products:
+        return obj
+    logger.error(MESSAGES_FOR_LOG['products_in_deal_null'])
+    logger.info(MESSAGES_FOR_LOG['stop_app'])
+    await response_for_bp(portal, initial_data['event_token'],
+                          MESSAGES_FOR_BP['products_in_deal_null'],
+                          return_values={'errors': MESSAGES_FOR_BP[
+                              'products_in_deal_null']})
+    return None
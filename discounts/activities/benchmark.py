@@ -0,0 +1,229 @@
+"""Эмулятор портала Битрикс24 для замера пропускной способности расчета
+скидок.
+
+Эмулятор отвечает на методы REST API, которые вызывает расчет скидок
+сделки, с постоянной задержкой. Данные портала постоянные: сделка с
+заданным числом товаров и по одному правилу в каждом блоке скидок.
+"""
+import json
+import re
+import threading
+import time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from core.models import Portals
+from settings.models import SettingsPortal
+
+MEMBER_ID: str = 'benchmark'
+COMPANY_ID: int = 5
+REQUISITE_ID: int = 77
+NOMENCLATURE_GROUPS: tuple[int] = (100, 101, 102)
+CATALOG_SIZE: int = 500
+# Код поля номенклатурной группы товара и id смарт процессов скидок
+PROPERTY_NOMENCLATURE_GROUP: str = 'PROPERTY_10'
+SMART_PROCESSES: dict[str, int] = {
+    'partner': 1,
+    'sum_invoice': 2,
+    'accumulative': 3,
+    'discount_product': 4,
+}
+
+
+def create_portal(hostname: str) -> tuple[Portals, SettingsPortal]:
+    """Создать портал эмулятора с включенными блоками скидок."""
+    portal = Portals.objects.create(member_id=MEMBER_ID, name=hostname,
+                                    auth_id='auth', refresh_id='refresh')
+    settings_portal = SettingsPortal.objects.create(
+        portal=portal,
+        code_nomenclature_group_id=PROPERTY_NOMENCLATURE_GROUP,
+        id_uni_list_nomenclature_groups=7,
+        code_accumulative_uni_list_is_active='PROPERTY_20',
+        accumulative_is_active_yes='Y',
+        code_sum_invoice_uni_list_is_active='PROPERTY_21',
+        sum_invoice_is_active_yes='Y',
+        id_smart_process_partner=SMART_PROCESSES['partner'],
+        code_company_type_smart_partner='ufType',
+        code_nomenclature_group_id_smart_partner='ufGroup',
+        code_discount_smart_partner='ufDiscount',
+        id_smart_process_sum_invoice=SMART_PROCESSES['sum_invoice'],
+        code_discount_smart_sum_invoice='ufDiscount',
+        id_smart_process_accumulative=SMART_PROCESSES['accumulative'],
+        code_nomenclature_group_accumulative='ufGroup',
+        code_upper_one_accumulative='ufLimit1',
+        code_discount_upper_one_accumulative='ufDiscount1',
+        code_upper_two_accumulative='ufLimit2',
+        code_discount_upper_two_accumulative='ufDiscount2',
+        code_upper_three_accumulative='ufLimit3',
+        code_discount_upper_three_accumulative='ufDiscount3',
+        id_smart_process_discount_product=SMART_PROCESSES['discount_product'],
+        code_discount_smart_discount_product='ufDiscount',
+    )
+    return portal, settings_portal
+
+
+def parse_query(query: str) -> dict[str, any]:
+    """Разобрать параметры команды пакета в формате PHP (a[b][]=c)."""
+    params = {}
+    for name, value in parse_qsl(query):
+        parts = re.findall(r'[^\[\]]+|\[\]', name)
+        current = params
+        for number, part in enumerate(parts):
+            if parts[number + 1:] == ['[]']:
+                current.setdefault(part, []).append(value)
+                break
+            if number == len(parts) - 1:
+                current[part] = value
+            else:
+                current = current.setdefault(part, {})
+    return params
+
+
+class StubPortal:
+    """Данные и ответы эмулятора портала."""
+
+    def __init__(self, products_count: int):
+        self.rows = [
+            {'ID': str(1000 + number), 'PRODUCT_ID': number, 'PRICE': 100.0,
+             'PRICE_BRUTTO': 100.0, 'QUANTITY': 2, 'DISCOUNT_TYPE_ID': 2,
+             'DISCOUNT_RATE': 0, 'TAX_RATE': None}
+            for number in range(1, products_count + 1)
+        ]
+        self.catalog = {
+            product_id: {'ID': str(product_id), PROPERTY_NOMENCLATURE_GROUP: {
+                'valueId': '1',
+                'value': str(NOMENCLATURE_GROUPS[
+                    product_id % len(NOMENCLATURE_GROUPS)])}}
+            for product_id in range(1, CATALOG_SIZE + 1)
+        }
+        group_partner, _, group_accumulative = (
+            NOMENCLATURE_GROUPS)
+        self.smart_processes = {
+            SMART_PROCESSES['partner']: [
+                {'id': 1, 'ufType': 'PARTNER', 'ufGroup': group_partner,
+                 'ufDiscount': 5}],
+            SMART_PROCESSES['sum_invoice']: [
+                {'id': 1, 'opportunity': 1000, 'ufDiscount': 3},
+                {'id': 2, 'opportunity': 100000, 'ufDiscount': 10}],
+            SMART_PROCESSES['accumulative']: [
+                {'id': 1, 'ufGroup': group_accumulative, 'ufLimit1': 10,
+                 'ufDiscount1': 7, 'ufLimit2': 1000, 'ufDiscount2': 8,
+                 'ufLimit3': 5000, 'ufDiscount3': 9}],
+            SMART_PROCESSES['discount_product']: [
+                {'id': 1, 'companyId': COMPANY_ID, 'ufDiscount': 15}],
+        }
+        self.smart_products = {1: [{'productId': 3}]}
+        self.responses = []
+        self._lock = threading.Lock()
+
+    def call(self, method: str, params: dict[str, any]) -> dict[str, any]:
+        """Ответ на вызов метода REST API."""
+        if method == 'batch':
+            results, errors = {}, {}
+            for key, command in params['cmd'].items():
+                command_method, query = command.split('?', 1)
+                response = self.call(command_method, parse_query(query))
+                if 'error' in response:
+                    errors[key] = response
+                else:
+                    results[key] = response['result']
+            return {'result': {'result': results or [],
+                               'result_error': errors or []}}
+        handler = getattr(self, 'call_' + method.replace('.', '_'), None)
+        if handler is None:
+            return {'error': 'ERROR_METHOD_NOT_FOUND',
+                    'error_description': method}
+        return {'result': handler(params)}
+
+    def call_crm_deal_productrows_get(self, params):
+        return [dict(row) for row in self.rows]
+
+    def call_crm_deal_productrows_set(self, params):
+        return True
+
+    def call_crm_company_list(self, params):
+        return [{'ID': str(COMPANY_ID), 'COMPANY_TYPE': 'PARTNER'}]
+
+    def call_crm_requisite_list(self, params):
+        return [{'ID': str(REQUISITE_ID), 'ENTITY_TYPE_ID': '4',
+                 'ENTITY_ID': str(COMPANY_ID), 'RQ_INN': '7700000000'}]
+
+    def call_crm_product_list(self, params):
+        if 'ID' in params['filter']:
+            return [self.catalog[int(product_id)]
+                    for product_id in params['filter']['ID']
+                    if int(product_id) in self.catalog]
+        return [self.catalog[product_id] for product_id in sorted(
+            self.catalog) if product_id > int(params['filter']['>ID'])][:50]
+
+    def call_lists_element_get(self, params):
+        elements_filter = params.get('FILTER') or {}
+        if 'ID' in elements_filter:
+            groups = [int(group_id) for group_id in elements_filter['ID']]
+        else:
+            groups = [group_id for group_id in NOMENCLATURE_GROUPS
+                      if group_id > int(elements_filter.get('>ID', 0))]
+        return [{'ID': str(group_id), 'PROPERTY_20': {'1': 'Y'},
+                 'PROPERTY_21': {'1': 'Y'}} for group_id in groups]
+
+    def call_crm_type_get(self, params):
+        return {'type': {'entityTypeId': int(params['id']) + 1000}}
+
+    def call_crm_item_list(self, params):
+        last_id = int((params.get('filter') or {}).get('>id', 0))
+        return {'items': [
+            dict(item) for item in self.smart_processes.get(
+                int(params['entityTypeId']) - 1000, [])
+            if item['id'] > last_id][:50]}
+
+    def call_crm_item_productrow_list(self, params):
+        return {'productRows': self.smart_products.get(
+            int(params['filter']['=ownerId']), [])}
+
+    def call_bizproc_event_send(self, params):
+        with self._lock:
+            self.responses.append(params.get('log_message'))
+        return True
+
+
+class StubServer(ThreadingHTTPServer):
+    """HTTP сервер эмулятора с задержкой ответа latency секунд."""
+    daemon_threads = True
+    # Очередь соединений вмещает все одновременные расчеты
+    request_queue_size = 1024
+
+    def __init__(self, portal: StubPortal, latency: float):
+        super().__init__(('127.0.0.1', 0), StubRequestHandler)
+        self.portal = portal
+        self.latency = latency
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> None:
+        threading.Thread(target=self.serve_forever, daemon=True,
+                         name='stub-portal').start()
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов REST API с постоянными соединениями."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        method = self.path.split('/rest/', 1)[1].split('.json', 1)[0]
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(self.server.latency)
+        data = json.dumps(self.server.portal.call(
+            method, json.loads(body or b'{}'))).encode('utf-8')
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import time
+
+# Сколько секунд повторный запрос ждет ответа выполняемого расчета
+WAIT_TIMEOUT = 120
+# Интервал проверки завершения расчета в асинхронных обработчиках, сек.
+POLL_INTERVAL = 0.05
+
+
+class InFlight:
+    """Класс Выполняемый расчет.
+
+    К расчету присоединяются повторные запросы с тем же ключом.
+    """
+
+    def __init__(self, key: tuple, event_token: str):
+        self.key = key
+        self.event_token = event_token
+        self.response = None
+        self.finished = threading.Event()
+
+
+_inflight: dict[tuple, InFlight] = {}
+_by_token: dict[str, InFlight] = {}
+_lock = threading.Lock()
+
+
+def acquire(key: tuple, event_token: str) -> tuple[InFlight, bool]:
+    """Функция регистрации расчета по ключу.
+
+    Если расчет с таким ключом уже выполняется в процессе, возвращает его и
+    False: запрос ждет ответа в wait_response. Иначе регистрирует новый
+    расчет и возвращает его и True: запрос выполняет расчет и по окончании
+    вызывает release.
+    """
+    with _lock:
+        entry = _inflight.get(key)
+        if entry is not None:
+            return entry, False
+        entry = _inflight[key] = _by_token[event_token] = InFlight(
+            key, event_token)
+        return entry, True
+
+
+def release(entry: InFlight) -> None:
+    """Функция завершения расчета и оповещения ждущих запросов."""
+    with _lock:
+        _inflight.pop(entry.key, None)
+        _by_token.pop(entry.event_token, None)
+    entry.finished.set()
+
+
+def wait_response(entry: InFlight,
+                  timeout: float = WAIT_TIMEOUT) -> tuple[str, any] or None:
+    """Функция ожидания ответа выполняемого расчета.
+
+    Возвращает сообщение и значения ответа в БП или None, если расчет
+    завершился без ответа или не завершился за timeout секунд.
+    """
+    entry.finished.wait(timeout)
+    return entry.response
+
+
+async def wait_response_async(
+        entry: InFlight,
+        timeout: float = WAIT_TIMEOUT) -> tuple[str, any] or None:
+    """Функция ожидания ответа выполняемого расчета, не занимающая поток."""
+    deadline = time.monotonic() + timeout
+    while not entry.finished.is_set() and time.monotonic() < deadline:
+        await asyncio.sleep(POLL_INTERVAL)
+    return entry.response
+
+
+def record_response(event_token: str, log_message: str,
+                    return_values: dict[str, any] or None) -> None:
+    """Функция сохранения ответа в БП для ждущих запросов."""
+    with _lock:
+        entry = _by_token.get(event_token)
+    if entry is not None:
+        entry.response = (log_message, return_values)
@@ -1,6 +1,6 @@
 import decimal
+from collections.abc import Iterable
 
-from core.bitrix24.bitrix24 import ListB24
 from core.models import Portals
 from django.core.exceptions import ObjectDoesNotExist
 from volumes.models import Volume
@@ -8,9 +8,11 @@ from volumes.models import Volume
 
 class Discount:
     """Базовый класс Скидка."""
+    ACTIVITY_FLAG: str = ''
+
     def __init__(
             self,
-            smart_process_elements: list[dict[str, any]],
+            smart_process_elements: Iterable[dict[str, any]],
             nomenclature_groups: dict[int, decimal.Decimal],
             discounts: dict[str, int],
             portal: Portals,
@@ -19,8 +21,6 @@ class Discount:
         self.nomenclature_groups = nomenclature_groups
         self.discounts = discounts
         self.portal = portal
-        self.property_uni_list_is_active = None
-        self.is_active_yes = None
         self.input_date = []
         self.nomenclature_groups_active = {}
         self.calculated_discounts = {}
@@ -39,33 +39,19 @@ class Discount:
 
     def check_input_date(self):
         """Функция проверки наличия входных данных."""
-        i = 0
-        while i < len(self.smart_process_elements):
-            for elem in self.input_date:
-                if (elem not in self.smart_process_elements[i] or not
-                        self.smart_process_elements[i].get(elem)):
-                    del self.smart_process_elements[i]
-                    break
-            else:
-                i += 1
+        self.smart_process_elements = [
+            element for element in self.smart_process_elements
+            if all(element.get(elem) for elem in self.input_date)
+        ]
 
-    def check_is_active_nomenclature_group(self, id_uni_list_n_groups: int):
+    def check_is_active_nomenclature_group(
+            self, groups_activity: dict[int, dict[str, bool]]):
         """Функция проверки активности номенклатурной группы для расчета
         в определенном типе скидок."""
-        uni_list = ListB24(self.portal, id_uni_list_n_groups)
         for n_group in self.nomenclature_groups:
-            try:
-                uni_list_elem = uni_list.get_element_by_id(n_group)[0]
-                if self.property_uni_list_is_active not in uni_list_elem:
-                    continue
-                is_active = True if (list(uni_list_elem.get(
-                    self.property_uni_list_is_active).values())[0]
-                    == self.is_active_yes) else False
-                if is_active:
-                    self.nomenclature_groups_active[n_group] = (
-                        decimal.Decimal(self.nomenclature_groups[n_group]))
-            except RuntimeError:
-                continue
+            if groups_activity.get(n_group, {}).get(self.ACTIVITY_FLAG):
+                self.nomenclature_groups_active[n_group] = (
+                    decimal.Decimal(self.nomenclature_groups[n_group]))
 
     def calculate_discounts(self):
         raise NotImplementedError(
@@ -74,12 +60,11 @@ class Discount:
 
 class InvoiceDiscount(Discount):
     """Class for one-time invoice discounts."""
+    ACTIVITY_FLAG: str = 'sum_invoice'
 
     def __init__(self,
                  code_discount: str,
-                 property_uni_list_is_active: str,
-                 is_active_yes: str,
-                 smart_process_elements: list[dict[str, any]],
+                 smart_process_elements: Iterable[dict[str, any]],
                  nomenclature_groups: dict[int, decimal.Decimal],
                  discounts: dict[str, int],
                  portal: Portals):
@@ -87,8 +72,6 @@ class InvoiceDiscount(Discount):
                          discounts, portal)
         self.limits = None
         self.code_discount = code_discount
-        self.property_uni_list_is_active = property_uni_list_is_active
-        self.is_active_yes = is_active_yes
         self.input_date = [self.code_discount]
 
     def set_limits(self):
@@ -121,7 +104,7 @@ class PartnerDiscount(Discount):
                  code_discount: str,
                  code_company_type: str,
                  code_nomenclature_group_id: str,
-                 smart_process_elements: list[dict[str, any]],
+                 smart_process_elements: Iterable[dict[str, any]],
                  nomenclature_groups: dict[int, decimal.Decimal],
                  discounts: dict[str, int],
                  portal: Portals):
@@ -156,6 +139,7 @@ class PartnerDiscount(Discount):
 
 class AccumulativeDiscount(Discount):
     """Class for accumulative discounts."""
+    ACTIVITY_FLAG: str = 'accumulative'
 
     def __init__(self,
                  code_nomenclature_group_id: str,
@@ -165,9 +149,7 @@ class AccumulativeDiscount(Discount):
                  code_discount_two_limit: str,
                  code_three_limit: str,
                  code_discount_three_limit: str,
-                 property_uni_list_is_active: str,
-                 is_active_yes: str,
-                 smart_process_elements: list[dict[str, any]],
+                 smart_process_elements: Iterable[dict[str, any]],
                  nomenclature_groups: dict[int, decimal.Decimal],
                  discounts: dict[str, int],
                  company_id: int,
@@ -181,8 +163,6 @@ class AccumulativeDiscount(Discount):
         self.code_discount_two_limit = code_discount_two_limit
         self.code_three_limit = code_three_limit
         self.code_discount_three_limit = code_discount_three_limit
-        self.property_uni_list_is_active = property_uni_list_is_active
-        self.is_active_yes = is_active_yes
         self.company_id = company_id
         self.input_date = [
             self.code_nomenclature_group_id, self.code_first_limit,
@@ -203,6 +183,7 @@ class AccumulativeDiscount(Discount):
                 )
             except ObjectDoesNotExist:
                 continue
+            volume = volume_nomenclature_group.get_total()
             accumulative_limits = {
                 'one': {
                     'lower_limit': decimal.Decimal(
@@ -228,16 +209,16 @@ class AccumulativeDiscount(Discount):
                 },
             }
             if (accumulative_limits.get('one').get('lower_limit')
-                    <= volume_nomenclature_group.volume
+                    <= volume
                     < accumulative_limits.get('one').get('upper_limit')):
                 self.calculated_discounts[n_group] = (
                     accumulative_limits.get('one').get('discount'))
             if (accumulative_limits.get('two').get('lower_limit')
-                    <= volume_nomenclature_group.volume
+                    <= volume
                     < accumulative_limits.get('two').get('upper_limit')):
                 self.calculated_discounts[n_group] = (
                     accumulative_limits.get('two').get('discount'))
             if (accumulative_limits.get('three').get('lower_limit')
-                    <= volume_nomenclature_group.volume):
+                    <= volume):
                 self.calculated_discounts[n_group] = (
                     accumulative_limits.get('three').get('discount'))
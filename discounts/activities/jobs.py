@@ -0,0 +1,248 @@
+import contextlib
+import functools
+import operator
+import threading
+from collections.abc import Iterable
+
+from core.models import Portals
+from django.db import connection, transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+from settings.models import SettingsPortal
+
+from .models import Job
+
+# Через сколько секунд выполняемое задание считается потерянным, если
+# обработчик не продлевает время его выполнения
+VISIBILITY_TIMEOUT = 300
+# Пауза перед первым повтором задания, удваивается с каждой попыткой
+RETRY_DELAY = 30
+# Сколько дней хранятся выполненные задания
+JOBS_TTL_DAYS = 7
+# За какой период считается время ожидания заданий в метриках, сек.
+METRICS_PERIOD = 3600
+
+_current = threading.local()
+
+
+def enqueue(portal: Portals, name: str, payload: dict[str, any],
+            max_attempts: int = 1) -> Job:
+    """Функция постановки задания активити в очередь."""
+    return Job.objects.create(portal=portal, name=name, payload=payload,
+                              max_attempts=max_attempts)
+
+
+def claim_jobs(limit: int,
+               visibility_timeout: int = VISIBILITY_TIMEOUT) -> list[Job]:
+    """Функция получения заданий для выполнения.
+
+    Берутся задания в очереди и выполняемые задания, у которых истекло время
+    выполнения (обработчик завершился аварийно). Места делятся между
+    порталами по get_shares, внутри портала задания берутся по порядку
+    поступления. Строки блокируются с пропуском заблокированных, поэтому
+    несколько обработчиков не получат одно задание. Задание становится
+    доступным повторно через visibility_timeout секунд.
+    """
+    now = timezone.now()
+    available = Job.objects.filter(status__in=[Job.PENDING, Job.RUNNING],
+                                   available_at__lte=now)
+    queued = {
+        row['portal_id']: row
+        for row in available.values('portal_id').annotate(
+            depth=Count('id'), oldest=Min('available_at'))
+    }
+    if not queued:
+        return []
+    running = dict(Job.objects.filter(
+        status=Job.RUNNING, available_at__gt=now, portal_id__in=queued
+    ).values('portal_id').annotate(count=Count('id')).values_list(
+        'portal_id', 'count'))
+    settings_portals = {
+        settings_portal.portal_id: settings_portal
+        for settings_portal in SettingsPortal.objects.filter(
+            portal_id__in=queued)
+    }
+    shares = get_shares(limit, queued, running, settings_portals)
+    # Блокируются только строки заданий: заблокированная строка портала
+    # (например, при обновлении токена) не должна скрывать его задания
+    if connection.features.has_select_for_update_of:
+        locked = available.select_for_update(
+            skip_locked=True, of=('self',)).select_related('portal')
+    else:
+        locked = available.select_for_update(skip_locked=True)
+    jobs = []
+    with transaction.atomic():
+        for portal_id, count in shares.items():
+            jobs.extend(locked.filter(portal_id=portal_id).order_by(
+                'available_at', 'id')[:count])
+        for job in jobs:
+            job.status = Job.RUNNING
+            job.attempts += 1
+            job.started = now
+            job.finished = None
+            job.available_at = now + timezone.timedelta(
+                seconds=visibility_timeout)
+        Job.objects.bulk_update(
+            jobs, ['status', 'attempts', 'started', 'finished',
+                   'available_at'])
+    return jobs
+
+
+def get_shares(limit: int, queued: dict[int, dict[str, any]],
+               running: dict[int, int],
+               settings_portals: dict[int, SettingsPortal]) -> dict[int, int]:
+    """Функция распределения свободных мест между порталами.
+
+    Взвешенная справедливая очередь: каждое следующее место получает
+    портал с наименьшим числом выполняемых заданий на единицу веса, при
+    равенстве - портал с самым старым заданием. Порталы, достигшие своего
+    ограничения одновременных заданий, мест не получают. Возвращает словарь
+    {id портала: число мест}.
+    """
+    default = SettingsPortal()
+    load = {portal_id: running.get(portal_id, 0) for portal_id in queued}
+    shares = {}
+    for _ in range(limit):
+        candidates = [
+            portal_id for portal_id in queued
+            if shares.get(portal_id, 0) < queued[portal_id]['depth']
+            and load[portal_id] < settings_portals.get(
+                portal_id, default).jobs_max_running
+        ]
+        if not candidates:
+            break
+        portal_id = min(candidates, key=lambda portal_id: (
+            load[portal_id] / max(1, settings_portals.get(
+                portal_id, default).jobs_weight),
+            queued[portal_id]['oldest']))
+        shares[portal_id] = shares.get(portal_id, 0) + 1
+        load[portal_id] += 1
+    return shares
+
+
+def extend_jobs(jobs: Iterable[Job],
+                visibility_timeout: int = VISIBILITY_TIMEOUT) -> int:
+    """Функция продления времени выполнения заданий обработчика.
+
+    Пока обработчик продлевает задания, другие обработчики их не берут.
+    Задания, уже переданные другому обработчику, не продлеваются.
+    Возвращает число продленных заданий.
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return 0
+    return Job.objects.filter(
+        functools.reduce(operator.or_, (
+            Q(pk=job.pk, attempts=job.attempts) for job in jobs)),
+        status=Job.RUNNING
+    ).update(available_at=timezone.now() + timezone.timedelta(
+        seconds=visibility_timeout))
+
+
+def complete_job(job: Job) -> bool:
+    """Функция отметки успешного выполнения задания.
+
+    Возвращает False, если задание уже передано другому обработчику и
+    не изменено.
+    """
+    job.status = Job.DONE
+    job.finished = timezone.now()
+    job.error = ''
+    return bool(_get_owned(job).update(
+        status=job.status, finished=job.finished, error=job.error))
+
+
+def fail_job(job: Job, error: str) -> str or None:
+    """Функция отметки ошибки выполнения задания.
+
+    Если попытки не исчерпаны, задание возвращается в очередь с паузой.
+    Возвращает новый статус задания или None, если задание уже передано
+    другому обработчику и не изменено.
+    """
+    job.finished = timezone.now()
+    job.error = error
+    if job.attempts < job.max_attempts:
+        job.status = Job.PENDING
+        job.available_at = job.finished + timezone.timedelta(
+            seconds=RETRY_DELAY * 2 ** (job.attempts - 1))
+    else:
+        job.status = Job.FAILED
+    if not _get_owned(job).update(
+            status=job.status, finished=job.finished, error=job.error,
+            available_at=job.available_at):
+        return None
+    return job.status
+
+
+@contextlib.contextmanager
+def running_job(job: Job):
+    """Выполнение задания в текущем потоке.
+
+    Пока задание выполняется, is_job_owned проверяет, что оно не передано
+    другому обработчику.
+    """
+    _current.job = job
+    try:
+        yield
+    finally:
+        _current.job = None
+
+
+def is_job_owned() -> bool:
+    """Функция проверки, что выполняемое в потоке задание принадлежит
+    обработчику. Вне заданий возвращает True."""
+    job = getattr(_current, 'job', None)
+    return job is None or _get_owned(job).exists()
+
+
+def _get_owned(job: Job):
+    """Задание, если его попытка все еще выполняется этим обработчиком."""
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING,
+                              attempts=job.attempts)
+
+
+def prune_jobs(days: int = JOBS_TTL_DAYS) -> int:
+    """Функция удаления старых выполненных заданий."""
+    return Job.objects.filter(
+        status=Job.DONE,
+        finished__lt=timezone.now() - timezone.timedelta(days=days)
+    ).delete()[0]
+
+
+def get_queue_metrics() -> dict[str, dict[str, any]]:
+    """Метрики очереди заданий по порталам.
+
+    Глубина очереди, число выполняемых заданий, время ожидания самого
+    старого задания в очереди, среднее и максимальное время ожидания
+    заданий, запущенных за METRICS_PERIOD.
+    """
+    now = timezone.now()
+    metrics = {}
+
+    def portal_metrics(name):
+        return metrics.setdefault(name, {
+            'queued': 0, 'running': 0, 'oldest_wait': 0.0,
+            'started': 0, 'avg_wait': 0.0, 'max_wait': 0.0})
+
+    for row in Job.objects.filter(status=Job.PENDING).values(
+            'portal__name').annotate(depth=Count('id'), oldest=Min('created')):
+        item = portal_metrics(row['portal__name'])
+        item['queued'] = row['depth']
+        item['oldest_wait'] = round(
+            (now - row['oldest']).total_seconds(), 3)
+    for name, count in Job.objects.filter(status=Job.RUNNING).values(
+            'portal__name').annotate(count=Count('id')).values_list(
+            'portal__name', 'count'):
+        portal_metrics(name)['running'] = count
+    for name, created, started in Job.objects.filter(
+            started__gte=now - timezone.timedelta(seconds=METRICS_PERIOD)
+    ).values_list('portal__name', 'created', 'started'):
+        item = portal_metrics(name)
+        wait = (started - created).total_seconds()
+        item['avg_wait'] += (wait - item['avg_wait']) / (item['started'] + 1)
+        item['started'] += 1
+        item['max_wait'] = max(item['max_wait'], wait)
+    for item in metrics.values():
+        item['avg_wait'] = round(item['avg_wait'], 3)
+        item['max_wait'] = round(item['max_wait'], 3)
+    return metrics
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from activities import async_views, views
+from activities.benchmark import (COMPANY_ID, StubPortal, StubServer,
+                                  create_portal)
+from core.bitrix24.client import get_async_client, get_client
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import RequestFactory
+
+REQUESTS = 100
+PRODUCTS = 120
+LATENCY = 0.1
+THREADS = [1, 4, 16, 32]
+WARMUP_ATTEMPTS = 3
+
+
+class Command(BaseCommand):
+    help = ('Замеряет пропускную способность расчета скидок синхронными '
+            '(WSGI) и асинхронными (ASGI) обработчиками на эмуляторе портала '
+            'Битрикс24. Данные создаются в тестовой БД, которая удаляется '
+            'после замера')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=REQUESTS,
+            help='Число одновременных расчетов в каждом замере')
+        parser.add_argument(
+            '--products', type=int, default=PRODUCTS,
+            help='Число товаров в сделке')
+        parser.add_argument(
+            '--latency', type=float, default=LATENCY,
+            help='Задержка ответа REST API эмулятора, сек.')
+        parser.add_argument(
+            '--threads', type=int, nargs='+', default=THREADS,
+            help='Число потоков синхронных обработчиков в замерах')
+        parser.add_argument(
+            '--rate-limit', action='store_true',
+            help='Не отключать ограничитель частоты запросов к порталу')
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with tempfile.TemporaryDirectory() as log_dir:
+                views.LOG_PATH = os.path.join(log_dir, '{}.log')
+                self.run_benchmark(options)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run_benchmark(self, options):
+        stub = StubPortal(options['products'])
+        server = StubServer(stub, options['latency'])
+        server.start()
+        portal, _ = create_portal('127.0.0.1')
+        client = get_client(portal)
+        client.PORT = get_async_client(portal).PORT = server.port
+        if not options['rate_limit']:
+            client.limiter.RATE = client.limiter.rate = float(10 ** 6)
+        # Первый расчет заполняет локальные копии данных портала. Блоки
+        # скидок синхронизируют копии параллельно, и SQLite может отказать в
+        # блокировке на запись, поэтому расчет повторяется
+        for _ in range(WARMUP_ATTEMPTS):
+            self.calculate(1)
+            if 'успешно' in stub.responses[-1]:
+                break
+        else:
+            raise CommandError(stub.responses[-1])
+        self.stdout.write(
+            '{} одновременных расчетов сделки с {} товарами, задержка REST '
+            'API {} с, CPU: {}, БД: {}'.format(
+                options['requests'], options['products'],
+                options['latency'], os.cpu_count(), connection.vendor))
+        self.stdout.write('| Обработчик | Время, с | Запросов в секунду |')
+        self.stdout.write('|---|---:|---:|')
+        obj_ids = iter(range(2, 10 ** 9))
+        for threads in options['threads']:
+            batch = [next(obj_ids) for _ in range(options['requests'])]
+            with ThreadPoolExecutor(threads) as executor:
+                self.write_result(
+                    'WSGI, потоков: {}'.format(threads), stub,
+                    lambda: list(executor.map(self.calculate, batch)))
+        batch = [next(obj_ids) for _ in range(options['requests'])]
+        self.write_result(
+            'ASGI, один цикл событий', stub,
+            lambda: asyncio.run(self.calculate_async(batch)))
+        server.shutdown()
+
+    def write_result(self, name, stub, run):
+        """Выполнить замер и вывести строку таблицы результатов."""
+        stub.responses.clear()
+        started = time.monotonic()
+        run()
+        elapsed = time.monotonic() - started
+        failed = [response for response in stub.responses
+                  if 'успешно' not in response]
+        if failed or not stub.responses:
+            raise CommandError('{}: {}'.format(name, failed[:1]))
+        self.stdout.write('| {} | {:.2f} | {:.1f} |'.format(
+            name, elapsed, len(stub.responses) / elapsed))
+
+    @staticmethod
+    def get_request(obj_id):
+        """Запрос активити расчета скидок сделки obj_id."""
+        return RequestFactory().post('/', {
+            'auth[member_id]': 'benchmark',
+            'event_token': 'token-{}'.format(obj_id),
+            'document_type[2]': 'DEAL',
+            'properties[obj_id]': obj_id,
+            'properties[company_id]': COMPANY_ID,
+        })
+
+    def calculate(self, obj_id):
+        views.calculation(self.get_request(obj_id))
+
+    async def calculate_async(self, obj_ids):
+        await asyncio.gather(*(async_views.calculation(
+            self.get_request(obj_id)) for obj_id in obj_ids))
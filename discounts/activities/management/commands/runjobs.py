@@ -0,0 +1,118 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from activities.jobs import (VISIBILITY_TIMEOUT, claim_jobs, complete_job,
+                             extend_jobs, fail_job, prune_jobs, running_job)
+from activities.messages import MESSAGES_FOR_BP, MESSAGES_FOR_LOG
+from activities.models import Job
+from activities.views import (get_logger, response_for_bp, run_calculation,
+                              run_in_thread, run_send_to_db)
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from settings.cache import get_portal_settings
+
+WORKERS = 4
+POLL_INTERVAL = 1.0
+# Как часто удаляются старые выполненные задания, сек.
+PRUNE_INTERVAL = 3600
+# Сколько раз за время выполнения (visibility timeout) продлеваются задания
+HEARTBEATS_PER_TIMEOUT = 3
+
+HANDLERS = {
+    'calculation': run_calculation,
+    'send_to_db': run_send_to_db,
+}
+
+
+def run_job(job: Job) -> None:
+    """Функция выполнения задания с учетом попыток и времени выполнения."""
+    logger = get_logger('jobs', logging.INFO)
+    try:
+        # Прошлая попытка не завершилась за отведенное время
+        if job.attempts > job.max_attempts:
+            raise RuntimeError(MESSAGES_FOR_LOG['job_lost'])
+        portal, settings_portal = get_portal_settings(job.portal.member_id)
+        portal.check_auth()
+        with running_job(job):
+            HANDLERS[job.name](portal, settings_portal, job.payload)
+    except Exception as ex:
+        logger.exception('Задание {}: ошибка'.format(job))
+        status = fail_job(job, repr(ex))
+        if status is None:
+            logger.warning(MESSAGES_FOR_LOG['job_not_owned'].format(job))
+        elif status == Job.FAILED:
+            try:
+                response_for_bp(job.portal, job.payload['event_token'],
+                                '{} {}'.format(MESSAGES_FOR_BP['main_error'],
+                                               ex))
+            except Exception:
+                logger.exception('Задание {}: ответ в БП не отправлен'.format(
+                    job))
+    else:
+        if not complete_job(job):
+            logger.warning(MESSAGES_FOR_LOG['job_not_owned'].format(job))
+    logger.info('Задание {}: попытка {}, ожидание {:.2f} с, выполнение '
+                '{:.2f} с, статус {}'.format(
+                    job, job.attempts, job.get_wait_time(),
+                    job.get_run_time(), job.status))
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задания активити из очереди'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=WORKERS,
+            help='Число одновременно выполняемых заданий')
+        parser.add_argument(
+            '--visibility-timeout', type=int, default=VISIBILITY_TIMEOUT,
+            help='Через сколько секунд незавершенное задание выполняется '
+                 'повторно')
+        parser.add_argument(
+            '--poll-interval', type=float, default=POLL_INTERVAL,
+            help='Пауза между проверками пустой очереди, сек.')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Выполнить доступные задания и завершить работу')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        executor = ThreadPoolExecutor(max_workers=workers,
+                                      thread_name_prefix='jobs')
+        visibility_timeout = options['visibility_timeout']
+        running = {}
+        pruned = 0.0
+        extended = time.monotonic()
+        try:
+            while True:
+                close_old_connections()
+                if time.monotonic() - pruned > PRUNE_INTERVAL:
+                    prune_jobs()
+                    pruned = time.monotonic()
+                jobs = []
+                if len(running) < workers:
+                    jobs = claim_jobs(workers - len(running),
+                                      visibility_timeout)
+                running.update(
+                    (executor.submit(run_in_thread, run_job, job), job)
+                    for job in jobs)
+                # Продлеваем выполняемые задания, чтобы их не взяли повторно
+                if (time.monotonic() - extended
+                        > visibility_timeout / HEARTBEATS_PER_TIMEOUT):
+                    extend_jobs(running.values(), visibility_timeout)
+                    extended = time.monotonic()
+                if options['once'] and not jobs and not running:
+                    break
+                if jobs and len(running) < workers:
+                    continue
+                if running:
+                    for future in wait(running, min(
+                            options['poll_interval'],
+                            visibility_timeout / HEARTBEATS_PER_TIMEOUT),
+                            FIRST_COMPLETED).done:
+                        del running[future]
+                else:
+                    time.sleep(options['poll_interval'])
+        finally:
+            executor.shutdown(wait=True)
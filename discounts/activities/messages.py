@@ -21,9 +21,13 @@ MESSAGES_FOR_BP = {
     'unknown_request_type': 'Ошибка: Неизвестный тип запроса',
     'send_data_to_db_ok': 'Успех: Данные в БД приложения переданы успешно',
     'calculation_ok': 'Успех: Расчет скидок произведен успешно',
+    'calculation_not_changed': 'Успех: Расчет скидок произведен успешно, '
+                               'цены товаров не изменились',
     'volume_no_db': 'Ошибка: Данные не найдены в БД приложения',
     'get_from_db_ok': 'Успех: Данные о накопленном объеме успешно получены',
     'wrong_inn': 'Компания с данным ИНН уже существует в БД',
+    'lock_timeout': 'Ошибка: Объект обрабатывается другим запуском активити, '
+                    'повторите позже',
 }
 
 MESSAGES_FOR_LOG = {
@@ -96,6 +100,9 @@ MESSAGES_FOR_LOG = {
     'all_products_send_bp': 'Все товары со скидками для передачи обратно в '
                             'бизнес-процесс:\n',
     'impossible_send_to_deal': 'Невозможно передать товары в сделку',
+    'products_changed': 'Изменены цены товарных позиций: {}',
+    'products_not_changed': 'Цены товаров не изменились, передача товаров в '
+                            'сделку не требуется',
     'partner_off': 'Скидка для партнера отключена в настройках',
     'sum_invoice_off': 'Скидка разовая по счету отключена в настройках',
     'accumulative_off': 'Скидка накопительная отключена в настройках',
@@ -118,4 +125,13 @@ MESSAGES_FOR_LOG = {
     'impossible_get_nomenclature_is_active': 'Невозможно получить свойство '
                                         'активности для номенклатуры {}',
     'wrong_inn': 'Компания с данным ИНН {} уже существует в БД',
+    'job_enqueued': 'Задание {} поставлено в очередь',
+    'job_lost': 'Задание не завершено за отведенное время',
+    'job_not_owned': 'Задание {} передано другому обработчику, результат '
+                     'не сохранен',
+    'job_response_skipped': 'Ответ в БП {} не отправлен: задание передано '
+                            'другому обработчику',
+    'lock_timeout': 'Не удалось дождаться блокировки {}',
+    'calculation_coalesced': 'Расчет по объекту {} уже выполняется, '
+                             'ожидание его результата',
 }
@@ -1,4 +1,6 @@
+from core.models import Portals
 from django.db import models
+from django.utils import timezone
 
 
 class Activity(models.Model):
@@ -161,3 +163,91 @@ class OptionsForSelect(models.Model):
     class Meta:
         verbose_name = 'Вариант для select'
         verbose_name_plural = 'Варианты для select'
+
+
+class Job(models.Model):
+    """Модель Фоновое задание активити."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнено'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    name = models.CharField(
+        verbose_name='Обработчик',
+        max_length=50,
+    )
+    payload = models.JSONField(
+        verbose_name='Начальные данные',
+    )
+    status = models.CharField(
+        verbose_name='Статус',
+        max_length=10,
+        choices=STATUSES,
+        default=PENDING,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name='Попыток',
+        default=0,
+    )
+    max_attempts = models.PositiveSmallIntegerField(
+        verbose_name='Максимум попыток',
+        default=1,
+    )
+    available_at = models.DateTimeField(
+        verbose_name='Доступно с',
+        help_text='Для выполняемого задания - время, после которого оно '
+                  'считается потерянным и выполняется повторно.',
+        default=timezone.now,
+    )
+    created = models.DateTimeField(
+        verbose_name='Создано',
+        auto_now_add=True,
+    )
+    started = models.DateTimeField(
+        verbose_name='Начало выполнения',
+        null=True,
+        blank=True,
+    )
+    finished = models.DateTimeField(
+        verbose_name='Окончание выполнения',
+        null=True,
+        blank=True,
+    )
+    error = models.TextField(
+        verbose_name='Ошибка',
+        blank=True,
+    )
+    portal = models.ForeignKey(
+        Portals,
+        verbose_name='Портал',
+        related_name='jobs',
+        on_delete=models.CASCADE,
+    )
+
+    class Meta:
+        verbose_name = 'Фоновое задание'
+        verbose_name_plural = 'Фоновые задания'
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+        ]
+
+    def __str__(self):
+        return '{} #{}'.format(self.name, self.pk)
+
+    def get_wait_time(self) -> float or None:
+        """Время ожидания в очереди до последнего запуска, сек."""
+        if not self.started:
+            return None
+        return (self.started - self.created).total_seconds()
+
+    def get_run_time(self) -> float or None:
+        """Время последнего выполнения, сек."""
+        if not self.started or not self.finished:
+            return None
+        return (self.finished - self.started).total_seconds()
@@ -0,0 +1,169 @@
+import logging
+from concurrent.futures import Future
+from types import SimpleNamespace
+from unittest import mock
+
+from core.models import Portals
+from django.db import OperationalError
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from pybitrix24.exceptions import PBx24RequestError
+
+from . import views
+from .jobs import claim_jobs, complete_job, enqueue, extend_jobs, fail_job
+from .management.commands import runjobs
+from .models import Job
+
+
+class JobsTest(TestCase):
+    """Владение заданием: продление, повторная выдача и завершение."""
+
+    def setUp(self):
+        self.portal = Portals.objects.create(
+            member_id='member', name='test.bitrix24.ru', auth_id='auth',
+            refresh_id='refresh')
+        patcher = mock.patch.object(
+            views, 'RotatingFileHandler',
+            lambda *args, **kwargs: logging.NullHandler())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def expire(self, job: Job) -> None:
+        """Истекло время выполнения задания."""
+        Job.objects.filter(pk=job.pk).update(
+            available_at=timezone.now() - timezone.timedelta(seconds=1))
+
+    def test_reclaimed_job_cannot_be_finished_by_stale_owner(self):
+        enqueue(self.portal, 'calculation', {'event_token': 'token'}, 3)
+        stale, = claim_jobs(1)
+        self.expire(stale)
+        owner, = claim_jobs(1)
+        self.assertEqual(owner.attempts, 2)
+        self.assertFalse(complete_job(stale))
+        self.assertIsNone(fail_job(stale, 'error'))
+        self.assertEqual(Job.objects.get().status, Job.RUNNING)
+        self.assertTrue(complete_job(owner))
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+
+    def test_extended_job_is_not_reclaimed(self):
+        enqueue(self.portal, 'calculation', {'event_token': 'token'})
+        job, = claim_jobs(1)
+        self.expire(job)
+        self.assertEqual(extend_jobs([job]), 1)
+        self.assertEqual(claim_jobs(1), [])
+
+    def test_reclaimed_job_is_not_extended(self):
+        enqueue(self.portal, 'calculation', {'event_token': 'token'}, 3)
+        stale, = claim_jobs(1)
+        self.expire(stale)
+        claim_jobs(1)
+        self.assertEqual(extend_jobs([stale]), 0)
+
+    def test_fail_job_retries_then_fails(self):
+        enqueue(self.portal, 'calculation', {'event_token': 'token'}, 2)
+        job, = claim_jobs(1)
+        self.assertEqual(fail_job(job, 'error'), Job.PENDING)
+        Job.objects.update(available_at=timezone.now())
+        job, = claim_jobs(1)
+        self.assertEqual(fail_job(job, 'error'), Job.FAILED)
+
+    def test_stale_owner_does_not_respond(self):
+        enqueue(self.portal, 'send_to_db', {'event_token': 'token'})
+        job, = claim_jobs(1)
+
+        def handler(portal, settings_portal, payload):
+            # Пока задание выполнялось, его взял другой обработчик
+            Job.objects.filter(pk=job.pk).update(attempts=job.attempts + 1)
+            views.response_for_bp(portal, payload['event_token'], 'ok')
+
+        with mock.patch.dict(runjobs.HANDLERS, {'send_to_db': handler}), \
+                mock.patch.object(runjobs, 'get_portal_settings',
+                                  return_value=(mock.Mock(), None)), \
+                mock.patch.object(views, 'get_client') as get_client:
+            runjobs.run_job(job)
+        get_client.return_value.call.assert_not_called()
+        self.assertEqual(Job.objects.get().status, Job.RUNNING)
+
+    def test_owner_responds(self):
+        enqueue(self.portal, 'send_to_db', {'event_token': 'token'})
+        job, = claim_jobs(1)
+
+        def handler(portal, settings_portal, payload):
+            views.response_for_bp(portal, payload['event_token'], 'ok')
+
+        with mock.patch.dict(runjobs.HANDLERS, {'send_to_db': handler}), \
+                mock.patch.object(runjobs, 'get_portal_settings',
+                                  return_value=(mock.Mock(), None)), \
+                mock.patch.object(views, 'get_client') as get_client:
+            runjobs.run_job(job)
+        get_client.return_value.call.assert_called_once()
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+
+
+class ProductRowsTest(SimpleTestCase):
+    """Товарные позиции для productrows.set сохраняют все поля."""
+
+    def test_rows_are_sent_as_read(self):
+        unchanged = {'ID': '1', 'PRODUCT_ID': 10, 'PRICE': '100',
+                     'DISCOUNT_RATE': 0, 'DISCOUNT_SUM': 0, 'XML_ID': 'x1',
+                     'STORE_ID': 3, 'CUSTOMIZED': 'Y',
+                     'nomenclature_group_id': 5}
+        changed = {'ID': '2', 'PRODUCT_ID': 20, 'PRICE': '90',
+                   'DISCOUNT_RATE': 10, 'DISCOUNT_SUM': 0,
+                   'PRICE_EXCLUSIVE': 100, 'PRICE_NETTO': 100,
+                   'PRICE_ACCOUNT': 100, 'PRICE_BRUTTO': 100,
+                   'XML_ID': 'x2', 'RESERVE_QUANTITY': 1,
+                   'nomenclature_group_id': 5}
+        rows = views.get_product_rows(
+            SimpleNamespace(products=[unchanged, changed]), ['2'])
+        self.assertEqual(rows[0], {
+            key: value for key, value in unchanged.items()
+            if key != 'nomenclature_group_id'})
+        self.assertEqual(rows[1], {
+            'ID': '2', 'PRODUCT_ID': 20, 'PRICE': '90', 'DISCOUNT_RATE': 10,
+            'PRICE_BRUTTO': 100, 'XML_ID': 'x2', 'RESERVE_QUANTITY': 1})
+
+
+class RulesErrorsTest(SimpleTestCase):
+    """Ошибки загрузки правил в пуле потоков завершают расчет ответом в БП."""
+
+    def setUp(self):
+        self.settings_portal = SimpleNamespace(
+            is_active_partner=True, is_active_sum_invoice=False,
+            is_active_accumulative=False, is_active_discount_product=True,
+            code_discount_smart_partner='ufDiscount',
+            code_company_type_smart_partner='ufType',
+            code_nomenclature_group_id_smart_partner='ufGroup')
+        patcher = mock.patch.object(views, 'response_for_bp')
+        self.response_for_bp = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def failed(self, ex: Exception) -> Future:
+        future = Future()
+        future.set_exception(ex)
+        return future
+
+    def test_any_error_is_answered(self):
+        for ex in (PBx24RequestError('timed out'),
+                   OperationalError('gone away'), KeyError('items')):
+            with self.subTest(ex=ex):
+                self.response_for_bp.reset_mock()
+                self.assertIsInstance(views.calculate_product_discounts(
+                    None, self.settings_portal, {'event_token': 'token'},
+                    self.failed(ex), mock.Mock()), HttpResponse)
+                self.response_for_bp.assert_called_once()
+
+    def test_pending_rules_are_cancelled(self):
+        rules = {'partner': self.failed(PBx24RequestError('timed out')),
+                 'discount_product': Future()}
+        with mock.patch.object(views, 'fill_nomenclatures_groups',
+                               return_value={1: 100}), \
+                mock.patch.object(views, 'create_company',
+                                  return_value=mock.Mock()), \
+                mock.patch.object(views, 'fetch_rules', return_value=rules):
+            self.assertIsNone(views.calculate_products(
+                None, self.settings_portal, {'event_token': 'token'},
+                mock.Mock(), 1, mock.Mock()))
+        self.response_for_bp.assert_called_once()
+        self.assertTrue(rules['discount_product'].cancelled())
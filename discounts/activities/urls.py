@@ -1,6 +1,6 @@
 from django.urls import path
 
-from . import views
+from . import async_views, views
 
 app_name = 'activities'
 
@@ -12,4 +12,14 @@ urlpatterns = [
     path('discounts_get_from_db/', views.get_from_db, name='get_from_db'),
     path('check-company-inn/', views.check_company_inn,
          name='check-company-inn'),
+    path('jobs/status/', views.jobs_status, name='jobs_status'),
+    # Асинхронные обработчики для запуска под ASGI
+    path('async/discounts_send_to_db/', async_views.send_to_db,
+         name='async_send_to_db'),
+    path('async/discounts_calculation/', async_views.calculation,
+         name='async_calculation'),
+    path('async/discounts_get_from_db/', async_views.get_from_db,
+         name='async_get_from_db'),
+    path('async/check-company-inn/', async_views.check_company_inn,
+         name='async_check-company-inn'),
 ]
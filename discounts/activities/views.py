@@ -1,28 +1,57 @@
 import decimal
 import json
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor
 from http import HTTPStatus
 from logging.handlers import RotatingFileHandler
 
 from activities.discount import (AccumulativeDiscount, InvoiceDiscount,
                                  PartnerDiscount)
-from core.bitrix24.bitrix24 import (ActivityB24, CompanyB24, DealB24,
-                                    ProductB24, QuoteB24, SmartProcessB24,
-                                    ProductRowB24, RequisiteB24)
+from core.bitrix24.bitrix24 import ActivityB24, DealB24, QuoteB24
+from core.bitrix24.client import get_client
+from core.locks import LockTimeoutError, named_lock
 from core.models import Portals
+from django.contrib.admin.views.decorators import staff_member_required
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.serializers.json import DjangoJSONEncoder
-from django.db import IntegrityError
+from django.db import IntegrityError, connections
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
-from pybitrix24 import Bitrix24
+from replicas.catalog import get_products_nomenclature_groups
+from replicas.companies import get_company
+from replicas.models import Company
+from replicas.nomenclature_groups import get_nomenclature_groups_activity
+from replicas.requisites import find_companies_by_inn
+from replicas.smart_processes import get_product_discounts, get_rules
+from settings.cache import get_portal_settings
 from settings.models import SettingsPortal
 from volumes.models import Volume
 
+from . import coalescing
+from .jobs import enqueue, get_queue_metrics, is_job_owned
 from .messages import MESSAGES_FOR_BP, MESSAGES_FOR_LOG
 from .models import Activity
 
+# Поля, которые приложение добавляет к товарным позициям для расчета
+PRODUCT_ROW_INTERNAL_FIELDS = ('nomenclature_group_id',)
+# Поля, производные от цены и скидки: у измененных позиций их пересчитывает
+# Битрикс24
+PRODUCT_ROW_DERIVED_FIELDS = (
+    'PRICE_EXCLUSIVE', 'PRICE_NETTO', 'PRICE_ACCOUNT', 'DISCOUNT_SUM',
+)
+# Число попыток фонового выполнения. Расчет можно повторить, повтор
+# передачи объемов мог бы повторно добавить объем к накоплениям компании
+CALCULATION_ATTEMPTS = 3
+SEND_TO_DB_ATTEMPTS = 1
+# Сколько секунд ждать завершения другого расчета того же объекта
+CALCULATION_LOCK_TIMEOUT = 60
+LOG_PATH = '/home/bitrix/ext_www/skidkipril.plazma-t.ru/logs/{}.log'
+# Потоки загрузки правил скидок, общие для всех запросов процесса
+RULES_WORKERS = 8
+rules_executor = ThreadPoolExecutor(max_workers=RULES_WORKERS,
+                                    thread_name_prefix='rules')
+
 
 @csrf_exempt
 def install(request):
@@ -65,105 +94,52 @@ def uninstall(request):
     return JsonResponse({'result': result})
 
 
+@staff_member_required
+def jobs_status(request):
+    """Служебная страница состояния очереди фоновых заданий по порталам."""
+    return JsonResponse({'portals': get_queue_metrics()})
+
+
 @csrf_exempt
 def send_to_db(request):
     """View-функция для работы активити 'Передача объемов в БД'."""
-    # Установки логирования
-    logger_send = logging.getLogger('send_to_db')
-    logger_send.setLevel(logging.DEBUG)
-    if not logger_send.hasHandlers():
-        handler = RotatingFileHandler(
-            '/home/bitrix/ext_www/skidkipril.plazma-t.ru/logs/send_to_db.log',
-            maxBytes=5000000,
-            backupCount=5
-        )
-        formatter = logging.Formatter(
-            "%(asctime)s [%(levelname)s] %(message)s")
-        handler.setFormatter(formatter)
-        logger_send.addHandler(handler)
+    logger_send = get_logger('send_to_db', logging.DEBUG)
     # Запуск приложения
     initial_data = start_app(request, logger_send)
     # Создаем портал
     portal, settings_portal = create_portal(initial_data, logger_send)
+    if settings_portal.run_in_background:
+        job = enqueue(portal, 'send_to_db', initial_data, SEND_TO_DB_ATTEMPTS)
+        logger_send.info(MESSAGES_FOR_LOG['job_enqueued'].format(job.pk))
+        return HttpResponse(status=200)
+    run_send_to_db(portal, settings_portal, initial_data)
+    return HttpResponse(status=200)
+
+
+def run_send_to_db(portal: Portals, settings_portal: SettingsPortal,
+                   initial_data: dict[str, any]) -> None:
+    """Функция выполнения активити 'Передача объемов в БД'."""
+    logger_send = get_logger('send_to_db', logging.DEBUG)
     # Проверяем начальные данные
-    obj_id, company_id = check_initial_data(portal, initial_data, logger_send)
+    ids = check_initial_data(portal, initial_data, logger_send)
+    if isinstance(ids, HttpResponse):
+        return
+    obj_id, company_id = ids
     # Получаем все продукты сделки или предложения
     obj = create_obj_and_get_all_products(portal, obj_id, initial_data,
                                           logger_send)
-    company = CompanyB24(portal, company_id)
-    inn = company.get_inn()
-    # Сформируем словарь номенклатурных групп
-    nomenclatures_groups = (fill_nomenclatures_groups(
-        portal, settings_portal, initial_data, obj, logger_send, 'send'))
-
-    accumulative_discounts: AccumulativeDiscount = AccumulativeDiscount(
-        settings_portal.code_nomenclature_group_accumulative,
-        settings_portal.code_upper_one_accumulative,
-        settings_portal.code_discount_upper_one_accumulative,
-        settings_portal.code_upper_two_accumulative,
-        settings_portal.code_discount_upper_two_accumulative,
-        settings_portal.code_upper_three_accumulative,
-        settings_portal.code_discount_upper_three_accumulative,
-        settings_portal.code_accumulative_uni_list_is_active,
-        settings_portal.accumulative_is_active_yes,
-        [],
-        nomenclatures_groups,
-        {},
-        company_id,
-        portal
-    )
-    accumulative_discounts.check_is_active_nomenclature_group(
-        settings_portal.id_uni_list_nomenclature_groups
-    )
-    logger_send.info('{}{}'.format(
-        MESSAGES_FOR_LOG['get_active_nomenclature_groups'],
-        json.dumps(accumulative_discounts.nomenclature_groups_active, indent=2,
-                   ensure_ascii=False, cls=DjangoJSONEncoder)))
-    prod_sum = sum(accumulative_discounts.nomenclature_groups_active.values())
-    try:
-        volume, created = Volume.objects.get_or_create(
-            company_id=company_id, portal=portal,
-            defaults={
-                'volume': prod_sum,
-                'inn': inn
-            }
-        )
-        if not created:
-            volume.volume += prod_sum
-            volume.save()
-    except IntegrityError:
-        logger_send.info(MESSAGES_FOR_LOG['wrong_inn'].format(inn))
-        logger_send.info(MESSAGES_FOR_LOG['stop_app'])
-        response_for_bp(portal, initial_data['event_token'],
-                        MESSAGES_FOR_BP['wrong_inn'],
-                        return_values={'result': 'wrong_inn',
-                                       'errors': 'Ошибка в ИНН компании'})
-        return HttpResponse(status=200)
-
-    logger_send.info(MESSAGES_FOR_LOG['send_data_to_db_ok'])
-    logger_send.info(MESSAGES_FOR_LOG['stop_app'])
-    response_for_bp(portal, initial_data['event_token'],
-                    MESSAGES_FOR_BP['send_data_to_db_ok'],
-                    return_values={'result': str(prod_sum)})
-    return HttpResponse(status=200)
+    if isinstance(obj, HttpResponse):
+        return
+    result = add_volume(portal, settings_portal, initial_data, obj,
+                        company_id, logger_send)
+    if result:
+        response_for_bp(portal, initial_data['event_token'], *result)
 
 
 @csrf_exempt
 def get_from_db(request):
     """View-функция для работы активити 'Получение объемов из БД'."""
-    # Установки логирования
-    logger_get = logging.getLogger('get_from_db')
-    logger_get.setLevel(logging.DEBUG)
-    if not logger_get.hasHandlers():
-        handler = RotatingFileHandler(
-            '/home/bitrix/ext_www/skidkipril.plazma-t.ru/logs/get_from_db.log',
-            maxBytes=5000000,
-            backupCount=5
-        )
-        formatter = logging.Formatter(
-            "%(asctime)s [%(levelname)s] %(message)s")
-        handler.setFormatter(formatter)
-        logger_get.addHandler(handler)
+    logger_get = get_logger('get_from_db', logging.DEBUG)
     # Получения начальных значений
     initial_data = start_app(request, logger_get)
     # Создаем портал
@@ -171,24 +147,8 @@ def get_from_db(request):
     # Проверяем начальные данные
     obj_id, company_id = check_initial_data(portal, initial_data, logger_get)
     # Запрос в БД на получение накопленного объема
-    try:
-        volume = Volume.objects.get(company_id=company_id, portal=portal)
-        logger_get.info(MESSAGES_FOR_LOG['get_volumes'].format(
-            str(volume.volume), company_id))
-        response_for_bp(
-            portal,
-            initial_data['event_token'],
-            MESSAGES_FOR_BP['get_from_db_ok'],
-            return_values={'volume': str(volume.volume), 'result': 'ok'}
-        )
-    except ObjectDoesNotExist:
-        logger_get.info(MESSAGES_FOR_LOG['volumes_no_db'].format(company_id))
-        logger_get.info(MESSAGES_FOR_LOG['stop_app'])
-        response_for_bp(portal, initial_data['event_token'],
-                        MESSAGES_FOR_BP['volume_no_db'],
-                        return_values={'result': 'no_data'})
-        return HttpResponse(status=200)
-    logger_get.info(MESSAGES_FOR_LOG['stop_app'])
+    response_for_bp(portal, initial_data['event_token'],
+                    *get_volume(portal, company_id, logger_get))
     return HttpResponse(status=200)
 
 
@@ -204,146 +164,363 @@ def check_company_inn(request):
         'company_inn': request.POST.get('properties[company_inn]'),
     }
     try:
-        portal: Portals = Portals.objects.get(
-            member_id=initial_data['member_id'])
+        portal, settings_portal = get_portal_settings(
+            initial_data['member_id'])
         portal.check_auth()
     except ObjectDoesNotExist:
         return HttpResponse(status=200)
-    try:
-        int(initial_data.get('company_inn'))
-    except ValueError:
-        response_for_bp(portal, initial_data['event_token'],
-                        'Ошибка в работе активити',
-                        return_values={
-                            'result': 'error',
-                            'errors': 'Поле company_inn содержит запрещенные '
-                                      'символы. Можно использовать только 0-9.'
-                        })
-        return HttpResponse(status=200)
-    try:
-        requisite = RequisiteB24(portal, 0)
-        filter_val = {
-            'RQ_INN': initial_data.get('company_inn')
-        }
-        result = requisite.list(filter_val)
-    except RuntimeError as ex:
-        response_for_bp(portal, initial_data['event_token'],
-                        'Ошибка в работе активити',
-                        return_values={
-                            'result': 'error',
-                            'errors': f'error: {ex.args[0]}, error '
-                                      f'description: {ex.args[1]}'
-                        })
-        return HttpResponse(status=200)
-
-    if not result:
-        response_for_bp(portal, initial_data['event_token'],
-                        'Компания с данным ИНН не найдена',
-                        return_values={'result': 'not_found'})
-        return HttpResponse(status=200)
     response_for_bp(portal, initial_data['event_token'],
-                    'Компания с данным ИНН найдена',
-                    return_values={
-                        'result': 'found',
-                        'ids_companies': [item.get('ENTITY_ID') for item in
-                                          result]
-                    })
+                    *check_inn(portal, settings_portal,
+                               initial_data.get('company_inn')))
     return HttpResponse(status=200)
 
 
 @csrf_exempt
 def calculation(request):
     """View-функция для работы активити 'Расчет скидок'."""
-    # Установки логирования
-    logger_calc = logging.getLogger('calculation')
-    logger_calc.setLevel(logging.INFO)
-    if not logger_calc.hasHandlers():
-        handler = RotatingFileHandler(
-            '/home/bitrix/ext_www/skidkipril.plazma-t.ru/logs/calculation.log',
-            maxBytes=5000000,
-            backupCount=5
-        )
-        formatter = logging.Formatter(
-            "%(asctime)s [%(levelname)s] %(message)s")
-        handler.setFormatter(formatter)
-        logger_calc.addHandler(handler)
+    logger_calc = get_logger('calculation', logging.INFO)
     # Запуск приложения
     initial_data = start_app(request, logger_calc)
     # Создаем портал
     portal, settings_portal = create_portal(initial_data, logger_calc)
+    if settings_portal.run_in_background:
+        job = enqueue(portal, 'calculation', initial_data,
+                      CALCULATION_ATTEMPTS)
+        logger_calc.info(MESSAGES_FOR_LOG['job_enqueued'].format(job.pk))
+        return HttpResponse(status=200)
+    run_calculation(portal, settings_portal, initial_data)
+    return HttpResponse(status=200)
+
+
+def run_calculation(portal: Portals, settings_portal: SettingsPortal,
+                    initial_data: dict[str, any]) -> None:
+    """Функция выполнения активити 'Расчет скидок'."""
+    logger_calc = get_logger('calculation', logging.INFO)
     # Проверяем начальные данные
-    obj_id, company_id = check_initial_data(portal, initial_data, logger_calc)
+    ids = check_initial_data(portal, initial_data, logger_calc)
+    if isinstance(ids, HttpResponse):
+        return
+    obj_id, company_id = ids
+    # Повторный запрос по тому же объекту ждет выполняемый расчет
+    entry, leader = coalescing.acquire(
+        get_calculation_key(portal, initial_data, obj_id, company_id),
+        initial_data['event_token'])
+    if not leader:
+        logger_calc.info(MESSAGES_FOR_LOG['calculation_coalesced'].format(
+            obj_id))
+        response = coalescing.wait_response(entry)
+        if response:
+            response_for_bp(portal, initial_data['event_token'], *response)
+            logger_calc.info(MESSAGES_FOR_LOG['stop_app'])
+            return
+    try:
+        # Расчеты одного объекта в разных процессах выполняются по очереди
+        with named_lock('calculation', portal.member_id,
+                        initial_data['document_type'], obj_id,
+                        timeout=CALCULATION_LOCK_TIMEOUT):
+            calculate_obj(portal, settings_portal, initial_data, obj_id,
+                          company_id, logger_calc)
+    except LockTimeoutError as ex:
+        logger_calc.error(MESSAGES_FOR_LOG['lock_timeout'].format(ex))
+        logger_calc.info(MESSAGES_FOR_LOG['stop_app'])
+        response_for_bp(portal, initial_data['event_token'],
+                        MESSAGES_FOR_BP['lock_timeout'])
+    finally:
+        if leader:
+            coalescing.release(entry)
+
+
+def get_calculation_key(portal: Portals, initial_data: dict[str, any],
+                        obj_id: int, company_id: int) -> tuple:
+    """Ключ расчета для объединения повторных запросов."""
+    return (portal.member_id, initial_data['document_type'], obj_id,
+            company_id)
+
+
+def calculate_obj(portal: Portals, settings_portal: SettingsPortal,
+                  initial_data: dict[str, any], obj_id: int, company_id: int,
+                  logger_calc) -> None:
+    """Функция расчета скидок и записи товаров сделки или предложения."""
     # Получаем все продукты сделки
     obj = create_obj_and_get_all_products(portal, obj_id, initial_data,
                                           logger_calc)
+    if isinstance(obj, HttpResponse):
+        return
+    changed_products = calculate_products(portal, settings_portal,
+                                          initial_data, obj, company_id,
+                                          logger_calc)
+    if changed_products is None:
+        return
+    # Если цены не изменились, товары в сделку не передаем
+    if not changed_products:
+        logger_calc.info(MESSAGES_FOR_LOG['products_not_changed'])
+        response_for_bp(portal, initial_data['event_token'],
+                        MESSAGES_FOR_BP['calculation_not_changed'])
+        logger_calc.info(MESSAGES_FOR_LOG['stop_block'])
+        logger_calc.info(MESSAGES_FOR_LOG['stop_app'])
+        return
+    logger_calc.info(MESSAGES_FOR_LOG['products_changed'].format(
+        ', '.join(str(product_id) for product_id in changed_products)))
+    if not update_products_deal(portal, initial_data, obj, changed_products,
+                                logger_calc):
+        return
+
+    logger_calc.info(json.dumps(obj.products, indent=2, ensure_ascii=False))
+
+    # Возвращаем результат
+    response_for_bp(portal, initial_data['event_token'],
+                    MESSAGES_FOR_BP['calculation_ok'])
+    logger_calc.info(MESSAGES_FOR_LOG['stop_block'])
+    logger_calc.info(MESSAGES_FOR_LOG['stop_app'])
+
+
+def get_logger(name: str, level: int) -> logging.Logger:
+    """Функция получения логгера активити с записью в файл."""
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    if not logger.hasHandlers():
+        handler = RotatingFileHandler(
+            LOG_PATH.format(name),
+            maxBytes=5000000,
+            backupCount=5
+        )
+        formatter = logging.Formatter(
+            "%(asctime)s [%(levelname)s] %(message)s")
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    return logger
+
+
+def add_volume(
+        portal: Portals, settings_portal: SettingsPortal,
+        initial_data: dict[str, str or int], obj: DealB24 or QuoteB24,
+        company_id: int, logger) -> tuple[str, dict[str, str]] or None:
+    """Функция добавления суммы товаров к накопленному объему компании.
+
+    Возвращает сообщение и значения для ответа в БП или None, если ответ
+    в БП уже отправлен.
+    """
+    inn = get_company(portal, settings_portal, company_id).inn
+    # Сформируем словарь номенклатурных групп
+    nomenclatures_groups = (fill_nomenclatures_groups(
+        portal, settings_portal, initial_data, obj, logger, 'send'))
+    if isinstance(nomenclatures_groups, HttpResponse):
+        return None
+
+    accumulative_discounts: AccumulativeDiscount = AccumulativeDiscount(
+        settings_portal.code_nomenclature_group_accumulative,
+        settings_portal.code_upper_one_accumulative,
+        settings_portal.code_discount_upper_one_accumulative,
+        settings_portal.code_upper_two_accumulative,
+        settings_portal.code_discount_upper_two_accumulative,
+        settings_portal.code_upper_three_accumulative,
+        settings_portal.code_discount_upper_three_accumulative,
+        [],
+        nomenclatures_groups,
+        {},
+        company_id,
+        portal
+    )
+    accumulative_discounts.check_is_active_nomenclature_group(
+        get_nomenclature_groups_activity(portal, settings_portal,
+                                         nomenclatures_groups))
+    logger.info('{}{}'.format(
+        MESSAGES_FOR_LOG['get_active_nomenclature_groups'],
+        json.dumps(accumulative_discounts.nomenclature_groups_active, indent=2,
+                   ensure_ascii=False, cls=DjangoJSONEncoder)))
+    prod_sum = sum(accumulative_discounts.nomenclature_groups_active.values())
+    try:
+        Volume.add(portal, company_id, prod_sum, inn)
+    except IntegrityError:
+        logger.info(MESSAGES_FOR_LOG['wrong_inn'].format(inn))
+        logger.info(MESSAGES_FOR_LOG['stop_app'])
+        return MESSAGES_FOR_BP['wrong_inn'], {
+            'result': 'wrong_inn', 'errors': 'Ошибка в ИНН компании'}
+
+    logger.info(MESSAGES_FOR_LOG['send_data_to_db_ok'])
+    logger.info(MESSAGES_FOR_LOG['stop_app'])
+    return MESSAGES_FOR_BP['send_data_to_db_ok'], {'result': str(prod_sum)}
+
+
+def get_volume(portal: Portals, company_id: int,
+               logger) -> tuple[str, dict[str, str]]:
+    """Функция получения накопленного объема компании из БД.
+
+    Возвращает сообщение и значения для ответа в БП.
+    """
+    try:
+        volume = Volume.objects.get(company_id=company_id, portal=portal)
+    except ObjectDoesNotExist:
+        logger.info(MESSAGES_FOR_LOG['volumes_no_db'].format(company_id))
+        logger.info(MESSAGES_FOR_LOG['stop_app'])
+        return MESSAGES_FOR_BP['volume_no_db'], {'result': 'no_data'}
+    total = volume.get_total()
+    logger.info(MESSAGES_FOR_LOG['get_volumes'].format(str(total), company_id))
+    logger.info(MESSAGES_FOR_LOG['stop_app'])
+    return MESSAGES_FOR_BP['get_from_db_ok'], {
+        'volume': str(total), 'result': 'ok'}
+
+
+def check_inn(portal: Portals, settings_portal: SettingsPortal,
+              company_inn: str) -> tuple[str, dict[str, any]]:
+    """Функция поиска компаний по ИНН.
+
+    Возвращает сообщение и значения для ответа в БП.
+    """
+    try:
+        int(company_inn)
+    except ValueError:
+        return 'Ошибка в работе активити', {
+            'result': 'error',
+            'errors': 'Поле company_inn содержит запрещенные '
+                      'символы. Можно использовать только 0-9.'
+        }
+    try:
+        result = find_companies_by_inn(portal, settings_portal, company_inn)
+    except RuntimeError as ex:
+        return 'Ошибка в работе активити', {
+            'result': 'error',
+            'errors': f'error: {ex.args[0]}, error '
+                      f'description: {ex.args[1]}'
+        }
+    if not result:
+        return 'Компания с данным ИНН не найдена', {'result': 'not_found'}
+    return 'Компания с данным ИНН найдена', {
+        'result': 'found',
+        'ids_companies': result
+    }
+
+
+def calculate_products(
+        portal: Portals, settings_portal: SettingsPortal,
+        initial_data: dict[str, str or int], obj: DealB24 or QuoteB24,
+        company_id: int, logger) -> list[str] or None:
+    """Функция расчета скидок и цен товаров сделки или предложения.
+
+    Цены и скидки записываются в obj.products. Возвращает ID измененных
+    товарных позиций или None, если расчет прерван и ответ в БП уже
+    отправлен.
+    """
     # Сформируем словарь номенклатурных групп
     nomenclatures_groups = (fill_nomenclatures_groups(
-        portal, settings_portal, initial_data, obj, logger_calc))
+        portal, settings_portal, initial_data, obj, logger))
+    if isinstance(nomenclatures_groups, HttpResponse):
+        return None
     # Создаем компанию и получаем ее тип
-    company: CompanyB24 = create_company(portal, company_id, initial_data,
-                                         logger_calc)
+    company: Company = create_company(portal, settings_portal, company_id,
+                                      initial_data, logger)
     if not company:
-        return HttpResponse(status=200)
+        return None
+    # Правила активных блоков скидок загружаются параллельно
+    rules = fetch_rules(portal, settings_portal, obj, company)
+    try:
+        return calculate_discounts(portal, settings_portal, initial_data, obj,
+                                   nomenclatures_groups, company, rules,
+                                   logger)
+    finally:
+        # Если расчет прерван, незапущенные загрузки правил не нужны
+        for future in rules.values():
+            future.cancel()
+
+
+def calculate_discounts(
+        portal: Portals, settings_portal: SettingsPortal,
+        initial_data: dict[str, str or int], obj: DealB24 or QuoteB24,
+        nomenclatures_groups: dict[int, decimal.Decimal], company: Company,
+        rules: dict[str, Future], logger) -> list[str] or None:
+    """Функция расчета скидок по блокам и применения их к товарам.
+
+    Возвращает ID измененных товарных позиций или None, если расчет прерван
+    и ответ в БП уже отправлен.
+    """
+    # Активность номенклатурных групп для разовой и накопительной скидок
+    groups_activity: dict[int, dict[str, bool]] = dict()
+    if (settings_portal.is_active_sum_invoice
+            or settings_portal.is_active_accumulative):
+        groups_activity = get_nomenclature_groups_activity(
+            portal, settings_portal, nomenclatures_groups)
     # Основной словарь скидок по номенклатуре
     discounts: dict[str, int] = dict()
-    logger_calc.info(MESSAGES_FOR_LOG['stop_block'])
+    logger.info(MESSAGES_FOR_LOG['stop_block'])
     # #######################Скидки для Партнеров#############################
-    logger_calc.info('{} {}'.format(MESSAGES_FOR_LOG['start_block'],
-                                    'Скидки для партнеров'))
+    logger.info('{} {}'.format(MESSAGES_FOR_LOG['start_block'],
+                               'Скидки для партнеров'))
     if settings_portal.is_active_partner:
-        calculate_partner_discounts(portal, settings_portal, initial_data,
-                                    nomenclatures_groups, discounts, company,
-                                    logger_calc)
-        logger_calc.info('{}{}'.format(
+        if calculate_partner_discounts(portal, settings_portal, initial_data,
+                                       rules['partner'], nomenclatures_groups,
+                                       discounts, company, logger):
+            return None
+        logger.info('{}{}'.format(
             MESSAGES_FOR_LOG['discounts_partner'],
             json.dumps(discounts, indent=2, ensure_ascii=False)))
     else:
-        logger_calc.info(MESSAGES_FOR_LOG['partner_off'])
-    logger_calc.info(MESSAGES_FOR_LOG['stop_block'])
+        logger.info(MESSAGES_FOR_LOG['partner_off'])
+    logger.info(MESSAGES_FOR_LOG['stop_block'])
     # #######################Разовая от суммы счета############################
-    logger_calc.info('{} {}'.format(MESSAGES_FOR_LOG['start_block'],
-                                    'Разовая от суммы счета'))
+    logger.info('{} {}'.format(MESSAGES_FOR_LOG['start_block'],
+                               'Разовая от суммы счета'))
     if settings_portal.is_active_sum_invoice:
-        calculate_sum_invoice_discounts(portal, settings_portal, initial_data,
-                                        nomenclatures_groups, discounts,
-                                        logger_calc)
-        logger_calc.info('{}{}'.format(
+        if calculate_sum_invoice_discounts(
+                portal, settings_portal, initial_data, rules['sum_invoice'],
+                nomenclatures_groups, groups_activity, discounts, logger):
+            return None
+        logger.info('{}{}'.format(
             MESSAGES_FOR_LOG['discounts_sum_invoice'],
             json.dumps(discounts, indent=2, ensure_ascii=False)))
     else:
-        logger_calc.info(MESSAGES_FOR_LOG['sum_invoice_off'])
-    logger_calc.info(MESSAGES_FOR_LOG['stop_block'])
+        logger.info(MESSAGES_FOR_LOG['sum_invoice_off'])
+    logger.info(MESSAGES_FOR_LOG['stop_block'])
     # #######################Накопительная#############################
-    logger_calc.info('{} {}'.format(MESSAGES_FOR_LOG['start_block'],
-                                    'Накопительная скидка'))
+    logger.info('{} {}'.format(MESSAGES_FOR_LOG['start_block'],
+                               'Накопительная скидка'))
     if settings_portal.is_active_accumulative:
-        calculate_accumulative_discounts(portal, settings_portal, initial_data,
-                                         nomenclatures_groups, discounts,
-                                         company, logger_calc)
-        logger_calc.info('{}{}'.format(
+        if calculate_accumulative_discounts(
+                portal, settings_portal, initial_data, rules['accumulative'],
+                nomenclatures_groups, groups_activity, discounts, company,
+                logger):
+            return None
+        logger.info('{}{}'.format(
             MESSAGES_FOR_LOG['discounts_accumulative'],
             json.dumps(discounts, indent=2, ensure_ascii=False)))
     else:
-        logger_calc.info(MESSAGES_FOR_LOG['accumulative_off'])
-    logger_calc.info(MESSAGES_FOR_LOG['stop_block'])
+        logger.info(MESSAGES_FOR_LOG['accumulative_off'])
+    logger.info(MESSAGES_FOR_LOG['stop_block'])
     # #######################Скидки на товар#############################
-    logger_calc.info('{} {}'.format(MESSAGES_FOR_LOG['start_block'],
-                                    'Скидки на конкретный товар'))
+    logger.info('{} {}'.format(MESSAGES_FOR_LOG['start_block'],
+                               'Скидки на конкретный товар'))
     all_discounts_products = {}
     if settings_portal.is_active_discount_product:
         all_discounts_products = calculate_product_discounts(
-            portal, settings_portal, initial_data, company, logger_calc)
+            portal, settings_portal, initial_data, rules['discount_product'],
+            logger)
+        if isinstance(all_discounts_products, HttpResponse):
+            return None
     else:
-        logger_calc.info(MESSAGES_FOR_LOG['discount_product_off'])
-    logger_calc.info(MESSAGES_FOR_LOG['stop_block'])
+        logger.info(MESSAGES_FOR_LOG['discount_product_off'])
+    logger.info(MESSAGES_FOR_LOG['stop_block'])
     # #######################Применяем скидки#############################
-    logger_calc.info('{} {}'.format(MESSAGES_FOR_LOG['start_block'],
-                                    'Применение скидок'))
+    logger.info('{} {}'.format(MESSAGES_FOR_LOG['start_block'],
+                               'Применение скидок'))
+    return apply_discounts(settings_portal, obj, discounts,
+                           all_discounts_products, logger)
+
+
+def apply_discounts(
+        settings_portal: SettingsPortal, obj: DealB24 or QuoteB24,
+        discounts: dict[str, int], all_discounts_products: dict[int, int],
+        logger) -> list[str]:
+    """Функция применения скидок к товарам сделки или предложения.
+
+    Возвращает ID товарных позиций, у которых изменилась цена или скидка.
+    """
+    changed_products = []
     for product in obj.products:
         nomenclature_group_id = product['nomenclature_group_id']
         # price_acc = decimal.Decimal(product['PRICE_ACCOUNT'])
         price_brutto = decimal.Decimal(product['PRICE_BRUTTO'])
         product_id = product['PRODUCT_ID']
+        old_values = (decimal.Decimal(str(product['PRICE'])),
+                      decimal.Decimal(str(product['DISCOUNT_RATE'])))
 
         # Применяем скидки по номенклатурным группам
         if nomenclature_group_id in discounts:
@@ -351,7 +528,7 @@ def calculation(request):
             product['DISCOUNT_RATE'] = discount_rate
             price = price_brutto * (100 - discount_rate) / 100
             product['PRICE'] = str(round(price))
-            logger_calc.info(MESSAGES_FOR_LOG['discount_ok_product'].format(
+            logger.info(MESSAGES_FOR_LOG['discount_ok_product'].format(
                 product_id, discount_rate
             ))
         else:
@@ -359,39 +536,41 @@ def calculation(request):
             product['PRICE'] = str(round(price_brutto))
         # Применяем скидки на конкретный товар
         if settings_portal.is_active_discount_product:
-            if product_id not in all_discounts_products:
-                logger_calc.info(
+            if int(product_id) in all_discounts_products:
+                discount_rate = all_discounts_products[int(product_id)]
+                product['DISCOUNT_RATE'] = discount_rate
+                price = price_brutto * (100 - discount_rate) / 100
+                product['PRICE'] = str(round(price))
+                logger.info(
+                    MESSAGES_FOR_LOG['discount_ok_product'].format(
+                        product_id, discount_rate
+                    ))
+            else:
+                logger.info(
                     MESSAGES_FOR_LOG['no_discount_one_product'].format(
                         product_id
                     ))
-                continue
-            discount_rate = all_discounts_products[product_id]
-            product['DISCOUNT_RATE'] = discount_rate
-            price = price_brutto * (100 - discount_rate) / 100
-            product['PRICE'] = str(round(price))
-            logger_calc.info(MESSAGES_FOR_LOG['discount_ok_product'].format(
-                product_id, discount_rate
-            ))
-    logger_calc.info('{}{}'.format(
+        if old_values != (decimal.Decimal(product['PRICE']),
+                          decimal.Decimal(str(product['DISCOUNT_RATE']))):
+            changed_products.append(product['ID'])
+    logger.info('{}{}'.format(
         MESSAGES_FOR_LOG['all_products_send_bp'],
         json.dumps(obj.products, indent=2, ensure_ascii=False)))
-
-    update_products_deal(portal, initial_data, obj.products, logger_calc)
-
-    logger_calc.info(json.dumps(obj.products, indent=2, ensure_ascii=False))
-
-    # Возвращаем результат
-    response_for_bp(portal, initial_data['event_token'],
-                    MESSAGES_FOR_BP['calculation_ok'])
-    logger_calc.info(MESSAGES_FOR_LOG['stop_block'])
-    logger_calc.info(MESSAGES_FOR_LOG['stop_app'])
-    return HttpResponse(status=200)
+    return changed_products
 
 
 def response_for_bp(portal, event_token, log_message, return_values=None):
-    """Метод отправки параметров ответа в БП."""
-    bx24 = Bitrix24(portal.name)
-    bx24._access_token = portal.auth_id
+    """Метод отправки параметров ответа в БП.
+
+    Фоновое задание, переданное другому обработчику, ответ не отправляет:
+    ответит обработчик, выполняющий задание.
+    """
+    if not is_job_owned():
+        get_logger('jobs', logging.INFO).warning(
+            MESSAGES_FOR_LOG['job_response_skipped'].format(event_token))
+        return
+    coalescing.record_response(event_token, log_message, return_values)
+    bx24 = get_client(portal)
     method_rest = 'bizproc.event.send'
     params = {
         'event_token': event_token,
@@ -423,10 +602,9 @@ def create_portal(initial_data: dict[str, any],
                   logger) -> tuple[Portals, SettingsPortal] or HttpResponse:
     """Функция создания портала."""
     try:
-        portal: Portals = Portals.objects.get(
-            member_id=initial_data['member_id'])
+        portal, settings_portal = get_portal_settings(
+            initial_data['member_id'])
         portal.check_auth()
-        settings_portal = SettingsPortal.objects.get(portal=portal)
         return portal, settings_portal
     except ObjectDoesNotExist:
         logger.error(MESSAGES_FOR_LOG['portal_not_found'].format(
@@ -462,9 +640,9 @@ def create_obj_and_get_all_products(
     """Функция создания сделки или предложения и получения всех товаров."""
     try:
         if initial_data['document_type'] == 'DEAL':
-            obj = DealB24(portal, obj_id)
+            obj = DealB24(portal, obj_id, select=['ASSIGNED_BY_ID'])
         else:
-            obj = QuoteB24(portal, obj_id)
+            obj = QuoteB24(portal, obj_id, select=['ASSIGNED_BY_ID'])
         obj.get_all_products()
         if obj.products:
             return obj
@@ -486,12 +664,12 @@ def create_obj_and_get_all_products(
         return HttpResponse(status=200)
 
 
-def create_company(portal: Portals, company_id: int,
-                   initial_data: dict[str, any],
-                   logger) -> CompanyB24 or bool:
-    """Функция создания компании."""
+def create_company(portal: Portals, settings_portal: SettingsPortal,
+                   company_id: int, initial_data: dict[str, any],
+                   logger) -> Company or bool:
+    """Функция получения типа и ИНН компании."""
     try:
-        return CompanyB24(portal, company_id)
+        return get_company(portal, settings_portal, company_id)
     except Exception:
         logger.error(MESSAGES_FOR_LOG['impossible_get_company_type'])
         logger.info(MESSAGES_FOR_LOG['stop_app'])
@@ -513,28 +691,34 @@ def fill_nomenclatures_groups(
                             'В сделке имеются товары не из каталога',
                             return_values={'errors': 'В сделке имеются товары '
                                                      'не из каталога'})
-        try:
-            prod: ProductB24 = ProductB24(portal, product["PRODUCT_ID"])
-        except RuntimeError:
+            return HttpResponse(status=200)
+    # Группы всех товаров получаем из копии каталога
+    products_groups, products_errors = get_products_nomenclature_groups(
+        portal, settings_portal,
+        {int(product['PRODUCT_ID']) for product in obj.products})
+    for product in obj.products:
+        nomenclature_group_id = products_groups.get(
+            int(product['PRODUCT_ID']))
+        if nomenclature_group_id is None:
             logger.error(
                 MESSAGES_FOR_LOG['impossible_get_product_props'].format(
-                    product['id']
+                    product['ID']
                 ))
+            if int(product['PRODUCT_ID']) in products_errors:
+                logger.error('{}: {}'.format(
+                    *products_errors[int(product['PRODUCT_ID'])]))
             logger.info(MESSAGES_FOR_LOG['stop_app'])
             response_for_bp(
                 portal, initial_data['event_token'],
                 MESSAGES_FOR_BP['impossible_get_product_props'].format(
-                    product['id']),
+                    product['ID']),
                 return_values={'errors': MESSAGES_FOR_BP[
-                    'impossible_get_product_props'].format(product['id'])}
+                    'impossible_get_product_props'].format(product['ID'])}
             )
             return HttpResponse(status=200)
-        if not prod.properties[settings_portal.code_nomenclature_group_id]:
-            product['nomenclature_group_id'] = 0
-            continue
-        nomenclature_group_id = int(prod.properties.get(
-            settings_portal.code_nomenclature_group_id).get('value'))
         product['nomenclature_group_id'] = nomenclature_group_id
+        if not nomenclature_group_id:
+            continue
         if func_name == 'calc':
             price = round(decimal.Decimal(product['PRICE_BRUTTO']), 2)
         else:
@@ -553,18 +737,74 @@ def fill_nomenclatures_groups(
     return nomenclatures_groups
 
 
+def fetch_rules(
+        portal: Portals, settings_portal: SettingsPortal,
+        obj: DealB24 or QuoteB24, company: Company) -> dict[str, Future]:
+    """Функция параллельной загрузки правил активных блоков скидок.
+
+    Загрузка каждого блока выполняется в общем пуле потоков и не зависит от
+    остальных. Возвращает словарь Future по коду блока, ошибки загрузки
+    возникают при получении результата.
+    """
+    tasks = {}
+    if settings_portal.is_active_partner:
+        tasks['partner'] = (get_rules, portal, settings_portal,
+                            settings_portal.id_smart_process_partner)
+    if settings_portal.is_active_sum_invoice:
+        tasks['sum_invoice'] = (get_rules, portal, settings_portal,
+                                settings_portal.id_smart_process_sum_invoice)
+    if settings_portal.is_active_accumulative:
+        tasks['accumulative'] = (
+            get_rules, portal, settings_portal,
+            settings_portal.id_smart_process_accumulative)
+    if settings_portal.is_active_discount_product:
+        tasks['discount_product'] = (
+            get_product_discounts, portal, settings_portal,
+            company.company_id,
+            {product['PRODUCT_ID'] for product in obj.products})
+    return {code: rules_executor.submit(run_in_thread, *task)
+            for code, task in tasks.items()}
+
+
+def run_in_thread(func, *args):
+    """Выполнить функцию в потоке пула и закрыть его соединения с БД."""
+    try:
+        return func(*args)
+    finally:
+        connections.close_all()
+
+
+def get_rules_result(rules: Future):
+    """Функция получения загруженных правил блока скидок.
+
+    Любая ошибка загрузки (REST API, БД) возбуждается как RuntimeError,
+    чтобы блок обработал ее как ошибку получения правил и ответил в БП.
+    """
+    try:
+        return rules.result()
+    except RuntimeError:
+        raise
+    except Exception as ex:
+        raise RuntimeError(type(ex).__name__, str(ex)) from ex
+
+
 def calculate_partner_discounts(
         portal: Portals, settings_portal: SettingsPortal,
-        initial_data: dict[str, str or int],
+        initial_data: dict[str, str or int], rules: Future,
         nomenclatures_groups: dict[int, decimal.Decimal],
-        discounts: dict[str, int], company: CompanyB24,
+        discounts: dict[str, int], company: Company,
         logger) -> None or HttpResponse:
     try:
-        smart_partner = SmartProcessB24(
-            portal,
-            settings_portal.id_smart_process_partner
+        partner_discounts = PartnerDiscount(
+            settings_portal.code_discount_smart_partner,
+            settings_portal.code_company_type_smart_partner,
+            settings_portal.code_nomenclature_group_id_smart_partner,
+            [element.fields for element in get_rules_result(rules)],
+            nomenclatures_groups,
+            discounts,
+            portal
         )
-        smart_partner_elements = smart_partner.get_all_elements()
+        partner_discounts.check_input_date()
     except RuntimeError:
         logger.error(MESSAGES_FOR_LOG['impossible_get_smart_partner'])
         logger.info(MESSAGES_FOR_LOG['stop_app'])
@@ -574,19 +814,10 @@ def calculate_partner_discounts(
         return HttpResponse(status=200)
     logger.debug('{}{}'.format(
         MESSAGES_FOR_LOG['get_elements_discounts_partners'],
-        json.dumps(smart_partner_elements, indent=2, ensure_ascii=False)
+        json.dumps(partner_discounts.smart_process_elements, indent=2,
+                   ensure_ascii=False)
     ))
-    partner_discounts = PartnerDiscount(
-        settings_portal.code_discount_smart_partner,
-        settings_portal.code_company_type_smart_partner,
-        settings_portal.code_nomenclature_group_id_smart_partner,
-        smart_partner_elements,
-        nomenclatures_groups,
-        discounts,
-        portal
-    )
-    partner_discounts.check_input_date()
-    partner_discounts.check_company_type(company.type)
+    partner_discounts.check_company_type(company.company_type)
     partner_discounts.calculate_discounts()
     partner_discounts.compare_discounts()
     return None
@@ -594,15 +825,19 @@ def calculate_partner_discounts(
 
 def calculate_sum_invoice_discounts(
         portal: Portals, settings_portal: SettingsPortal,
-        initial_data: dict[str, str or int],
+        initial_data: dict[str, str or int], rules: Future,
         nomenclatures_groups: dict[int, decimal.Decimal],
+        groups_activity: dict[int, dict[str, bool]],
         discounts: dict[str, int], logger) -> None or HttpResponse:
     try:
-        smart_sum_invoice = SmartProcessB24(
-            portal,
-            settings_portal.id_smart_process_sum_invoice
+        invoice_discounts: InvoiceDiscount = InvoiceDiscount(
+            settings_portal.code_discount_smart_sum_invoice,
+            [element.fields for element in get_rules_result(rules)],
+            nomenclatures_groups,
+            discounts,
+            portal
         )
-        smart_sum_invoice_elements = smart_sum_invoice.get_all_elements()
+        invoice_discounts.check_input_date()
     except RuntimeError:
         logger.error(MESSAGES_FOR_LOG['impossible_get_smart_sum_invoice'])
         logger.info(MESSAGES_FOR_LOG['stop_app'])
@@ -612,21 +847,9 @@ def calculate_sum_invoice_discounts(
         return HttpResponse(status=200)
     logger.debug('{}{}'.format(
         MESSAGES_FOR_LOG['get_elements_sum_invoice'],
-        json.dumps(smart_sum_invoice_elements, indent=2,
+        json.dumps(invoice_discounts.smart_process_elements, indent=2,
                    ensure_ascii=False)))
-    invoice_discounts: InvoiceDiscount = InvoiceDiscount(
-        settings_portal.code_discount_smart_sum_invoice,
-        settings_portal.code_sum_invoice_uni_list_is_active,
-        settings_portal.sum_invoice_is_active_yes,
-        smart_sum_invoice_elements,
-        nomenclatures_groups,
-        discounts,
-        portal
-    )
-    invoice_discounts.check_input_date()
-    invoice_discounts.check_is_active_nomenclature_group(
-        settings_portal.id_uni_list_nomenclature_groups
-    )
+    invoice_discounts.check_is_active_nomenclature_group(groups_activity)
     invoice_discounts.set_limits()
     invoice_discounts.calculate_discounts()
     invoice_discounts.compare_discounts()
@@ -635,16 +858,27 @@ def calculate_sum_invoice_discounts(
 
 def calculate_accumulative_discounts(
         portal: Portals, settings_portal: SettingsPortal,
-        initial_data: dict[str, str or int],
+        initial_data: dict[str, str or int], rules: Future,
         nomenclatures_groups: dict[int, decimal.Decimal],
-        discounts: dict[str, int], company: CompanyB24,
+        groups_activity: dict[int, dict[str, bool]],
+        discounts: dict[str, int], company: Company,
         logger) -> None or HttpResponse:
     try:
-        smart_accumulative = SmartProcessB24(
-            portal,
-            settings_portal.id_smart_process_accumulative
+        accumulative_discounts: AccumulativeDiscount = AccumulativeDiscount(
+            settings_portal.code_nomenclature_group_accumulative,
+            settings_portal.code_upper_one_accumulative,
+            settings_portal.code_discount_upper_one_accumulative,
+            settings_portal.code_upper_two_accumulative,
+            settings_portal.code_discount_upper_two_accumulative,
+            settings_portal.code_upper_three_accumulative,
+            settings_portal.code_discount_upper_three_accumulative,
+            [element.fields for element in get_rules_result(rules)],
+            nomenclatures_groups,
+            discounts,
+            company.company_id,
+            portal
         )
-        smart_accumulative_elements = smart_accumulative.get_all_elements()
+        accumulative_discounts.check_input_date()
     except RuntimeError:
         logger.error(MESSAGES_FOR_LOG['impossible_get_smart_accumulative'])
         logger.info(MESSAGES_FOR_LOG['stop_app'])
@@ -652,31 +886,12 @@ def calculate_accumulative_discounts(
             portal, initial_data['event_token'],
             MESSAGES_FOR_BP['impossible_get_smart_accumulative'])
         return HttpResponse(status=200)
-
-    accumulative_discounts: AccumulativeDiscount = AccumulativeDiscount(
-        settings_portal.code_nomenclature_group_accumulative,
-        settings_portal.code_upper_one_accumulative,
-        settings_portal.code_discount_upper_one_accumulative,
-        settings_portal.code_upper_two_accumulative,
-        settings_portal.code_discount_upper_two_accumulative,
-        settings_portal.code_upper_three_accumulative,
-        settings_portal.code_discount_upper_three_accumulative,
-        settings_portal.code_accumulative_uni_list_is_active,
-        settings_portal.accumulative_is_active_yes,
-        smart_accumulative_elements,
-        nomenclatures_groups,
-        discounts,
-        company.id,
-        portal
-    )
     logger.debug('{}{}'.format(
         MESSAGES_FOR_LOG['get_elements_accumulative'],
         json.dumps(accumulative_discounts.smart_process_elements, indent=2,
                    ensure_ascii=False)))
-    accumulative_discounts.check_input_date()
     accumulative_discounts.check_is_active_nomenclature_group(
-        settings_portal.id_uni_list_nomenclature_groups
-    )
+        groups_activity)
     accumulative_discounts.calculate_discounts()
     accumulative_discounts.compare_discounts()
     return None
@@ -684,12 +899,11 @@ def calculate_accumulative_discounts(
 
 def calculate_product_discounts(
         portal: Portals, settings_portal: SettingsPortal,
-        initial_data: dict[str, str or int], company: CompanyB24, logger):
+        initial_data: dict[str, str or int], rules: Future, logger):
     all_discounts_products = {}
     try:
-        discounts_product = SmartProcessB24(
-            portal, settings_portal.id_smart_process_discount_product)
-        elements = discounts_product.get_all_elements()
+        # Скидки на товары сделки для компании из индекса
+        all_discounts_products = get_rules_result(rules)
     except RuntimeError:
         logger.error(MESSAGES_FOR_LOG['impossible_get_smart_one_product'])
         logger.info(MESSAGES_FOR_LOG['stop_app'])
@@ -697,38 +911,6 @@ def calculate_product_discounts(
                         MESSAGES_FOR_BP[
                             'impossible_get_smart_one_product'])
         return HttpResponse(status=200)
-    logger.debug('{}{}'.format(
-        MESSAGES_FOR_LOG['get_elements_discounts_product'],
-        json.dumps(elements, indent=2, ensure_ascii=False)))
-    # Перебор всех элементов смарт процесса Скидки на товар
-    for element in elements:
-        # Проверяем входные данные элементов смарт процесса
-        if (not element[
-                settings_portal.code_discount_smart_discount_product]):
-            logger.error(
-                MESSAGES_FOR_LOG['wrong_input_data_smart'].format(
-                    element['title'], discounts_product.id
-                ))
-            continue
-        logger.info('{} {}'.format(
-            MESSAGES_FOR_LOG['algorithm_for_smart'],
-            element['title']
-        ))
-        # Проверяем id компании в элементе смарт процесса и сделке
-        smart_company_id = element['companyId']
-        # Проверяем совпадает ли id_company сделки и элемента
-        if smart_company_id != company.id:
-            logger.info(
-                MESSAGES_FOR_LOG['company_deal_not_company_smart'].format(
-                    smart_company_id, company.id
-                ))
-            continue
-        # Получаем все товары элемента смарт процесса
-        products = discounts_product.get_all_products(element['id'])
-        # Формируем словарь всех скидок на продукт
-        for product in products:
-            all_discounts_products[product['productId']] = element[
-                settings_portal.code_discount_smart_discount_product]
     logger.debug('{} {}'.format(
         MESSAGES_FOR_LOG['get_all_discounts_products'],
         json.dumps(all_discounts_products, indent=2,
@@ -738,24 +920,40 @@ def calculate_product_discounts(
 
 def update_products_deal(
         portal: Portals, initial_data: dict[str, str or int],
-        products: list[dict[str, any]], logger):
-    """Method for update products in deal."""
-    for product in products:
-        product_id = product.get('ID')
-        fields = {
-            'price': product.get('PRICE'),
-            'discountTypeId': product.get('DISCOUNT_TYPE_ID'),
-            'discountRate': product.get('DISCOUNT_RATE'),
-        }
+        obj: DealB24 or QuoteB24, changed_products: list[str],
+        logger) -> bool:
+    """Функция записи товаров в сделку или предложение.
 
-        try:
-            product_row = ProductRowB24(portal, product_id)
-            product_row.update(product_id, fields)
-        except RuntimeError:
-            logger.error(MESSAGES_FOR_LOG['impossible_send_to_deal'])
-            logger.info(MESSAGES_FOR_LOG['stop_app'])
-            response_for_bp(
-                portal, initial_data['event_token'],
-                MESSAGES_FOR_BP['impossible_send_to_deal'],
-            )
-            return HttpResponse(status=200)
+    Все товарные позиции записываются одним вызовом productrows.set, поэтому
+    объект либо обновляется целиком, либо не изменяется.
+    """
+    try:
+        obj.set_products(get_product_rows(obj, changed_products))
+    except RuntimeError:
+        logger.error(MESSAGES_FOR_LOG['impossible_send_to_deal'])
+        logger.info(MESSAGES_FOR_LOG['stop_app'])
+        response_for_bp(
+            portal, initial_data['event_token'],
+            MESSAGES_FOR_BP['impossible_send_to_deal'],
+        )
+        return False
+    return True
+
+
+def get_product_rows(obj: DealB24 or QuoteB24,
+                     changed_products: list[str]) -> list[dict[str, any]]:
+    """Функция формирования товарных позиций для productrows.set.
+
+    productrows.set заменяет все позиции, поэтому каждая передается такой,
+    какой была получена, с ID и всеми полями. У измененных позиций
+    отличаются только цена и скидка, а производные от них поля не
+    передаются, чтобы портал пересчитал их.
+    """
+    rows = []
+    for product in obj.products:
+        skipped = PRODUCT_ROW_INTERNAL_FIELDS
+        if product.get('ID') in changed_products:
+            skipped += PRODUCT_ROW_DERIVED_FIELDS
+        rows.append({field: value for field, value in product.items()
+                     if field not in skipped})
+    return rows
@@ -1,25 +1,160 @@
 from core.models import Portals
-from pybitrix24 import Bitrix24
+
+from .client import get_async_client, get_client
 
 
 class ObjB24:
     """Базовый класс объекта Битрикс24."""
     GET_PROPS_REST_METHOD: str = ''
+    LIST_PROPS_REST_METHOD: str = ''
+    BATCH_MAX_COMMANDS: int = 50
+    LIST_PAGE_SIZE: int = 50
 
-    def __init__(self, portal: Portals, id_obj: int):
+    def __init__(self, portal: Portals, id_obj: int, select=None):
         self.portal = portal
-        self.bx24 = Bitrix24(portal.name)
-        self.bx24._access_token = portal.auth_id
+        self.bx24 = get_client(portal)
         self.id = id_obj
-        if self.GET_PROPS_REST_METHOD and self.id:
-            self.properties = self._get_properties()
+        self.select = select
+        self._properties = None
+
+    @property
+    def properties(self):
+        """Свойства объекта.
+
+        Запрашиваются при первом обращении и запоминаются в объекте.
+        """
+        if self._properties is None:
+            self._properties = self._get_properties()
+        return self._properties
 
     def _get_properties(self):
         """Получить свойства объекта."""
-        return self._check_error(self.bx24.call(
-            self.GET_PROPS_REST_METHOD,
-            {'id': self.id}
-        ))
+        if not (self.GET_PROPS_REST_METHOD and self.id):
+            return {}
+        method, params = self._get_properties_command()
+        return self._parse_properties(self._check_error(
+            self.bx24.call(method, params)))
+
+    def _get_properties_command(self) -> tuple[str, dict]:
+        """Команда получения свойств объекта.
+
+        Если задан список полей select, свойства получаются методом списка
+        с фильтром по id, так как методы get не поддерживают выборку полей.
+        """
+        if self.select and self.LIST_PROPS_REST_METHOD:
+            return self.LIST_PROPS_REST_METHOD, {
+                'filter': {'ID': self.id}, 'select': ['ID', *self.select]}
+        return self.GET_PROPS_REST_METHOD, {'id': self.id}
+
+    def _parse_properties(self, result):
+        """Свойства объекта из результата команды."""
+        if not (self.select and self.LIST_PROPS_REST_METHOD):
+            return result
+        if not result:
+            raise RuntimeError('NOT_FOUND', 'Not found')
+        return result[0]
+
+    @staticmethod
+    def prefetch(*objs: 'ObjB24') -> None:
+        """Загрузить свойства нескольких объектов одного портала одним
+        пакетным запросом.
+
+        Объекты, свойства которых не удалось получить, запросят их отдельно
+        при первом обращении.
+        """
+        objs = [obj for obj in objs if obj._properties is None
+                and obj.GET_PROPS_REST_METHOD and obj.id]
+        if not objs:
+            return
+        # Ключи команд не числовые: ответ с ключами 0, 1, ... Битрикс24
+        # возвращает массивом, а не объектом
+        results, _ = objs[0]._call_batch({
+            'obj_{}'.format(number): obj._get_properties_command()
+            for number, obj in enumerate(objs)
+        })
+        for number, obj in enumerate(objs):
+            key = 'obj_{}'.format(number)
+            if key not in results:
+                continue
+            try:
+                obj._properties = obj._parse_properties(results[key])
+            except RuntimeError:
+                continue
+
+    @classmethod
+    def get_properties_batch(cls, portal: Portals, ids_obj, select=None):
+        """Получить свойства нескольких объектов пакетными запросами.
+
+        Возвращает словарь свойств и словарь ошибок по id объектов. Если
+        задан список полей select, каждая команда пакета получает методом
+        списка до LIST_PAGE_SIZE объектов только с этими полями.
+        """
+        batch = ObjB24(portal, None)
+        ids_obj = [int(id_obj) for id_obj in ids_obj]
+        # Ключи команд не числовые: ответ с ключами 0, 1, ... Битрикс24
+        # возвращает массивом, а не объектом
+        if not (select and cls.LIST_PROPS_REST_METHOD):
+            keys = {'id_{}'.format(id_obj): id_obj for id_obj in ids_obj}
+            results, errors = batch._call_batch({
+                key: (cls.GET_PROPS_REST_METHOD, {'id': id_obj})
+                for key, id_obj in keys.items()
+            })
+            return ({keys[key]: value for key, value in results.items()},
+                    {keys[key]: value for key, value in errors.items()})
+        chunks = {
+            'ids_{}'.format(number): ids_obj[start:start + cls.LIST_PAGE_SIZE]
+            for number, start in enumerate(
+                range(0, len(ids_obj), cls.LIST_PAGE_SIZE))
+        }
+        results, errors = batch._call_batch({
+            key: (cls.LIST_PROPS_REST_METHOD,
+                  {'filter': {'ID': chunk}, 'select': ['ID', *select]})
+            for key, chunk in chunks.items()
+        })
+        return ({int(props['ID']): props for result in results.values()
+                 for props in result},
+                {id_obj: errors[key] for key, chunk in chunks.items()
+                 if key in errors for id_obj in chunk})
+
+    def get_all(self, select=None, filter=None):
+        """Получить все объекты методом списка.
+
+        Генератор обходит страницы по возрастанию id без подсчета общего
+        количества и отдает объекты по мере получения.
+        """
+        params = {
+            'order': {'ID': 'ASC'},
+            'start': -1,
+        }
+        if select:
+            params['select'] = ['ID', *select]
+        last_id = 0
+        while True:
+            params['filter'] = {**(filter or {}), '>ID': last_id}
+            objs = self._check_error(self.bx24.call(
+                self.LIST_PROPS_REST_METHOD, params))
+            yield from objs
+            if len(objs) < self.LIST_PAGE_SIZE:
+                return
+            last_id = objs[-1].get('ID')
+
+    def _call_batch(self, commands: dict[str, tuple[str, dict]]):
+        """Выполнить команды пакетами (batch) не более BATCH_MAX_COMMANDS.
+
+        Возвращает словарь результатов и словарь ошибок по ключам команд.
+        """
+        results = {}
+        errors = {}
+        keys = list(commands)
+        for start in range(0, len(keys), self.BATCH_MAX_COMMANDS):
+            chunk = {key: commands[key] for key in
+                     keys[start:start + self.BATCH_MAX_COMMANDS]}
+            result = self._check_error(self.bx24.call_batch(chunk))
+            results.update(result.get('result') or {})
+            for key, error in (result.get('result_error') or {}).items():
+                errors[key] = (error.get('error'),
+                               error.get('error_description'))
+        return results, errors
 
     @staticmethod
     def _check_error(result):
@@ -34,11 +169,16 @@ class ObjB24:
 class DealB24(ObjB24):
     """Класс Сделка."""
     GET_PROPS_REST_METHOD: str = 'crm.deal.get'
+    LIST_PROPS_REST_METHOD: str = 'crm.deal.list'
 
-    def __init__(self, portal: Portals, id_obj: int):
-        super().__init__(portal, id_obj)
+    def __init__(self, portal: Portals, id_obj: int, select=None):
+        super().__init__(portal, id_obj, select)
         self.products = None
-        self.responsible = self.properties.get('ASSIGNED_BY_ID')
+
+    @property
+    def responsible(self):
+        """Ответственный."""
+        return self.properties.get('ASSIGNED_BY_ID')
 
     def get_all_products(self):
         """Получить все продукты сделки."""
@@ -69,15 +209,33 @@ class DealB24(ObjB24):
             }
         ))
 
+    async def get_all_products_async(self):
+        """Получить все продукты сделки, не блокируя цикл событий."""
+        self.products = self._check_error(
+            await get_async_client(self.portal).call(
+                'crm.deal.productrows.get', {'id': self.id}))
+
+    async def set_products_async(self, prods_rows):
+        """Записать товары в сделку, не блокируя цикл событий."""
+        return self._check_error(
+            await get_async_client(self.portal).call(
+                'crm.deal.productrows.set',
+                {'id': self.id, 'rows': prods_rows}))
+
 
 class QuoteB24(ObjB24):
     """Класс Предложение."""
     GET_PROPS_REST_METHOD: str = 'crm.quote.get'
+    LIST_PROPS_REST_METHOD: str = 'crm.quote.list'
 
-    def __init__(self, portal: Portals, id_obj: int):
-        super().__init__(portal, id_obj)
+    def __init__(self, portal: Portals, id_obj: int, select=None):
+        super().__init__(portal, id_obj, select)
         self.products = None
-        self.responsible = self.properties.get('ASSIGNED_BY_ID')
+
+    @property
+    def responsible(self):
+        """Ответственный."""
+        return self.properties.get('ASSIGNED_BY_ID')
 
     def get_all_products(self):
         """Получить все продукты предложения."""
@@ -86,7 +244,7 @@ class QuoteB24(ObjB24):
         ))
 
     def set_products(self, prods_rows):
-        """Добавить товар в сделку в Битрикс24"""
+        """Добавить товар в предложение в Битрикс24"""
         return self._check_error(self.bx24.call(
             'crm.quote.productrows.set',
             {
@@ -95,14 +253,29 @@ class QuoteB24(ObjB24):
             }
         ))
 
+    async def get_all_products_async(self):
+        """Получить все продукты предложения, не блокируя цикл событий."""
+        self.products = self._check_error(
+            await get_async_client(self.portal).call(
+                'crm.quote.productrows.get', {'id': self.id}))
+
+    async def set_products_async(self, prods_rows):
+        """Записать товары в предложение, не блокируя цикл событий."""
+        return self._check_error(
+            await get_async_client(self.portal).call(
+                'crm.quote.productrows.set',
+                {'id': self.id, 'rows': prods_rows}))
+
 
 class CompanyB24(ObjB24):
     """Класс Компания Битрикс24."""
     GET_PROPS_REST_METHOD: str = 'crm.company.get'
+    LIST_PROPS_REST_METHOD: str = 'crm.company.list'
 
-    def __init__(self, portal, id_obj: int):
-        super().__init__(portal, id_obj)
-        self.type = self.properties.get('COMPANY_TYPE')
+    @property
+    def type(self):
+        """Тип компании."""
+        return self.properties.get('COMPANY_TYPE')
 
     def get_inn(self):
         """Метод получения ИНН компании."""
@@ -112,6 +285,31 @@ class CompanyB24(ObjB24):
         ))
         return result[0].get('RQ_INN') if result else None
 
+    @classmethod
+    def get_with_requisite(cls, portal: Portals, company_id: int,
+                           select=None):
+        """Получить свойства компании и ее реквизит с ИНН одним пакетным
+        запросом.
+
+        Возвращает свойства компании и первый реквизит или None.
+        """
+        results, errors = ObjB24(portal, None)._call_batch({
+            'company': (cls.LIST_PROPS_REST_METHOD, {
+                'filter': {'ID': company_id},
+                'select': ['ID', *(select or [])],
+            }),
+            'requisite': ('crm.requisite.list', {
+                'filter': {'ENTITY_ID': company_id},
+                'select': ['ID', 'RQ_INN'],
+            }),
+        })
+        if errors:
+            raise RuntimeError(*next(iter(errors.values())))
+        if not results.get('company'):
+            raise RuntimeError('NOT_FOUND', 'Not found')
+        return (results['company'][0],
+                next(iter(results.get('requisite') or []), None))
+
 
 class ActivityB24(ObjB24):
     """Класс Активити Битрикс24 (действия бизнес-процессов)."""
@@ -138,9 +336,26 @@ class ActivityB24(ObjB24):
         ))
 
 
+class EventB24(ObjB24):
+    """Класс Обработчиков событий Битрикс24."""
+    def get_all_bound(self):
+        """Получить все обработчики событий приложения на портале."""
+        return self._check_error(self.bx24.call('event.get'))
+
+    def bind(self, event, handler):
+        """Метод установки обработчика события на портал."""
+        return self._check_error(self.bx24.call_event_bind(event, handler))
+
+    def unbind(self, event, handler):
+        """Метод удаления обработчика события с портала."""
+        return self._check_error(
+            self.bx24.call_event_unbind(event, handler))
+
+
 class ProductB24(ObjB24):
     """Класс Товар каталога."""
     GET_PROPS_REST_METHOD: str = 'crm.product.get'
+    LIST_PROPS_REST_METHOD: str = 'crm.product.list'
 
 
 class ProductRowB24(ObjB24):
@@ -159,30 +374,54 @@ class ProductRowB24(ObjB24):
 class RequisiteB24(ObjB24):
     """Класс Реквизитов."""
     GET_PROPS_REST_METHOD: str = 'crm.requisite.get'
+    LIST_PROPS_REST_METHOD: str = 'crm.requisite.list'
 
-    def list(self, filter):
+    def list(self, filter, select=None):
         """Метод поиска реквизитов."""
+        params = {'filter': filter}
+        if select:
+            params['select'] = select
         return self._check_error(self.bx24.call(
-            'crm.requisite.list',
-            {
-                'filter': filter
-            }
-        ))
+            self.LIST_PROPS_REST_METHOD, params))
 
 
 class SmartProcessB24(ObjB24):
     """Класс Smart процесс."""
     GET_PROPS_REST_METHOD: str = 'crm.type.get'
 
-    def get_all_elements(self):
-        """Метод получения всех элементов смарт процесса."""
+    def get_all_elements(self, select=None, filter=None):
+        """Метод получения всех элементов смарт процесса.
+
+        Генератор обходит все страницы по возрастанию id без подсчета общего
+        количества элементов и отдает элементы по мере получения. Если задан
+        список полей select, элементы получаются только с этими полями.
+        """
+        params = {
+            'entityTypeId': self.entity_type_id,
+            'order': {'id': 'ASC'},
+            'start': -1,
+        }
+        if select:
+            params['select'] = ['id', *select]
+        last_id = 0
+        while True:
+            params['filter'] = {**(filter or {}), '>id': last_id}
+            elements = self._check_error(self.bx24.call(
+                'crm.item.list', params)).get('items')
+            yield from elements
+            if len(elements) < self.LIST_PAGE_SIZE:
+                return
+            last_id = elements[-1].get('id')
+
+    def get_element(self, element_id):
+        """Получить элемент smart процесса."""
         return self._check_error(self.bx24.call(
-            'crm.item.list',
+            'crm.item.get',
             {
-                'entityTypeId': int(self.properties.get('type').get(
-                    'entityTypeId')),
+                'entityTypeId': self.entity_type_id,
+                'id': element_id,
             }
-        )).get('items')
+        )).get('item')
 
     def get_all_products(self, element_id):
         """Получить все товары smart процесса"""
@@ -190,12 +429,41 @@ class SmartProcessB24(ObjB24):
             'crm.item.productrow.list',
             {
                 'filter': {
-                    '=ownerType': "Tb1",
+                    '=ownerType': self.owner_type,
                     "=ownerId": element_id
                 }
             }
         )).get('productRows')
 
+    def get_products_batch(self, elements_ids):
+        """Получить товары нескольких элементов smart процесса пакетными
+        запросами.
+
+        Возвращает словарь товаров и словарь ошибок по id элементов.
+        """
+        results, errors = self._call_batch({
+            str(element_id): ('crm.item.productrow.list', {
+                'filter': {
+                    '=ownerType': self.owner_type,
+                    '=ownerId': element_id,
+                }
+            })
+            for element_id in elements_ids
+        })
+        return ({int(key): value.get('productRows')
+                 for key, value in results.items()},
+                {int(key): value for key, value in errors.items()})
+
+    @property
+    def entity_type_id(self) -> int:
+        """Идентификатор типа сущности smart процесса."""
+        return int(self.properties.get('type').get('entityTypeId'))
+
+    @property
+    def owner_type(self) -> str:
+        """Краткий код типа сущности для товарных позиций."""
+        return 'T{:x}'.format(self.entity_type_id)
+
 
 class ListB24(ObjB24):
     """Класс Универсальных списков."""
@@ -209,3 +477,50 @@ class ListB24(ObjB24):
                 'ELEMENT_ID': element_id,
             }
         ))
+
+    def get_all_elements(self, filter=None):
+        """Метод получения всех элементов универсального списка.
+
+        Генератор обходит страницы по возрастанию id и отдает элементы по
+        мере получения.
+        """
+        last_id = 0
+        while True:
+            elements = self._check_error(self.bx24.call(
+                'lists.element.get',
+                {
+                    'IBLOCK_TYPE_ID': 'lists',
+                    'IBLOCK_ID': self.id,
+                    'FILTER': {**(filter or {}), '>ID': last_id},
+                    'ELEMENT_ORDER': {'ID': 'ASC'},
+                }
+            ))
+            yield from elements
+            if len(elements) < self.LIST_PAGE_SIZE:
+                return
+            last_id = elements[-1].get('ID')
+
+    def get_elements_by_ids(self, elements_ids):
+        """Метод получения элементов универсального списка по их id.
+
+        Элементы запрашиваются пакетом команд с фильтром по массиву id, не
+        более LIST_PAGE_SIZE в каждой. Возвращает словарь элементов по id.
+        Если команда пакета завершилась ошибкой, возникает RuntimeError:
+        иначе элементы этой команды выглядели бы отсутствующими.
+        """
+        elements_ids = [int(element_id) for element_id in elements_ids]
+        # Ключи команд не числовые: ответ с ключами 0, 1, ... Битрикс24
+        # возвращает массивом, а не объектом
+        results, errors = self._call_batch({
+            'group_{}'.format(start): ('lists.element.get', {
+                'IBLOCK_TYPE_ID': 'lists',
+                'IBLOCK_ID': self.id,
+                'FILTER': {
+                    'ID': elements_ids[start:start + self.LIST_PAGE_SIZE]},
+            })
+            for start in range(0, len(elements_ids), self.LIST_PAGE_SIZE)
+        })
+        if errors:
+            raise RuntimeError(*next(iter(errors.values())))
+        return {int(element['ID']): element for result in results.values()
+                for element in result}
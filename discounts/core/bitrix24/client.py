@@ -0,0 +1,536 @@
+import asyncio
+import collections
+import http.client
+import json
+import queue
+import random
+import threading
+import time
+import weakref
+from urllib.parse import urlencode, urlsplit
+
+from pybitrix24 import Bitrix24
+from pybitrix24.exceptions import PBx24RequestError, PyBitrix24Error
+from pybitrix24.requester import prepare_batch_command
+
+
+class NoResponseError(ConnectionError):
+    """Запрос не отправлен или соединение закрыто до начала ответа."""
+
+
+class RateLimiter:
+    """Ограничитель частоты запросов к порталу (token bucket).
+
+    Скорость пополнения снижается вдвое при ошибках превышения лимита и
+    постепенно восстанавливается после успешных запросов.
+    """
+    RATE: float = 2.0
+    MIN_RATE: float = 0.25
+    RECOVERY_STEP: float = 0.05
+    CAPACITY: float = 50.0
+    BACKOFF_BASE: float = 0.5
+    BACKOFF_MAX: float = 16.0
+
+    def __init__(self):
+        self.rate = self.RATE
+        self.tokens = self.CAPACITY
+        self.updated = time.monotonic()
+        self.throttled_time = 0.0
+        self.throttled_count = 0
+        self.limit_errors = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Дождаться свободного токена. Возвращает время ожидания."""
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self) -> float:
+        """Дождаться свободного токена, не блокируя цикл событий."""
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+    def _reserve(self) -> float:
+        """Забрать токен. Возвращает время, которое нужно подождать."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.CAPACITY, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            if wait:
+                self.throttled_time += wait
+                self.throttled_count += 1
+        return wait
+
+    def penalize(self) -> None:
+        """Учесть ошибку превышения лимита."""
+        with self._lock:
+            self.limit_errors += 1
+            self.tokens = min(self.tokens, 0.0)
+            self.rate = max(self.MIN_RATE, self.rate / 2)
+
+    def wait(self, delay: float) -> None:
+        """Пауза, учитываемая во времени ожидания."""
+        self._count_wait(delay)
+        time.sleep(delay)
+
+    async def wait_async(self, delay: float) -> None:
+        """Пауза, не блокирующая цикл событий."""
+        self._count_wait(delay)
+        await asyncio.sleep(delay)
+
+    def _count_wait(self, delay: float) -> None:
+        with self._lock:
+            self.throttled_time += delay
+            self.throttled_count += 1
+
+    def backoff(self, attempt: int) -> float:
+        """Пауза перед повтором запроса: экспоненциальная со случайным
+        разбросом. Возвращает время паузы."""
+        delay = self.get_backoff_delay(attempt)
+        self.wait(delay)
+        return delay
+
+    def get_backoff_delay(self, attempt: int) -> float:
+        """Время паузы перед повтором запроса."""
+        return random.uniform(
+            0, min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** attempt))
+
+    def recover(self) -> None:
+        """Учесть успешный запрос."""
+        if self.rate < self.RATE:
+            with self._lock:
+                self.rate = min(self.RATE, self.rate + self.RECOVERY_STEP)
+
+    def get_metrics(self) -> dict[str, float]:
+        """Метрики ограничителя."""
+        return {
+            'rate': self.rate,
+            'throttled_time': round(self.throttled_time, 3),
+            'throttled_count': self.throttled_count,
+            'limit_errors': self.limit_errors,
+        }
+
+
+class OperatingBudget:
+    """Учет времени выполнения (operating) методов REST на портале.
+
+    Битрикс24 блокирует метод, если его суммарное время выполнения за окно
+    превысило LIMIT секунд. После SOFT_LIMIT вызовы метода замедляются тем
+    сильнее, чем ближе расход к лимиту и чем дальше до сброса окна.
+    """
+    LIMIT: float = 480.0
+    SOFT_LIMIT: float = 0.5
+    MAX_DELAY: float = 30.0
+
+    def __init__(self):
+        self.methods: dict[str, dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, method: str, time_info: dict) -> None:
+        """Сохранить блок time ответа для метода."""
+        if not isinstance(time_info, dict) or 'operating' not in time_info:
+            return
+        with self._lock:
+            state = self.methods.setdefault(method, {'calls': 0})
+            state['calls'] += 1
+            state['operating'] = float(time_info.get('operating') or 0)
+            state['reset_at'] = float(
+                time_info.get('operating_reset_at') or 0)
+
+    def get_delay(self, method: str) -> float:
+        """Пауза перед вызовом метода для равномерного расхода бюджета."""
+        with self._lock:
+            state = self.methods.get(method)
+            if not state or 'operating' not in state:
+                return 0.0
+            remaining = state['reset_at'] - time.time()
+            if remaining <= 0:
+                state['operating'] = 0.0
+                return 0.0
+            usage = state['operating'] / self.LIMIT
+        if usage <= self.SOFT_LIMIT:
+            return 0.0
+        pressure = min(1.0, (usage - self.SOFT_LIMIT) / (1 - self.SOFT_LIMIT))
+        return min(self.MAX_DELAY, remaining * pressure ** 2)
+
+    def get_metrics(self) -> dict[str, dict[str, float]]:
+        """Состояние бюджета по методам."""
+        now = time.time()
+        with self._lock:
+            return {
+                method: {
+                    'calls': state['calls'],
+                    'operating': (state.get('operating', 0.0)
+                                  if state.get('reset_at', 0) > now else 0.0),
+                    'limit': self.LIMIT,
+                    'reset_at': state.get('reset_at'),
+                }
+                for method, state in self.methods.items()
+            }
+
+
+class Bitrix24Client(Bitrix24):
+    """Клиент REST API Битрикс24 с пулом постоянных соединений."""
+    POOL_SIZE: int = 10
+    TIMEOUT: int = 60
+    PORT: int = 443
+    LIMIT_ERRORS: tuple[str] = ('QUERY_LIMIT_EXCEEDED',)
+    MAX_RETRIES: int = 5
+
+    def __init__(self, hostname, **kwargs):
+        super().__init__(hostname, **kwargs)
+        # Дата получения токена клиента, чтобы не заменить его более старым
+        self.token_date = None
+        self._pool = queue.LifoQueue(maxsize=self.POOL_SIZE)
+        self.limiter = RateLimiter()
+        self.budget = OperatingBudget()
+
+    def _call(self, url, method, query, params):
+        hostname, path, body, commands = self._prepare_request(
+            url, method, query, params)
+        for attempt in range(self.MAX_RETRIES + 1):
+            delay = self._get_delay(method, commands)
+            if delay:
+                self.limiter.wait(delay)
+            self.limiter.acquire()
+            status, data = self._request(hostname, path, body)
+            data, retry = self._handle_response(method, commands, status,
+                                                data)
+            if not retry:
+                return data
+            if attempt < self.MAX_RETRIES:
+                self.limiter.backoff(attempt)
+        return data
+
+    def _prepare_request(self, url, method, query, params):
+        """Хост, путь, тело запроса и методы команд пакета."""
+        url = self._call_url_template.format(url=url, method=method)
+        if query is not None:
+            url += '?' + urlencode(query)
+        body = (json.dumps(params).encode('utf-8') if params is not None
+                else None)
+        parts = urlsplit(url)
+        path = ('{}?{}'.format(parts.path, parts.query) if parts.query
+                else parts.path)
+        return (parts.hostname, path, body,
+                self._get_batch_methods(method, params))
+
+    def _get_delay(self, method, commands) -> float:
+        """Пауза перед запросом по бюджету времени его методов."""
+        return max(self.budget.get_delay(command)
+                   for command in [method, *commands.values()])
+
+    def _handle_response(self, method, commands, status, data):
+        """Разобрать ответ. Возвращает данные и признак повтора запроса
+        из-за превышения лимита."""
+        try:
+            data = json.loads(data.decode('utf-8'))
+        except ValueError as ex:
+            if status != http.HTTPStatus.SERVICE_UNAVAILABLE:
+                raise PyBitrix24Error(
+                    'Error decoding of server response', ex)
+            data = {'error': 'SERVICE_UNAVAILABLE',
+                    'error_description': 'Service unavailable'}
+        self._record_time(method, commands, data)
+        if (status != http.HTTPStatus.SERVICE_UNAVAILABLE
+                and data.get('error') not in self.LIMIT_ERRORS):
+            self.limiter.recover()
+            return data, False
+        self.limiter.penalize()
+        return data, True
+
+    @staticmethod
+    def _get_batch_methods(method, params) -> dict[str, str]:
+        """Методы команд пакетного запроса по их ключам."""
+        if method != 'batch' or not params:
+            return {}
+        return {key: command.split('?')[0]
+                for key, command in (params.get('cmd') or {}).items()}
+
+    def _record_time(self, method, commands, data) -> None:
+        """Учесть время выполнения методов из ответа."""
+        self.budget.record(method, data.get('time'))
+        result = data.get('result')
+        if not commands or not isinstance(result, dict):
+            return
+        result_time = result.get('result_time') or {}
+        for key, command in commands.items():
+            self.budget.record(command, result_time.get(key))
+
+    def _request(self, hostname, path, body):
+        """Выполнить HTTP запрос. Возвращает код ответа и тело.
+
+        Запрос повторяется на новом соединении, только если простаивающее
+        соединение оказалось закрыто: запрос не удалось отправить или сервер
+        закрыл соединение до начала ответа, и запрос не выполнялся. Ошибки
+        после начала ответа и истечение времени ожидания ответа не
+        повторяются, чтобы не выполнить дважды неидемпотентный метод.
+        """
+        while True:
+            connection, reused = self._get_connection(hostname)
+            try:
+                try:
+                    connection.request(
+                        'POST' if body is not None else 'GET', path,
+                        body=body,
+                        headers={'Content-Type': 'application/json'})
+                except OSError as ex:
+                    raise NoResponseError(*ex.args) from ex
+                try:
+                    response = connection.getresponse()
+                except ConnectionError as ex:
+                    raise NoResponseError(*ex.args) from ex
+                data = response.read()
+            except (http.client.HTTPException, OSError) as ex:
+                connection.close()
+                if reused and isinstance(ex, NoResponseError):
+                    continue
+                raise PBx24RequestError('Error on request', ex)
+            self._release_connection(connection)
+            return response.status, data
+
+    def _get_connection(self, hostname):
+        """Взять соединение из пула или открыть новое."""
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            if self.PORT == 443:
+                return http.client.HTTPSConnection(
+                    hostname, timeout=self.TIMEOUT), False
+            return http.client.HTTPConnection(
+                hostname, self.PORT, timeout=self.TIMEOUT), False
+
+    def _release_connection(self, connection):
+        """Вернуть соединение в пул."""
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+
+class AsyncBitrix24Client:
+    """Асинхронный клиент REST API Битрикс24.
+
+    Токен, ограничитель запросов и бюджет времени общие с синхронным
+    клиентом портала. Постоянные соединения привязаны к циклу событий, в
+    котором открыты, поэтому пул ведется для каждого цикла отдельно.
+    """
+    POOL_SIZE: int = 20
+    TIMEOUT: int = 60
+    PORT: int = 443
+
+    def __init__(self, client: Bitrix24Client):
+        self.client = client
+        self._pools = weakref.WeakKeyDictionary()
+        self._pools_lock = threading.Lock()
+
+    async def call(self, method, params=None):
+        """Вызвать метод REST API."""
+        client = self.client
+        url = client._method_url_template.format(hostname=client.hostname)
+        return await self._call(url, method, {'auth': client._access_token},
+                                params)
+
+    async def call_batch(self, calls, halt_on_error=False):
+        """Вызвать несколько методов одним пакетным запросом."""
+        return await self.call('batch', {
+            'cmd': prepare_batch_command(calls),
+            'halt': halt_on_error,
+        })
+
+    async def _call(self, url, method, query, params):
+        client = self.client
+        hostname, path, body, commands = client._prepare_request(
+            url, method, query, params)
+        for attempt in range(client.MAX_RETRIES + 1):
+            delay = client._get_delay(method, commands)
+            if delay:
+                await client.limiter.wait_async(delay)
+            await client.limiter.acquire_async()
+            status, data = await self._request(hostname, path, body)
+            data, retry = client._handle_response(method, commands, status,
+                                                  data)
+            if not retry:
+                return data
+            if attempt < client.MAX_RETRIES:
+                await client.limiter.wait_async(
+                    client.limiter.get_backoff_delay(attempt))
+        return data
+
+    async def _request(self, hostname, path, body):
+        """Выполнить HTTP запрос. Возвращает код ответа и тело."""
+        request = self._build_request(hostname, path, body)
+        while True:
+            connection, reused = await self._get_connection(hostname)
+            reader, writer = connection
+            try:
+                try:
+                    writer.write(request)
+                    await writer.drain()
+                except OSError as ex:
+                    raise NoResponseError(*ex.args) from ex
+                status, headers, data = await asyncio.wait_for(
+                    self._read_response(reader), self.TIMEOUT)
+            except (OSError, EOFError, ValueError,
+                    asyncio.TimeoutError) as ex:
+                writer.close()
+                # Простаивающее соединение закрыто до начала ответа
+                if reused and isinstance(ex, NoResponseError):
+                    continue
+                raise PBx24RequestError('Error on request', ex)
+            if headers.get('connection', '').lower() == 'close':
+                writer.close()
+            else:
+                self._release_connection(connection)
+            return status, data
+
+    @staticmethod
+    def _build_request(hostname, path, body) -> bytes:
+        """Текст HTTP запроса."""
+        lines = [
+            '{} {} HTTP/1.1'.format('POST' if body is not None else 'GET',
+                                    path),
+            'Host: {}'.format(hostname),
+            'Content-Type: application/json',
+            'Content-Length: {}'.format(len(body or b'')),
+            'Connection: keep-alive',
+        ]
+        return '\r\n'.join(lines).encode('latin-1') + b'\r\n\r\n' + (
+            body or b'')
+
+    @staticmethod
+    async def _read_response(reader):
+        """Прочитать HTTP ответ. Возвращает код, заголовки и тело."""
+        try:
+            status_line = await reader.readline()
+        except ConnectionError as ex:
+            raise NoResponseError(*ex.args) from ex
+        if not status_line:
+            raise NoResponseError('Connection closed by server')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if not size:
+                    while await reader.readline() not in (b'\r\n', b'\n',
+                                                          b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            return status, headers, b''.join(chunks)
+        if 'content-length' in headers:
+            return status, headers, await reader.readexactly(
+                int(headers['content-length']))
+        headers['connection'] = 'close'
+        return status, headers, await reader.read()
+
+    def _get_pool(self) -> collections.deque:
+        """Пул соединений текущего цикла событий."""
+        loop = asyncio.get_running_loop()
+        with self._pools_lock:
+            pool = self._pools.get(loop)
+            if pool is None:
+                pool = self._pools[loop] = collections.deque()
+        return pool
+
+    async def _get_connection(self, hostname):
+        """Взять соединение из пула или открыть новое."""
+        pool = self._get_pool()
+        while pool:
+            reader, writer = pool.pop()
+            if not writer.is_closing():
+                return (reader, writer), True
+        try:
+            connection = await asyncio.wait_for(asyncio.open_connection(
+                hostname, self.PORT, ssl=self.PORT == 443), self.TIMEOUT)
+        except (OSError, asyncio.TimeoutError) as ex:
+            raise PBx24RequestError('Error on request', ex)
+        return connection, False
+
+    def _release_connection(self, connection):
+        """Вернуть соединение в пул."""
+        pool = self._get_pool()
+        if len(pool) < self.POOL_SIZE:
+            pool.append(connection)
+        else:
+            connection[1].close()
+
+
+_clients: dict[str, Bitrix24Client] = {}
+_async_clients: dict[str, AsyncBitrix24Client] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(portal) -> Bitrix24Client:
+    """Получить общий для процесса клиент портала."""
+    with _clients_lock:
+        client = _clients.get(portal.name)
+        if client is None:
+            client = _clients[portal.name] = Bitrix24Client(portal.name)
+    _set_token(client, portal)
+    return client
+
+
+def get_async_client(portal) -> AsyncBitrix24Client:
+    """Получить общий для процесса асинхронный клиент портала."""
+    client = get_client(portal)
+    with _clients_lock:
+        async_client = _async_clients.get(portal.name)
+        if async_client is None:
+            async_client = _async_clients[portal.name] = (
+                AsyncBitrix24Client(client))
+    return async_client
+
+
+def get_metrics() -> dict[str, dict[str, dict]]:
+    """Метрики ограничителей запросов и бюджета времени по порталам."""
+    with _clients_lock:
+        clients = dict(_clients)
+    return {
+        name: {
+            'limiter': client.limiter.get_metrics(),
+            'operating': client.budget.get_metrics(),
+        }
+        for name, client in clients.items()
+    }
+
+
+def set_access_token(portal) -> None:
+    """Обновить токен клиента портала после его обновления."""
+    with _clients_lock:
+        client = _clients.get(portal.name)
+    if client is not None:
+        _set_token(client, portal)
+
+
+def _set_token(client: Bitrix24Client, portal) -> None:
+    """Передать клиенту токен портала, если он не старее токена клиента.
+
+    Устаревший экземпляр портала (из кеша настроек или долго выполняемого
+    задания) не заменяет токен, который уже обновлен.
+    """
+    token_date = portal.auth_id_create_date
+    with _clients_lock:
+        if client._access_token and token_date is None:
+            return
+        if (client.token_date is not None and token_date is not None
+                and token_date < client.token_date):
+            return
+        client._access_token = portal.auth_id
+        client.token_date = token_date
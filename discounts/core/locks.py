@@ -0,0 +1,173 @@
+import asyncio
+import contextlib
+import hashlib
+import math
+import threading
+import time
+
+from django.db import connection, connections
+
+# Сколько секунд по умолчанию ждать освобождения блокировки
+LOCK_TIMEOUT = 30
+# Максимальная длина имени блокировки MySQL
+MYSQL_NAME_LENGTH = 64
+
+
+class LockTimeoutError(Exception):
+    """Блокировка не получена за отведенное время."""
+
+
+class LockMetrics:
+    """Счетчики ожидания блокировок одного вида."""
+
+    def __init__(self):
+        self.acquired = 0
+        self.contended = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float, acquired: bool, contended: bool) -> None:
+        if acquired:
+            self.acquired += 1
+        else:
+            self.timeouts += 1
+        if contended:
+            self.contended += 1
+            self.wait_time += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def get_metrics(self) -> dict[str, float]:
+        return {
+            'acquired': self.acquired,
+            'contended': self.contended,
+            'timeouts': self.timeouts,
+            'wait_time': round(self.wait_time, 3),
+            'max_wait': round(self.max_wait, 3),
+        }
+
+
+_metrics: dict[str, LockMetrics] = {}
+_locks: dict[str, list] = {}
+_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def named_lock(kind: str, *key, timeout: float = LOCK_TIMEOUT):
+    """Именованная блокировка вида kind по ключу key.
+
+    На MySQL используется GET_LOCK, поэтому блокировка действует для всех
+    процессов приложения; на остальных БД - блокировка внутри процесса.
+    Блокировка MySQL принадлежит соединению потока с БД, поэтому получение и
+    освобождение выполняются в одном потоке. Если блокировка не получена
+    за timeout секунд, возникает LockTimeoutError.
+    """
+    name = _get_name(kind, key)
+    mysql = connection.vendor == 'mysql'
+    acquire = _acquire_mysql if mysql else _acquire_local
+    started = time.monotonic()
+    acquired = acquire(name, 0)
+    contended = not acquired
+    if contended:
+        acquired = acquire(name, timeout)
+    with _lock:
+        metrics = _metrics.setdefault(kind, LockMetrics())
+        metrics.record(time.monotonic() - started, acquired, contended)
+    if not acquired:
+        raise LockTimeoutError(name)
+    try:
+        yield
+    finally:
+        (_release_mysql if mysql else _release_local)(name)
+
+
+@contextlib.asynccontextmanager
+async def named_lock_async(kind: str, *key, timeout: float = LOCK_TIMEOUT):
+    """Именованная блокировка для асинхронного кода.
+
+    Блокировку получает и держит отдельный поток, так как блокировка MySQL
+    привязана к соединению потока, а цикл событий не должен ждать ее.
+    """
+    loop = asyncio.get_running_loop()
+    locked = loop.create_future()
+    release = threading.Event()
+
+    def hold():
+        try:
+            with named_lock(kind, *key, timeout=timeout):
+                loop.call_soon_threadsafe(_set_result, locked, None)
+                release.wait()
+        except Exception as ex:
+            loop.call_soon_threadsafe(_set_exception, locked, ex)
+        finally:
+            connections.close_all()
+
+    threading.Thread(target=hold, daemon=True,
+                     name='lock-{}'.format(kind)).start()
+    try:
+        await locked
+        yield
+    finally:
+        release.set()
+
+
+def get_lock_metrics() -> dict[str, dict[str, float]]:
+    """Метрики ожидания блокировок по видам."""
+    with _lock:
+        return {kind: metrics.get_metrics()
+                for kind, metrics in _metrics.items()}
+
+
+def _get_name(kind: str, key: tuple) -> str:
+    name = ':'.join(['discounts', kind, *map(str, key)])
+    if len(name) > MYSQL_NAME_LENGTH:
+        name = 'discounts:{}:{}'.format(
+            kind, hashlib.sha1(name.encode('utf-8')).hexdigest())
+    return name
+
+
+def _acquire_mysql(name: str, timeout: float) -> bool:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT GET_LOCK(%s, %s)',
+                       [name, math.ceil(timeout)])
+        return cursor.fetchone()[0] == 1
+
+
+def _release_mysql(name: str) -> None:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT RELEASE_LOCK(%s)', [name])
+
+
+def _acquire_local(name: str, timeout: float) -> bool:
+    with _lock:
+        entry = _locks.setdefault(name, [threading.Lock(), 0])
+        entry[1] += 1
+    acquired = entry[0].acquire(timeout=timeout) if timeout else (
+        entry[0].acquire(blocking=False))
+    if not acquired:
+        _forget_local(name)
+    return acquired
+
+
+def _release_local(name: str) -> None:
+    _locks[name][0].release()
+    _forget_local(name)
+
+
+def _forget_local(name: str) -> None:
+    """Удалить неиспользуемую блокировку процесса."""
+    with _lock:
+        entry = _locks[name]
+        entry[1] -= 1
+        if not entry[1]:
+            del _locks[name]
+
+
+def _set_result(future: asyncio.Future, result) -> None:
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future: asyncio.Future, ex: Exception) -> None:
+    if not future.done():
+        future.set_exception(ex)
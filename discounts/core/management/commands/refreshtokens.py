@@ -0,0 +1,39 @@
+import time
+
+from core.models import Portals
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Обновляет токены порталов незадолго до истечения их срока'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Проверять токены постоянно с интервалом --interval')
+        parser.add_argument(
+            '--interval', type=int, default=60,
+            help='Интервал проверки в секундах')
+
+    def handle(self, *args, **options):
+        while True:
+            for portal in Portals.objects.all():
+                if not portal.is_token_expired(Portals.REFRESH_MARGIN):
+                    continue
+                # Ошибка одного портала не прерывает обновление остальных
+                try:
+                    portal.refresh_auth(Portals.REFRESH_MARGIN)
+                except Exception as ex:
+                    self.stderr.write('Токены портала {} не обновлены: '
+                                      '{!r}'.format(portal.name, ex))
+                    continue
+                if portal.is_token_expired(Portals.REFRESH_MARGIN):
+                    self.stderr.write('Токены портала {} не обновлены: '
+                                      'Битрикс24 не вернул новые '
+                                      'токены'.format(portal.name))
+                    continue
+                self.stdout.write('Токены портала {} обновлены'.format(
+                    portal.name))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
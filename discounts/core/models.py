@@ -1,10 +1,25 @@
-from django.db import models
+import threading
+
+from core.bitrix24.client import set_access_token
+from django.db import models, transaction
 from django.utils import timezone
 from pybitrix24 import Bitrix24
 
+_refresh_locks: dict[int, threading.Lock] = {}
+_refresh_locks_lock = threading.Lock()
+
+
+def _get_refresh_lock(portal_id: int) -> threading.Lock:
+    """Блокировка обновления токенов портала в пределах процесса."""
+    with _refresh_locks_lock:
+        return _refresh_locks.setdefault(portal_id, threading.Lock())
+
 
 class Portals(models.Model):
     """Модель портала Битрикс24."""
+    TOKEN_LIFETIME = timezone.timedelta(seconds=3600)
+    REFRESH_MARGIN = timezone.timedelta(seconds=300)
+
     member_id = models.CharField(
         verbose_name='Уникальный код портала',
         max_length=255,
@@ -38,6 +53,19 @@ class Portals(models.Model):
         null=True,
         blank=True,
     )
+    events_token = models.CharField(
+        verbose_name='Токен обработчика событий',
+        help_text='Передается в адресе обработчика событий при установке',
+        max_length=64,
+        blank=True,
+    )
+    application_token = models.CharField(
+        verbose_name='Токен приложения в событиях',
+        help_text='Сохраняется из первого события с верным токеном '
+                  'обработчика',
+        max_length=64,
+        blank=True,
+    )
 
     class Meta:
         verbose_name = 'Портал'
@@ -48,13 +76,37 @@ class Portals(models.Model):
 
     def check_auth(self):
         """Метод проверки аутентификации на портале."""
-        if ((self.auth_id_create_date + timezone.timedelta(seconds=3600))
-                < timezone.now()):
-            bx24 = Bitrix24(self.name)
-            bx24.auth_hostname = 'oauth.bitrix.info'
-            bx24._refresh_token = self.refresh_id
-            bx24.client_id = self.client_id
-            bx24.client_secret = self.client_secret
-            bx24.refresh_tokens()
-            self.auth_id = bx24._access_token
-            self.refresh_id = bx24._refresh_token
+        if self.is_token_expired():
+            self.refresh_auth()
+
+    def is_token_expired(self, margin=timezone.timedelta()) -> bool:
+        """Истекает ли токен аутентификации в пределах margin."""
+        return (self.auth_id_create_date + self.TOKEN_LIFETIME - margin
+                < timezone.now())
+
+    def refresh_auth(self, margin=timezone.timedelta()):
+        """Метод обновления токенов портала.
+
+        Для портала одновременно выполняется только одно обновление:
+        в процессе под блокировкой, между процессами под блокировкой строки
+        в БД. Если токены уже обновлены другим запросом, используются они.
+        """
+        with _get_refresh_lock(self.pk):
+            with transaction.atomic():
+                portal = Portals.objects.select_for_update().get(pk=self.pk)
+                if portal.is_token_expired(margin):
+                    bx24 = Bitrix24(portal.name)
+                    bx24.auth_hostname = 'oauth.bitrix.info'
+                    bx24._refresh_token = portal.refresh_id
+                    bx24.client_id = portal.client_id
+                    bx24.client_secret = portal.client_secret
+                    bx24.refresh_tokens()
+                    if bx24._access_token and bx24._refresh_token:
+                        portal.auth_id = bx24._access_token
+                        portal.refresh_id = bx24._refresh_token
+                        portal.save(update_fields=[
+                            'auth_id', 'refresh_id', 'auth_id_create_date'])
+            self.auth_id = portal.auth_id
+            self.refresh_id = portal.refresh_id
+            self.auth_id_create_date = portal.auth_id_create_date
+        set_access_token(self)
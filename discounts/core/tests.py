@@ -0,0 +1,329 @@
+import asyncio
+import http.client
+import io
+import socket
+import threading
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from pybitrix24.exceptions import PBx24RequestError
+
+from .bitrix24.bitrix24 import CompanyB24, DealB24, ListB24, ObjB24, ProductB24
+from .bitrix24.client import (AsyncBitrix24Client, Bitrix24Client,
+                              get_client, set_access_token)
+from .locks import (MYSQL_NAME_LENGTH, LockTimeoutError, _get_name, _locks,
+                    get_lock_metrics, named_lock, named_lock_async)
+from .models import Portals
+
+
+def php_json(values: dict[str, any]) -> dict[str, any] or list:
+    """Словарь так, как его возвращает json_encode в PHP: ключи 0, 1, ...
+    по порядку дают массив."""
+    if list(values) == [str(number) for number in range(len(values))]:
+        return list(values.values())
+    return values
+
+
+class FakeBatch:
+    """Пакетный запрос к Битрикс24: команды выполняет handler."""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.commands = []
+
+    def __call__(self, calls, halt_on_error=False):
+        self.commands.append(dict(calls))
+        results, errors = {}, {}
+        for key, (method, params) in calls.items():
+            try:
+                results[key] = self.handler(method, params)
+            except RuntimeError as ex:
+                errors[key] = {'error': ex.args[0],
+                               'error_description': ex.args[1]}
+        return {'result': {'result': php_json(results),
+                           'result_error': php_json(errors)}}
+
+
+class BatchKeysTest(SimpleTestCase):
+    """Ключи пакетных команд не превращают ответ в массив."""
+
+    def setUp(self):
+        self.portal = Portals(member_id='member', name='test.bitrix24.ru',
+                              auth_id='auth')
+
+    def patch_batch(self, handler) -> FakeBatch:
+        fake_batch = FakeBatch(handler)
+        patcher = mock.patch.object(Bitrix24Client, 'call_batch', fake_batch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return fake_batch
+
+    def test_list_elements_by_ids(self):
+        self.patch_batch(lambda method, params: [
+            {'ID': str(element_id)} for element_id in params['FILTER']['ID']])
+        for count in (1, 50, 120):
+            with self.subTest(count=count):
+                elements = ListB24(self.portal, 7).get_elements_by_ids(
+                    range(1, count + 1))
+                self.assertEqual(sorted(elements), list(range(1, count + 1)))
+
+    def test_list_elements_error_is_raised(self):
+        def handler(method, params):
+            if 60 in params['FILTER']['ID']:
+                raise RuntimeError('QUERY_LIMIT_EXCEEDED', 'Too many requests')
+            return [{'ID': str(element_id)}
+                    for element_id in params['FILTER']['ID']]
+
+        self.patch_batch(handler)
+        with self.assertRaises(RuntimeError):
+            ListB24(self.portal, 7).get_elements_by_ids(range(1, 121))
+
+    def test_properties_batch_with_select(self):
+        self.patch_batch(lambda method, params: [
+            {'ID': str(product_id), 'PROPERTY_1': product_id}
+            for product_id in params['filter']['ID']])
+        for count in (1, 50, 120):
+            with self.subTest(count=count):
+                products, errors = ProductB24.get_properties_batch(
+                    self.portal, range(1, count + 1), select=['PROPERTY_1'])
+                self.assertEqual(errors, {})
+                self.assertEqual(sorted(products), list(range(1, count + 1)))
+                self.assertEqual(products[count]['PROPERTY_1'], count)
+
+    def test_properties_batch_without_select(self):
+        fake_batch = self.patch_batch(lambda method, params: (
+            {'ID': str(params['id'])} if params['id'] != 2 else None))
+        products, errors = ProductB24.get_properties_batch(
+            self.portal, range(3))
+        self.assertTrue(all(not key.isdigit()
+                            for key in fake_batch.commands[0]))
+        self.assertEqual(products, {0: {'ID': '0'}, 1: {'ID': '1'},
+                                    2: None})
+        self.assertEqual(errors, {})
+
+    def test_prefetch(self):
+        fake_batch = self.patch_batch(lambda method, params: (
+            {'ID': str(params['id']), 'METHOD': method}))
+        deal = DealB24(self.portal, 1)
+        company = CompanyB24(self.portal, 2)
+        ObjB24.prefetch(deal, company)
+        self.assertEqual(len(fake_batch.commands), 1)
+        self.assertEqual(deal.properties,
+                         {'ID': '1', 'METHOD': 'crm.deal.get'})
+        self.assertEqual(company.properties,
+                         {'ID': '2', 'METHOD': 'crm.company.get'})
+
+
+class AccessTokenTest(SimpleTestCase):
+    """Устаревший экземпляр портала не заменяет обновленный токен."""
+
+    def test_stale_portal_keeps_refreshed_token(self):
+        now = timezone.now()
+        stale = Portals(member_id='member', name='token.bitrix24.ru',
+                        auth_id='old', auth_id_create_date=now)
+        refreshed = Portals(member_id='member', name='token.bitrix24.ru',
+                            auth_id='new', auth_id_create_date=now
+                            + timezone.timedelta(hours=1))
+        client = get_client(stale)
+        set_access_token(refreshed)
+        self.assertEqual(get_client(stale)._access_token, 'new')
+        self.assertIs(get_client(refreshed), client)
+
+
+class FakeConnection:
+    """HTTP соединение: getresponse возбуждает error или отдает ответ."""
+
+    def __init__(self, error=None, send_error=None):
+        self.error = error
+        self.send_error = send_error
+        self.requests = 0
+
+    def request(self, *args, **kwargs):
+        if self.send_error:
+            raise self.send_error
+        self.requests += 1
+
+    def getresponse(self):
+        if self.error:
+            raise self.error
+        response = mock.Mock(status=200)
+        response.read.return_value = b'{"result": true}'
+        return response
+
+    def close(self):
+        pass
+
+
+class RequestRetryTest(SimpleTestCase):
+    """Повтор запроса на новом соединении только до начала ответа."""
+
+    def setUp(self):
+        self.client = Bitrix24Client('retry.bitrix24.ru')
+        self.new_connection = FakeConnection()
+        patcher = mock.patch.object(http.client, 'HTTPSConnection',
+                                    return_value=self.new_connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def request(self, stale_connection: FakeConnection):
+        self.client._pool.put_nowait(stale_connection)
+        return self.client._request('retry.bitrix24.ru', '/rest/', b'{}')
+
+    def test_closed_before_response_is_retried(self):
+        status, _ = self.request(FakeConnection(
+            http.client.RemoteDisconnected('closed')))
+        self.assertEqual(status, 200)
+        self.assertEqual(self.new_connection.requests, 1)
+
+    def test_send_failure_is_retried(self):
+        status, _ = self.request(FakeConnection(
+            send_error=BrokenPipeError('broken pipe')))
+        self.assertEqual(status, 200)
+        self.assertEqual(self.new_connection.requests, 1)
+
+    def test_timeout_is_not_retried(self):
+        with self.assertRaises(PBx24RequestError):
+            self.request(FakeConnection(socket.timeout('timed out')))
+        self.assertEqual(self.new_connection.requests, 0)
+
+    def test_broken_response_is_not_retried(self):
+        with self.assertRaises(PBx24RequestError):
+            self.request(FakeConnection(http.client.BadStatusLine('HTTP/')))
+        self.assertEqual(self.new_connection.requests, 0)
+
+
+class FakeWriter:
+    def __init__(self):
+        self.data = b''
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+    def is_closing(self):
+        return False
+
+
+class AsyncRequestRetryTest(SimpleTestCase):
+    """Повтор асинхронного запроса только до начала ответа."""
+
+    def run_request(self, stale_reader_data: bytes or None):
+        client = AsyncBitrix24Client(Bitrix24Client('retry.bitrix24.ru'))
+        client.TIMEOUT = 0.1
+        opened = []
+
+        async def open_connection(*args, **kwargs):
+            reader = asyncio.StreamReader()
+            reader.feed_data(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n'
+                             b'\r\n{}')
+            opened.append(FakeWriter())
+            return reader, opened[-1]
+
+        async def request():
+            stale_reader = asyncio.StreamReader()
+            if stale_reader_data is not None:
+                stale_reader.feed_data(stale_reader_data)
+                stale_reader.feed_eof()
+            client._get_pool().append((stale_reader, FakeWriter()))
+            return await client._request('retry.bitrix24.ru', '/rest/',
+                                         b'{}')
+
+        with mock.patch.object(asyncio, 'open_connection', open_connection):
+            return asyncio.run(request()), opened
+
+    def test_closed_before_response_is_retried(self):
+        (status, data), opened = self.run_request(b'')
+        self.assertEqual((status, data), (200, b'{}'))
+        self.assertEqual(len(opened), 1)
+
+    def test_timeout_is_not_retried(self):
+        with self.assertRaises(PBx24RequestError):
+            self.run_request(None)
+
+    def test_closed_after_response_started_is_not_retried(self):
+        with self.assertRaises(PBx24RequestError):
+            self.run_request(b'HTTP/1.1 200 OK\r\nContent-Length: 10\r\n'
+                             b'\r\n{')
+
+
+class NamedLockTest(SimpleTestCase):
+    """Именованные блокировки внутри процесса (БД не MySQL)."""
+
+    def lock_in_thread(self, kind: str, *key, timeout: float = 0.05) -> bool:
+        """Попытаться получить блокировку из другого потока."""
+        result = []
+
+        def lock():
+            try:
+                with named_lock(kind, *key, timeout=timeout):
+                    result.append(True)
+            except LockTimeoutError:
+                result.append(False)
+
+        thread = threading.Thread(target=lock)
+        thread.start()
+        thread.join()
+        return result[0]
+
+    def test_same_key_is_exclusive(self):
+        with named_lock('exclusive', 1, 2):
+            self.assertFalse(self.lock_in_thread('exclusive', 1, 2))
+            self.assertTrue(self.lock_in_thread('exclusive', 1, 3))
+        self.assertTrue(self.lock_in_thread('exclusive', 1, 2))
+        metrics = get_lock_metrics()['exclusive']
+        self.assertEqual((metrics['acquired'], metrics['contended'],
+                          metrics['timeouts']), (3, 1, 1))
+
+    def test_released_on_error(self):
+        with self.assertRaises(ValueError):
+            with named_lock('error', 1):
+                raise ValueError
+        self.assertNotIn(_get_name('error', (1,)), _locks)
+        self.assertTrue(self.lock_in_thread('error', 1))
+
+    def test_long_name(self):
+        name = _get_name('long', ('x' * 100,))
+        self.assertLessEqual(len(name), MYSQL_NAME_LENGTH)
+        self.assertNotEqual(name, _get_name('long', ('y' * 100,)))
+
+    def test_async_lock(self):
+        async def hold():
+            async with named_lock_async('async', 1):
+                return await asyncio.to_thread(self.lock_in_thread,
+                                               'async', 1)
+
+        self.assertFalse(asyncio.run(hold()))
+        # Поток, державший блокировку, освобождает ее после выхода из блока
+        self.assertTrue(self.lock_in_thread('async', 1, timeout=5))
+
+
+class RefreshTokensTest(TestCase):
+    """Ошибка обновления токенов одного портала не останавливает остальные."""
+
+    def test_failed_portal_is_skipped(self):
+        for member_id in ('revoked', 'valid', 'empty'):
+            Portals.objects.create(member_id=member_id,
+                                   name='{}.bitrix24.ru'.format(member_id),
+                                   auth_id='auth', refresh_id='refresh')
+        Portals.objects.update(
+            auth_id_create_date=timezone.now() - timezone.timedelta(days=1))
+
+        def refresh_auth(portal, margin):
+            if portal.member_id == 'revoked':
+                raise PBx24RequestError('invalid_grant')
+            if portal.member_id == 'valid':
+                portal.auth_id_create_date = timezone.now()
+
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with mock.patch.object(Portals, 'refresh_auth', refresh_auth):
+            call_command('refreshtokens', stdout=stdout, stderr=stderr)
+        self.assertIn('valid.bitrix24.ru обновлены', stdout.getvalue())
+        self.assertIn('revoked.bitrix24.ru не обновлены', stderr.getvalue())
+        self.assertIn('empty.bitrix24.ru не обновлены', stderr.getvalue())
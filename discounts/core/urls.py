@@ -6,4 +6,5 @@ app_name = 'core'
 
 urlpatterns = [
     path('', views.install, name='install'),
+    path('status/', views.status, name='status'),
 ]
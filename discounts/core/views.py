@@ -1,8 +1,12 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
 from django.shortcuts import render
 from django.views.decorators.clickjacking import xframe_options_exempt
 from django.views.decorators.csrf import csrf_exempt
 from settings.models import SettingsPortal
 
+from .bitrix24.client import get_metrics
+from .locks import get_lock_metrics
 from .models import Portals
 
 
@@ -29,3 +33,11 @@ def install(request):
         SettingsPortal.objects.create(portal=portal)
 
     return render(request, 'core/install.html')
+
+
+@staff_member_required
+def status(request):
+    """Служебная страница состояния лимитов REST API по порталам и
+    ожидания блокировок."""
+    return JsonResponse({'portals': get_metrics(),
+                         'locks': get_lock_metrics()})
@@ -29,6 +29,7 @@ INSTALLED_APPS = [
     'settings',
     'activities',
     'volumes',
+    'replicas',
 ]
 
 MIDDLEWARE = [
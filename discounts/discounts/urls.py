@@ -5,5 +5,6 @@ urlpatterns = [
     path('', include('settings.urls', namespace='settings')),
     path('install/', include('core.urls', namespace='core')),
     path('activities/', include('activities.urls', namespace='activities')),
+    path('replicas/', include('replicas.urls', namespace='replicas')),
     path('admin/', admin.site.urls),
 ]
@@ -0,0 +1,66 @@
+from django.contrib import admin
+
+from .models import (CatalogProduct, Company, NomenclatureGroup,
+                     ProductDiscount, Requisite, RulesVersion,
+                     SmartProcessElement, SyncState)
+
+
+class NomenclatureGroupAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'group_id', 'is_active_accumulative',
+                    'is_active_sum_invoice', 'updated', 'portal')
+    list_filter = ('portal',)
+    search_fields = ('group_id',)
+
+
+class CatalogProductAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'product_id', 'nomenclature_group_id', 'updated',
+                    'portal')
+    list_filter = ('portal',)
+    search_fields = ('product_id', 'nomenclature_group_id')
+
+
+class CompanyAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'company_id', 'company_type', 'inn', 'updated',
+                    'portal')
+    list_filter = ('portal', 'company_type')
+    search_fields = ('company_id', 'inn')
+
+
+class RequisiteAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'requisite_id', 'entity_type_id', 'entity_id',
+                    'inn', 'updated', 'portal')
+    list_filter = ('portal', 'entity_type_id')
+    search_fields = ('inn', 'entity_id')
+
+
+class SmartProcessElementAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'smart_process_id', 'element_id', 'updated_time',
+                    'portal')
+    list_filter = ('portal', 'smart_process_id')
+    search_fields = ('element_id',)
+
+
+class ProductDiscountAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'company_id', 'product_id', 'discount_rate',
+                    'element_id', 'portal')
+    list_filter = ('portal',)
+    search_fields = ('company_id', 'product_id')
+
+
+class RulesVersionAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'version', 'portal')
+
+
+class SyncStateAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'name', 'synced', 'portal')
+    list_filter = ('portal',)
+
+
+admin.site.register(NomenclatureGroup, NomenclatureGroupAdmin)
+admin.site.register(CatalogProduct, CatalogProductAdmin)
+admin.site.register(Company, CompanyAdmin)
+admin.site.register(Requisite, RequisiteAdmin)
+admin.site.register(SmartProcessElement, SmartProcessElementAdmin)
+admin.site.register(ProductDiscount, ProductDiscountAdmin)
+admin.site.register(RulesVersion, RulesVersionAdmin)
+admin.site.register(SyncState, SyncStateAdmin)
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class ReplicasConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'replicas'
+    verbose_name = 'Локальные копии данных Битрикс24'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,82 @@
+from collections.abc import Iterable
+
+from core.bitrix24.bitrix24 import ProductB24
+from core.models import Portals
+from settings.models import SettingsPortal
+
+from .models import CatalogProduct
+from .sync import upsert
+
+SYNC_NAME: str = 'catalog_products'
+
+
+def get_products_nomenclature_groups(
+        portal: Portals, settings_portal: SettingsPortal,
+        products_ids: Iterable[int]
+) -> tuple[dict[int, int], dict[int, tuple[str, str]]]:
+    """Функция получения номенклатурных групп товаров каталога.
+
+    Группы берутся из локальной копии каталога одним запросом. Товары,
+    которых в копии нет, запрашиваются из Битрикс24 пакетом и сохраняются.
+    Возвращает словарь {id товара: id группы} (0, если группа не указана)
+    и словарь ошибок по id товаров, которые не удалось получить.
+    """
+    products_ids = {int(product_id) for product_id in products_ids}
+    products_groups = dict(CatalogProduct.objects.filter(
+        portal=portal, product_id__in=products_ids).values_list(
+        'product_id', 'nomenclature_group_id'))
+    missing_products = products_ids - products_groups.keys()
+    if not missing_products:
+        return products_groups, {}
+    try:
+        products_props, errors = ProductB24.get_properties_batch(
+            portal, missing_products,
+            select=settings_portal.get_select_product())
+    except RuntimeError:
+        return products_groups, {}
+    products_groups.update(save_products(
+        portal, settings_portal, products_props.values()))
+    return products_groups, errors
+
+
+def refresh_products(portal: Portals, settings_portal: SettingsPortal,
+                     products_ids: Iterable[int]) -> None:
+    """Функция обновления копии каталога по товарам Битрикс24.
+
+    Товары, которых больше нет в каталоге, удаляются из копии.
+    """
+    products_ids = {int(product_id) for product_id in products_ids}
+    products_props, errors = ProductB24.get_properties_batch(
+        portal, products_ids, select=settings_portal.get_select_product())
+    if errors:
+        raise RuntimeError(*next(iter(errors.values())))
+    save_products(portal, settings_portal, products_props.values())
+    CatalogProduct.objects.filter(
+        portal=portal,
+        product_id__in=products_ids - products_props.keys()).delete()
+
+
+def save_products(portal: Portals, settings_portal: SettingsPortal,
+                  products: Iterable[dict[str, any]]) -> dict[int, int]:
+    """Функция сохранения товаров каталога в локальную копию."""
+    catalog_products = [
+        CatalogProduct(
+            portal=portal,
+            product_id=int(product['ID']),
+            nomenclature_group_id=get_nomenclature_group_id(
+                product, settings_portal.code_nomenclature_group_id),
+        )
+        for product in products
+    ]
+    upsert(CatalogProduct, catalog_products, ['portal_id', 'product_id'],
+           ['nomenclature_group_id', 'updated'])
+    return {catalog_product.product_id: catalog_product.nomenclature_group_id
+            for catalog_product in catalog_products}
+
+
+def get_nomenclature_group_id(product: dict[str, any],
+                              code_nomenclature_group_id: str) -> int:
+    """Номенклатурная группа из свойства товара или 0."""
+    if not product.get(code_nomenclature_group_id):
+        return 0
+    return int(product.get(code_nomenclature_group_id).get('value'))
@@ -0,0 +1,49 @@
+from core.bitrix24.bitrix24 import CompanyB24
+from core.models import Portals
+from django.utils import timezone
+from settings.models import SettingsPortal
+
+from .models import Company, Requisite
+
+
+def get_company(portal: Portals, settings_portal: SettingsPortal,
+                company_id: int) -> Company:
+    """Функция получения типа и ИНН компании.
+
+    Компания берется из локального кэша, если она обновлялась не раньше
+    срока актуальности из настроек портала. Иначе тип и реквизит компании
+    запрашиваются одним пакетом и сохраняются в кэш.
+    """
+    company = Company.objects.filter(
+        portal=portal, company_id=company_id,
+        updated__gte=timezone.now() - timezone.timedelta(
+            seconds=settings_portal.companies_ttl)).first()
+    if company:
+        return company
+    properties, requisite = CompanyB24.get_with_requisite(
+        portal, company_id, select=['COMPANY_TYPE'])
+    company, _ = Company.objects.update_or_create(
+        portal=portal, company_id=company_id,
+        defaults={
+            'company_type': properties.get('COMPANY_TYPE'),
+            'inn': requisite.get('RQ_INN') if requisite else None,
+            'requisite_id': int(requisite['ID']) if requisite else None,
+        })
+    return company
+
+
+def invalidate_company(portal: Portals, company_id: int) -> None:
+    """Удалить компанию из кэша."""
+    Company.objects.filter(portal=portal, company_id=company_id).delete()
+
+
+def invalidate_requisite(portal: Portals, requisite_id: int) -> None:
+    """Удалить из кэша компании, к которым относится реквизит.
+
+    Компании ищутся по сохраненным id реквизита и владельцу реквизита в
+    индексе, поэтому удаленный реквизит не нужно получать из Битрикс24.
+    """
+    Company.objects.filter(portal=portal, requisite_id=requisite_id).delete()
+    owners = Requisite.objects.filter(
+        portal=portal, requisite_id=requisite_id).values('entity_id')
+    Company.objects.filter(portal=portal, company_id__in=owners).delete()
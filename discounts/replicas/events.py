@@ -0,0 +1,76 @@
+from core.models import Portals
+from settings.models import SettingsPortal
+
+from .catalog import refresh_products
+from .companies import invalidate_company, invalidate_requisite
+from .requisites import refresh_requisite
+from .nomenclature_groups import refresh_nomenclature_groups
+from .smart_processes import (get_entity_types, get_smart_processes,
+                              refresh_element)
+
+
+def nomenclature_group_changed(portal: Portals,
+                               settings_portal: SettingsPortal, data) -> None:
+    """Обработчик изменения элемента универсального списка."""
+    if (int(data.get('data[FIELDS][IBLOCK_ID]') or 0)
+            != settings_portal.id_uni_list_nomenclature_groups):
+        return
+    refresh_nomenclature_groups(portal, settings_portal,
+                                [int(data['data[FIELDS][ID]'])])
+
+
+def smart_process_element_changed(portal: Portals,
+                                  settings_portal: SettingsPortal,
+                                  data) -> None:
+    """Обработчик изменения элемента смарт процесса."""
+    entity_type_id = int(data['data[FIELDS][ENTITY_TYPE_ID]'])
+    for smart_process_id, smart_entity_type_id in get_entity_types(
+            portal, get_smart_processes(settings_portal)).items():
+        if smart_entity_type_id != entity_type_id:
+            continue
+        refresh_element(portal, settings_portal, smart_process_id,
+                        int(data['data[FIELDS][ID]']))
+
+
+def product_changed(portal: Portals, settings_portal: SettingsPortal,
+                    data) -> None:
+    """Обработчик изменения товара каталога."""
+    refresh_products(portal, settings_portal, [int(data['data[FIELDS][ID]'])])
+
+
+def company_changed(portal: Portals, settings_portal: SettingsPortal,
+                    data) -> None:
+    """Обработчик изменения компании."""
+    invalidate_company(portal, int(data['data[FIELDS][ID]']))
+
+
+def requisite_changed(portal: Portals, settings_portal: SettingsPortal,
+                      data) -> None:
+    """Обработчик изменения реквизита.
+
+    Кэш компаний сбрасывается по сохраненным данным до обновления
+    реквизита, чтобы не зависеть от ответа Битрикс24.
+    """
+    requisite_id = int(data['data[FIELDS][ID]'])
+    invalidate_requisite(portal, requisite_id)
+    requisite = refresh_requisite(portal, requisite_id)
+    if requisite:
+        invalidate_company(portal, int(requisite.get('ENTITY_ID') or 0))
+
+
+HANDLERS = {
+    'ONLISTSELEMENTADD': nomenclature_group_changed,
+    'ONLISTSELEMENTUPDATE': nomenclature_group_changed,
+    'ONLISTSELEMENTDELETE': nomenclature_group_changed,
+    'ONCRMDYNAMICITEMADD': smart_process_element_changed,
+    'ONCRMDYNAMICITEMUPDATE': smart_process_element_changed,
+    'ONCRMDYNAMICITEMDELETE': smart_process_element_changed,
+    'ONCRMPRODUCTADD': product_changed,
+    'ONCRMPRODUCTUPDATE': product_changed,
+    'ONCRMPRODUCTDELETE': product_changed,
+    'ONCRMCOMPANYUPDATE': company_changed,
+    'ONCRMCOMPANYDELETE': company_changed,
+    'ONCRMREQUISITEADD': requisite_changed,
+    'ONCRMREQUISITEUPDATE': requisite_changed,
+    'ONCRMREQUISITEDELETE': requisite_changed,
+}
@@ -0,0 +1,47 @@
+import secrets
+from urllib.parse import urlencode
+
+from core.bitrix24.bitrix24 import EventB24
+from core.models import Portals
+from django.core.management.base import BaseCommand
+from replicas.events import HANDLERS
+
+
+class Command(BaseCommand):
+    help = ('Устанавливает на порталы обработчики событий для обновления '
+            'локальных копий данных. Адрес обработчика содержит токен '
+            'портала, обработчики того же адреса с другим токеном удаляются')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'handler', help='Полный URL обработчика событий приложения')
+
+    def handle(self, *args, **options):
+        for portal in Portals.objects.all():
+            portal.check_auth()
+            if not portal.events_token:
+                portal.events_token = secrets.token_urlsafe(32)
+                portal.save(update_fields=['events_token'])
+            handler = '{}?{}'.format(options['handler'], urlencode(
+                {'token': portal.events_token}))
+            events_b24 = EventB24(portal, None)
+            bound = {(event.get('event').upper(), event.get('handler'))
+                     for event in events_b24.get_all_bound()}
+            for event, bound_handler in bound:
+                if (event in HANDLERS and bound_handler != handler
+                        and bound_handler.split('?')[0]
+                        == options['handler']):
+                    try:
+                        events_b24.unbind(event, bound_handler)
+                    except RuntimeError as ex:
+                        self.stderr.write(
+                            'Портал {}: обработчик {} события {} не удален: '
+                            '{}'.format(portal.name, bound_handler, event, ex))
+            for event in HANDLERS:
+                if (event, handler) in bound:
+                    continue
+                try:
+                    events_b24.bind(event, handler)
+                except RuntimeError as ex:
+                    self.stderr.write('Портал {}: событие {} не установлено: '
+                                      '{}'.format(portal.name, event, ex))
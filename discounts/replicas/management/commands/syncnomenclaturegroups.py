@@ -0,0 +1,35 @@
+from core.bitrix24.bitrix24 import ListB24
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from replicas.nomenclature_groups import SYNC_NAME, save_nomenclature_groups
+from replicas.sync import get_synced, set_synced
+from settings.models import SettingsPortal
+
+
+class Command(BaseCommand):
+    help = ('Обновляет индекс активности номенклатурных групп из '
+            'универсального списка')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Перечитать все элементы, а не только измененные')
+
+    def handle(self, *args, **options):
+        for settings_portal in SettingsPortal.objects.select_related(
+                'portal').filter(id_uni_list_nomenclature_groups__gt=0):
+            portal = settings_portal.portal
+            portal.check_auth()
+            started = timezone.now()
+            synced = None if options['full'] else get_synced(portal,
+                                                             SYNC_NAME)
+            uni_list = ListB24(
+                portal, settings_portal.id_uni_list_nomenclature_groups)
+            elements = uni_list.get_all_elements(
+                {'>=TIMESTAMP_X': synced.strftime('%d.%m.%Y %H:%M:%S')}
+                if synced else None)
+            count = len(save_nomenclature_groups(
+                portal, settings_portal, elements))
+            set_synced(portal, SYNC_NAME, started)
+            self.stdout.write('Портал {}: обновлено групп {}'.format(
+                portal.name, count))
@@ -0,0 +1,47 @@
+from core.bitrix24.bitrix24 import ProductB24
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from replicas.catalog import SYNC_NAME, save_products
+from replicas.models import CatalogProduct
+from replicas.sync import get_synced, set_synced
+from settings.models import SettingsPortal
+
+CHUNK_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = ('Обновляет локальную копию номенклатурных групп товаров '
+            'каталога')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Перечитать все товары, а не только измененные')
+
+    def handle(self, *args, **options):
+        for settings_portal in SettingsPortal.objects.select_related(
+                'portal'):
+            portal = settings_portal.portal
+            portal.check_auth()
+            started = timezone.now()
+            synced = None if options['full'] else get_synced(portal,
+                                                             SYNC_NAME)
+            products = ProductB24(portal, None).get_all(
+                settings_portal.get_select_product(),
+                {'>=DATE_MODIFY': synced.isoformat()} if synced else None)
+            count = 0
+            chunk = []
+            for product in products:
+                chunk.append(product)
+                if len(chunk) == CHUNK_SIZE:
+                    count += len(save_products(
+                        portal, settings_portal, chunk))
+                    chunk = []
+            count += len(save_products(portal, settings_portal, chunk))
+            # При полной синхронизации все оставшиеся товары обновлены
+            if synced is None:
+                CatalogProduct.objects.filter(
+                    portal=portal, updated__lt=started).delete()
+            set_synced(portal, SYNC_NAME, started)
+            self.stdout.write('Портал {}: обновлено товаров {}'.format(
+                portal.name, count))
@@ -0,0 +1,43 @@
+from core.bitrix24.bitrix24 import RequisiteB24
+from core.models import Portals
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from replicas.models import Requisite
+from replicas.requisites import REQUISITE_FIELDS, SYNC_NAME, save_requisites
+from replicas.sync import get_synced, set_synced
+
+CHUNK_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Обновляет локальный индекс ИНН реквизитов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Перечитать все реквизиты, а не только измененные')
+
+    def handle(self, *args, **options):
+        for portal in Portals.objects.all():
+            portal.check_auth()
+            started = timezone.now()
+            synced = None if options['full'] else get_synced(portal,
+                                                             SYNC_NAME)
+            requisites = RequisiteB24(portal, None).get_all(
+                REQUISITE_FIELDS,
+                {'>=DATE_MODIFY': synced.isoformat()} if synced else None)
+            count = 0
+            chunk = []
+            for requisite in requisites:
+                chunk.append(requisite)
+                if len(chunk) == CHUNK_SIZE:
+                    count += save_requisites(portal, chunk)
+                    chunk = []
+            count += save_requisites(portal, chunk)
+            # При полной синхронизации все оставшиеся реквизиты обновлены
+            if synced is None:
+                Requisite.objects.filter(
+                    portal=portal, updated__lt=started).delete()
+            set_synced(portal, SYNC_NAME, started)
+            self.stdout.write('Портал {}: обновлено реквизитов {}'.format(
+                portal.name, count))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from replicas.smart_processes import (get_smart_processes,
+                                      prune_smart_processes,
+                                      sync_smart_process)
+from settings.models import SettingsPortal
+
+
+class Command(BaseCommand):
+    help = ('Обновляет локальное хранилище элементов смарт процессов с '
+            'правилами скидок')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Перечитать все элементы, а не только измененные')
+
+    def handle(self, *args, **options):
+        for settings_portal in SettingsPortal.objects.select_related(
+                'portal'):
+            portal = settings_portal.portal
+            portal.check_auth()
+            prune_smart_processes(portal.pk, settings_portal)
+            for smart_process_id in get_smart_processes(settings_portal):
+                try:
+                    count = sync_smart_process(
+                        portal, settings_portal, smart_process_id,
+                        full=options['full'])
+                except RuntimeError as ex:
+                    self.stderr.write(
+                        'Портал {}: смарт процесс {} не обновлен: {}'.format(
+                            portal.name, smart_process_id, ex))
+                    continue
+                self.stdout.write(
+                    'Портал {}: смарт процесс {}, обновлено элементов '
+                    '{}'.format(portal.name, smart_process_id, count))
@@ -0,0 +1,279 @@
+from core.models import Portals
+from django.db import models
+
+
+class NomenclatureGroup(models.Model):
+    """Модель активности номенклатурной группы в расчете скидок."""
+    group_id = models.IntegerField(
+        verbose_name='ID номенклатурной группы',
+    )
+    is_active_accumulative = models.BooleanField(
+        verbose_name='Участвует в накопительных скидках',
+        default=False,
+    )
+    is_active_sum_invoice = models.BooleanField(
+        verbose_name='Участвует в разовых скидках по счету',
+        default=False,
+    )
+    updated = models.DateTimeField(
+        verbose_name='Дата обновления',
+        auto_now=True,
+    )
+    portal = models.ForeignKey(
+        Portals,
+        verbose_name='Портал',
+        related_name='nomenclature_groups',
+        on_delete=models.CASCADE,
+    )
+
+    class Meta:
+        verbose_name = 'Номенклатурная группа'
+        verbose_name_plural = 'Номенклатурные группы'
+        unique_together = ['portal', 'group_id']
+
+    def __str__(self):
+        return str(self.group_id)
+
+    def get_flags(self) -> dict[str, bool]:
+        """Активность группы по видам скидок."""
+        return {
+            'accumulative': self.is_active_accumulative,
+            'sum_invoice': self.is_active_sum_invoice,
+        }
+
+
+class CatalogProduct(models.Model):
+    """Модель номенклатурной группы товара каталога."""
+    product_id = models.IntegerField(
+        verbose_name='ID товара',
+    )
+    nomenclature_group_id = models.IntegerField(
+        verbose_name='ID номенклатурной группы',
+        help_text='0, если группа у товара не указана',
+        default=0,
+    )
+    updated = models.DateTimeField(
+        verbose_name='Дата обновления',
+        auto_now=True,
+    )
+    portal = models.ForeignKey(
+        Portals,
+        verbose_name='Портал',
+        related_name='catalog_products',
+        on_delete=models.CASCADE,
+    )
+
+    class Meta:
+        verbose_name = 'Товар каталога'
+        verbose_name_plural = 'Товары каталога'
+        unique_together = ['portal', 'product_id']
+
+    def __str__(self):
+        return str(self.product_id)
+
+
+class Company(models.Model):
+    """Модель типа и ИНН компании Битрикс24."""
+    company_id = models.IntegerField(
+        verbose_name='ID компании',
+    )
+    company_type = models.CharField(
+        verbose_name='Тип компании',
+        max_length=50,
+        blank=True,
+        null=True,
+    )
+    inn = models.CharField(
+        verbose_name='ИНН компании',
+        max_length=50,
+        blank=True,
+        null=True,
+    )
+    requisite_id = models.IntegerField(
+        verbose_name='ID реквизита с ИНН',
+        blank=True,
+        null=True,
+    )
+    updated = models.DateTimeField(
+        verbose_name='Дата обновления',
+        auto_now=True,
+    )
+    portal = models.ForeignKey(
+        Portals,
+        verbose_name='Портал',
+        related_name='companies',
+        on_delete=models.CASCADE,
+    )
+
+    class Meta:
+        verbose_name = 'Компания'
+        verbose_name_plural = 'Компании'
+        unique_together = ['portal', 'company_id']
+
+    def __str__(self):
+        return str(self.company_id)
+
+
+class Requisite(models.Model):
+    """Модель ИНН реквизита Битрикс24."""
+    requisite_id = models.IntegerField(
+        verbose_name='ID реквизита',
+    )
+    entity_type_id = models.IntegerField(
+        verbose_name='ID типа владельца',
+        blank=True,
+        null=True,
+    )
+    entity_id = models.IntegerField(
+        verbose_name='ID владельца',
+    )
+    inn = models.CharField(
+        verbose_name='ИНН',
+        max_length=50,
+        blank=True,
+        null=True,
+    )
+    updated = models.DateTimeField(
+        verbose_name='Дата обновления',
+        auto_now=True,
+    )
+    portal = models.ForeignKey(
+        Portals,
+        verbose_name='Портал',
+        related_name='requisites',
+        on_delete=models.CASCADE,
+    )
+
+    class Meta:
+        verbose_name = 'Реквизит'
+        verbose_name_plural = 'Реквизиты'
+        unique_together = ['portal', 'requisite_id']
+        indexes = [models.Index(fields=['portal', 'inn'])]
+
+    def __str__(self):
+        return str(self.requisite_id)
+
+
+class SmartProcessElement(models.Model):
+    """Модель элемента смарт процесса с правилами скидок."""
+    smart_process_id = models.IntegerField(
+        verbose_name='ID смарт процесса',
+    )
+    entity_type_id = models.IntegerField(
+        verbose_name='ID типа сущности смарт процесса',
+    )
+    element_id = models.IntegerField(
+        verbose_name='ID элемента',
+    )
+    fields = models.JSONField(
+        verbose_name='Поля элемента',
+        default=dict,
+    )
+    products = models.JSONField(
+        verbose_name='ID товаров элемента',
+        null=True,
+        blank=True,
+    )
+    updated_time = models.DateTimeField(
+        verbose_name='Дата изменения в Битрикс24',
+        null=True,
+        blank=True,
+    )
+    portal = models.ForeignKey(
+        Portals,
+        verbose_name='Портал',
+        related_name='smart_process_elements',
+        on_delete=models.CASCADE,
+    )
+
+    class Meta:
+        verbose_name = 'Элемент смарт процесса'
+        verbose_name_plural = 'Элементы смарт процессов'
+        unique_together = ['portal', 'smart_process_id', 'element_id']
+
+    def __str__(self):
+        return '{} ({})'.format(self.fields.get('title') or self.element_id,
+                                self.smart_process_id)
+
+
+class ProductDiscount(models.Model):
+    """Модель индекса скидок на товары для компаний."""
+    company_id = models.IntegerField(
+        verbose_name='ID компании',
+    )
+    product_id = models.IntegerField(
+        verbose_name='ID товара',
+    )
+    discount_rate = models.IntegerField(
+        verbose_name='Скидка',
+    )
+    element_id = models.IntegerField(
+        verbose_name='ID элемента смарт процесса',
+    )
+    portal = models.ForeignKey(
+        Portals,
+        verbose_name='Портал',
+        related_name='product_discounts',
+        on_delete=models.CASCADE,
+    )
+
+    class Meta:
+        verbose_name = 'Скидка на товар'
+        verbose_name_plural = 'Скидки на товары'
+        indexes = [
+            models.Index(fields=['portal', 'company_id', 'product_id']),
+            models.Index(fields=['portal', 'element_id']),
+        ]
+
+    def __str__(self):
+        return '{} - {}'.format(self.company_id, self.product_id)
+
+
+class RulesVersion(models.Model):
+    """Модель версии правил скидок портала.
+
+    Версия увеличивается при каждом изменении сохраненных элементов смарт
+    процессов.
+    """
+    version = models.PositiveBigIntegerField(
+        verbose_name='Версия',
+        default=0,
+    )
+    portal = models.OneToOneField(
+        Portals,
+        verbose_name='Портал',
+        related_name='rules_version',
+        on_delete=models.CASCADE,
+    )
+
+    class Meta:
+        verbose_name = 'Версия правил скидок'
+        verbose_name_plural = 'Версии правил скидок'
+
+    def __str__(self):
+        return str(self.version)
+
+
+class SyncState(models.Model):
+    """Модель состояния синхронизации локальной копии данных."""
+    name = models.CharField(
+        verbose_name='Код синхронизации',
+        max_length=50,
+    )
+    synced = models.DateTimeField(
+        verbose_name='Дата последней синхронизации',
+    )
+    portal = models.ForeignKey(
+        Portals,
+        verbose_name='Портал',
+        related_name='sync_states',
+        on_delete=models.CASCADE,
+    )
+
+    class Meta:
+        verbose_name = 'Состояние синхронизации'
+        verbose_name_plural = 'Состояния синхронизации'
+        unique_together = ['portal', 'name']
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,105 @@
+import logging
+from collections.abc import Iterable
+
+from core.bitrix24.bitrix24 import ListB24
+from core.models import Portals
+from django.utils import timezone
+from settings.models import SettingsPortal
+
+from .models import NomenclatureGroup
+from .sync import upsert
+
+SYNC_NAME: str = 'nomenclature_groups'
+
+logger = logging.getLogger(__name__)
+
+
+def get_nomenclature_groups_activity(
+        portal: Portals, settings_portal: SettingsPortal,
+        nomenclature_groups: Iterable[int]) -> dict[int, dict[str, bool]]:
+    """Функция получения активности номенклатурных групп.
+
+    Активность берется из локального индекса. Группы, которых нет в индексе
+    или которые не обновлялись дольше срока актуальности из настроек
+    портала, запрашиваются из универсального списка одним пакетом и
+    сохраняются в индекс. Возвращает словарь {id группы: {'accumulative':
+    bool, 'sum_invoice': bool}}. Если группы не удалось получить,
+    используется их устаревшая активность из индекса; групп, которых нет в
+    индексе, в словаре нет, и они считаются неактивными.
+    """
+    nomenclature_groups = {int(n_group) for n_group in nomenclature_groups}
+    actual_from = timezone.now() - timezone.timedelta(
+        seconds=settings_portal.nomenclature_groups_ttl)
+    groups_activity = {
+        group.group_id: group.get_flags()
+        for group in NomenclatureGroup.objects.filter(
+            portal=portal, group_id__in=nomenclature_groups,
+            updated__gte=actual_from)
+    }
+    missing_groups = nomenclature_groups - groups_activity.keys()
+    if missing_groups:
+        try:
+            groups_activity.update(refresh_nomenclature_groups(
+                portal, settings_portal, missing_groups))
+        except RuntimeError as ex:
+            logger.warning('Номенклатурные группы %s не получены: %s',
+                           sorted(missing_groups), ex)
+            groups_activity.update({
+                group.group_id: group.get_flags()
+                for group in NomenclatureGroup.objects.filter(
+                    portal=portal, group_id__in=missing_groups)
+            })
+    return groups_activity
+
+
+def refresh_nomenclature_groups(
+        portal: Portals, settings_portal: SettingsPortal,
+        nomenclature_groups: Iterable[int]) -> dict[int, dict[str, bool]]:
+    """Функция обновления индекса по элементам универсального списка.
+
+    Группы, которых больше нет в универсальном списке, удаляются из индекса.
+    """
+    nomenclature_groups = {int(n_group) for n_group in nomenclature_groups}
+    uni_list = ListB24(portal, settings_portal.id_uni_list_nomenclature_groups)
+    groups_activity = save_nomenclature_groups(
+        portal, settings_portal,
+        uni_list.get_elements_by_ids(nomenclature_groups).values())
+    NomenclatureGroup.objects.filter(
+        portal=portal,
+        group_id__in=nomenclature_groups - groups_activity.keys()
+    ).delete()
+    return groups_activity
+
+
+def save_nomenclature_groups(
+        portal: Portals, settings_portal: SettingsPortal,
+        uni_list_elements: Iterable[dict[str, any]]
+) -> dict[int, dict[str, bool]]:
+    """Функция сохранения элементов универсального списка в индекс."""
+    groups = [
+        NomenclatureGroup(
+            portal=portal,
+            group_id=int(uni_list_elem['ID']),
+            is_active_accumulative=_is_active(
+                uni_list_elem,
+                settings_portal.code_accumulative_uni_list_is_active,
+                settings_portal.accumulative_is_active_yes),
+            is_active_sum_invoice=_is_active(
+                uni_list_elem,
+                settings_portal.code_sum_invoice_uni_list_is_active,
+                settings_portal.sum_invoice_is_active_yes),
+        )
+        for uni_list_elem in uni_list_elements
+    ]
+    upsert(NomenclatureGroup, groups, ['portal_id', 'group_id'],
+           ['is_active_accumulative', 'is_active_sum_invoice', 'updated'])
+    return {group.group_id: group.get_flags() for group in groups}
+
+
+def _is_active(uni_list_elem: dict[str, any], property_is_active: str,
+               is_active_yes: str) -> bool:
+    """Значение поля активности элемента списка равно ответу Да."""
+    if not uni_list_elem.get(property_is_active):
+        return False
+    return (list(uni_list_elem.get(property_is_active).values())[0]
+            == is_active_yes)
@@ -0,0 +1,69 @@
+from collections.abc import Iterable
+
+from core.bitrix24.bitrix24 import RequisiteB24
+from core.models import Portals
+from settings.models import SettingsPortal
+
+from .models import Requisite
+from .sync import get_last_synced, upsert
+
+SYNC_NAME: str = 'requisites'
+REQUISITE_FIELDS: list[str] = ['ENTITY_TYPE_ID', 'ENTITY_ID', 'RQ_INN']
+
+
+def find_companies_by_inn(portal: Portals, settings_portal: SettingsPortal,
+                          inn: str) -> list[str]:
+    """Функция поиска владельцев реквизитов по ИНН.
+
+    Поиск выполняется по локальному индексу реквизитов. Пока индекс не
+    синхронизирован, а также если ИНН в нем не найден и в настройках
+    портала включена проверка, реквизиты ищутся в Битрикс24 и сохраняются
+    в индекс. Возвращает список id владельцев.
+    """
+    if get_last_synced(portal, SYNC_NAME) is not None:
+        entities_ids = Requisite.objects.filter(
+            portal=portal, inn=inn).order_by('requisite_id').values_list(
+            'entity_id', flat=True)
+        if entities_ids or not settings_portal.inn_index_verify:
+            return [str(entity_id) for entity_id in entities_ids]
+    requisites = RequisiteB24(portal, 0).list(
+        {'RQ_INN': inn}, select=['ID', *REQUISITE_FIELDS])
+    save_requisites(portal, requisites)
+    return [requisite.get('ENTITY_ID') for requisite in requisites]
+
+
+def refresh_requisite(portal: Portals,
+                      requisite_id: int) -> dict[str, any] or None:
+    """Функция обновления реквизита в индексе.
+
+    Реквизит запрашивается списком с фильтром по id: для отсутствующего id
+    crm.requisite.get возвращает ошибку без кода, а пустой список однозначно
+    означает, что реквизит удален. Такой реквизит удаляется из индекса.
+    Возвращает свойства реквизита или None.
+    """
+    requisites = RequisiteB24(portal, 0).list(
+        {'ID': requisite_id}, select=['ID', *REQUISITE_FIELDS])
+    if requisites:
+        save_requisites(portal, requisites[:1])
+        return requisites[0]
+    Requisite.objects.filter(
+        portal=portal, requisite_id=requisite_id).delete()
+    return None
+
+
+def save_requisites(portal: Portals,
+                    requisites: Iterable[dict[str, any]]) -> int:
+    """Функция сохранения реквизитов в индекс."""
+    requisites = [
+        Requisite(
+            portal=portal,
+            requisite_id=int(requisite['ID']),
+            entity_type_id=int(requisite.get('ENTITY_TYPE_ID') or 0) or None,
+            entity_id=int(requisite.get('ENTITY_ID') or 0),
+            inn=requisite.get('RQ_INN') or None,
+        )
+        for requisite in requisites
+    ]
+    upsert(Requisite, requisites, ['portal_id', 'requisite_id'],
+           ['entity_type_id', 'entity_id', 'inn', 'updated'])
+    return len(requisites)
@@ -0,0 +1,47 @@
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+from settings.models import SettingsPortal
+
+from . import catalog, nomenclature_groups
+from .models import CatalogProduct, NomenclatureGroup, SyncState
+from .smart_processes import prune_smart_processes
+
+# Копии, их синхронизации и настройки портала, от которых зависят данные
+REPLICAS_SETTINGS = [
+    (NomenclatureGroup, nomenclature_groups.SYNC_NAME, [
+        'id_uni_list_nomenclature_groups',
+        'code_accumulative_uni_list_is_active',
+        'accumulative_is_active_yes',
+        'code_sum_invoice_uni_list_is_active',
+        'sum_invoice_is_active_yes',
+    ]),
+    (CatalogProduct, catalog.SYNC_NAME, ['code_nomenclature_group_id']),
+]
+
+
+@receiver(pre_save, sender=SettingsPortal)
+def settings_portal_saving(sender, instance, **kwargs):
+    """Запомнить сохраненные настройки, от которых зависят копии."""
+    instance._replicas_settings = SettingsPortal.objects.filter(
+        pk=instance.pk).values(*[
+            field for _, _, fields in REPLICAS_SETTINGS for field in fields
+        ]).first() if instance.pk else None
+
+
+@receiver(post_save, sender=SettingsPortal)
+def settings_portal_changed(sender, instance, **kwargs):
+    """Копии, данные которых зависят от измененных настроек, сбрасываются
+    вместе с датой их синхронизации, чтобы следующая синхронизация была
+    полной. Смарт процессы, которых больше нет в настройках, удаляются."""
+    previous = getattr(instance, '_replicas_settings', None)
+    for model, sync_name, fields in REPLICAS_SETTINGS:
+        if previous is not None and all(
+                previous[field] == getattr(instance, field)
+                for field in fields):
+            continue
+        with transaction.atomic():
+            model.objects.filter(portal_id=instance.portal_id).delete()
+            SyncState.objects.filter(portal_id=instance.portal_id,
+                                     name=sync_name).delete()
+    prune_smart_processes(instance.portal_id, instance)
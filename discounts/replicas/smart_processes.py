@@ -0,0 +1,302 @@
+import threading
+from collections.abc import Iterable
+
+from core.bitrix24.bitrix24 import SmartProcessB24
+from core.models import Portals
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from settings.models import SettingsPortal
+
+from .models import (ProductDiscount, RulesVersion, SmartProcessElement,
+                     SyncState)
+from .sync import get_last_synced, get_synced, set_synced, upsert
+
+SYNC_NAME: str = 'smart_process_{}'
+PRODUCT_DISCOUNTS_SYNC_NAME: str = 'product_discounts'
+
+_rules: dict[tuple[int, int], tuple[int, list[SmartProcessElement]]] = {}
+_entity_types: dict[tuple[int, int], int] = {}
+_lock = threading.Lock()
+
+
+def get_smart_processes(settings_portal: SettingsPortal) -> dict[int, bool]:
+    """Смарт процессы с правилами скидок из настроек портала.
+
+    Возвращает словарь {id смарт процесса: нужны ли товары элементов}.
+    """
+    smart_processes = {
+        settings_portal.id_smart_process_partner: False,
+        settings_portal.id_smart_process_sum_invoice: False,
+        settings_portal.id_smart_process_accumulative: False,
+    }
+    smart_processes[settings_portal.id_smart_process_discount_product] = True
+    return {smart_process_id: with_products for smart_process_id, with_products
+            in smart_processes.items() if smart_process_id > 0}
+
+
+def get_rules(portal: Portals, settings_portal: SettingsPortal,
+              smart_process_id: int) -> list[SmartProcessElement]:
+    """Функция получения элементов смарт процесса из локального хранилища.
+
+    Элементы хранятся в памяти процесса до смены версии правил портала.
+    """
+    ensure_synced(portal, settings_portal, smart_process_id)
+    version = get_version(portal)
+    with _lock:
+        entry = _rules.get((portal.pk, smart_process_id))
+    if entry and entry[0] == version:
+        return list(entry[1])
+    elements = list(SmartProcessElement.objects.filter(
+        portal=portal, smart_process_id=smart_process_id).order_by(
+        'element_id'))
+    with _lock:
+        _rules[(portal.pk, smart_process_id)] = (version, elements)
+    return list(elements)
+
+
+def get_product_discounts(portal: Portals, settings_portal: SettingsPortal,
+                          company_id: int,
+                          products_ids: Iterable[int]) -> dict[int, int]:
+    """Функция получения скидок на товары компании из индекса.
+
+    Если товар указан в нескольких элементах смарт процесса, действует
+    элемент с наибольшим id. Возвращает словарь {id товара: скидка}.
+    """
+    ensure_synced(portal, settings_portal,
+                  settings_portal.id_smart_process_discount_product)
+    if get_last_synced(portal, PRODUCT_DISCOUNTS_SYNC_NAME) is None:
+        update_product_discounts(portal, settings_portal)
+    return dict(ProductDiscount.objects.filter(
+        portal=portal, company_id=company_id,
+        product_id__in=[int(product_id) for product_id in products_ids]
+    ).order_by('element_id').values_list('product_id', 'discount_rate'))
+
+
+def ensure_synced(portal: Portals, settings_portal: SettingsPortal,
+                  smart_process_id: int) -> None:
+    """Функция проверки актуальности хранилища смарт процесса.
+
+    Если смарт процесс еще не синхронизировался, он загружается полностью.
+    Если синхронизация была раньше срока актуальности из настроек портала,
+    дозагружаются элементы, измененные с момента синхронизации.
+    """
+    synced = get_last_synced(portal, SYNC_NAME.format(smart_process_id))
+    if synced is None or synced < timezone.now() - timezone.timedelta(
+            seconds=settings_portal.smart_processes_ttl):
+        sync_smart_process(portal, settings_portal, smart_process_id,
+                           full=synced is None)
+
+
+def get_version(portal: Portals) -> int:
+    """Текущая версия правил скидок портала."""
+    return RulesVersion.objects.filter(portal=portal).values_list(
+        'version', flat=True).first() or 0
+
+
+def increment_version(portal: Portals) -> None:
+    """Увеличить версию правил скидок портала."""
+    RulesVersion.objects.get_or_create(portal=portal)
+    RulesVersion.objects.filter(portal=portal).update(
+        version=F('version') + 1)
+
+
+def sync_smart_process(portal: Portals, settings_portal: SettingsPortal,
+                       smart_process_id: int, full: bool = False) -> int:
+    """Функция синхронизации элементов смарт процесса.
+
+    Без full запрашиваются только элементы, измененные с последней
+    синхронизации. При полной синхронизации удаляются элементы, которых
+    больше нет в Битрикс24. Возвращает количество измененных элементов.
+    """
+    name = SYNC_NAME.format(smart_process_id)
+    started = timezone.now()
+    synced = None if full else get_synced(portal, name)
+    smart_process = SmartProcessB24(portal, smart_process_id)
+    elements = list(smart_process.get_all_elements(
+        filter={'>=updatedTime': synced.isoformat()} if synced else None))
+    changed = save_elements(
+        portal, smart_process, elements,
+        get_smart_processes(settings_portal).get(smart_process_id, False))
+    if synced is None:
+        deleted = SmartProcessElement.objects.filter(
+            portal=portal, smart_process_id=smart_process_id).exclude(
+            element_id__in=[int(element['id']) for element in elements])
+        changed.extend(deleted.values_list('element_id', flat=True))
+        deleted.delete()
+    elements_changed(portal, settings_portal, smart_process_id, changed)
+    set_synced(portal, name, started)
+    return len(changed)
+
+
+def refresh_element(portal: Portals, settings_portal: SettingsPortal,
+                    smart_process_id: int, element_id: int) -> None:
+    """Функция обновления одного элемента смарт процесса.
+
+    Элемент, которого больше нет в Битрикс24, удаляется из хранилища.
+    """
+    smart_process = SmartProcessB24(portal, smart_process_id)
+    try:
+        elements = [smart_process.get_element(element_id)]
+    except RuntimeError as ex:
+        if ex.args[0] != 'NOT_FOUND':
+            raise
+        elements = []
+    changed = save_elements(
+        portal, smart_process, elements,
+        get_smart_processes(settings_portal).get(smart_process_id, False))
+    if not elements:
+        deleted, _ = SmartProcessElement.objects.filter(
+            portal=portal, smart_process_id=smart_process_id,
+            element_id=element_id).delete()
+        if deleted:
+            changed.append(element_id)
+    elements_changed(portal, settings_portal, smart_process_id, changed)
+
+
+def elements_changed(portal: Portals, settings_portal: SettingsPortal,
+                     smart_process_id: int, elements_ids: list[int]) -> None:
+    """Функция учета изменения элементов смарт процесса в хранилище."""
+    if not elements_ids:
+        return
+    increment_version(portal)
+    if (smart_process_id
+            == settings_portal.id_smart_process_discount_product):
+        update_product_discounts(portal, settings_portal, elements_ids)
+
+
+def save_elements(portal: Portals, smart_process: SmartProcessB24,
+                  elements: Iterable[dict[str, any]],
+                  with_products: bool) -> list[int]:
+    """Функция сохранения элементов смарт процесса в хранилище.
+
+    Сохраняются только элементы с новой датой изменения или другим
+    составом товаров. Возвращает id сохраненных элементов.
+    """
+    elements = {int(element['id']): element for element in elements}
+    products = {}
+    if with_products and elements:
+        products, errors = smart_process.get_products_batch(elements)
+        if errors:
+            raise RuntimeError(*next(iter(errors.values())))
+    stored = {
+        element.element_id: (element.updated_time, element.products)
+        for element in SmartProcessElement.objects.filter(
+            portal=portal, smart_process_id=smart_process.id,
+            element_id__in=elements)
+    }
+    changed = []
+    for element_id, element in elements.items():
+        updated_time = (parse_datetime(element['updatedTime'])
+                        if element.get('updatedTime') else None)
+        element_products = ([product['productId'] for product in
+                             products.get(element_id) or []]
+                            if with_products else None)
+        if stored.get(element_id) == (updated_time, element_products):
+            continue
+        changed.append(SmartProcessElement(
+            portal=portal,
+            smart_process_id=smart_process.id,
+            entity_type_id=smart_process.entity_type_id,
+            element_id=element_id,
+            fields=element,
+            products=element_products,
+            updated_time=updated_time,
+        ))
+    upsert(SmartProcessElement, changed,
+           ['portal_id', 'smart_process_id', 'element_id'],
+           ['entity_type_id', 'fields', 'products', 'updated_time'])
+    return [element.element_id for element in changed]
+
+
+def update_product_discounts(portal: Portals, settings_portal: SettingsPortal,
+                             elements_ids: Iterable[int] = None) -> None:
+    """Функция обновления индекса скидок на товары.
+
+    Индекс строится по сохраненным элементам смарт процесса "Скидка на
+    товар": одна строка на каждый товар элемента. Без elements_ids индекс
+    портала перестраивается полностью.
+    """
+    code_discount = settings_portal.code_discount_smart_discount_product
+    elements = SmartProcessElement.objects.filter(
+        portal=portal,
+        smart_process_id=settings_portal.id_smart_process_discount_product)
+    product_discounts = ProductDiscount.objects.filter(portal=portal)
+    if elements_ids is not None:
+        elements = elements.filter(element_id__in=elements_ids)
+        product_discounts = product_discounts.filter(
+            element_id__in=elements_ids)
+    rows = [
+        ProductDiscount(
+            portal=portal,
+            company_id=int(element.fields['companyId']),
+            product_id=int(product_id),
+            discount_rate=int(element.fields[code_discount]),
+            element_id=element.element_id,
+        )
+        for element in elements
+        if element.fields.get(code_discount) and element.fields.get(
+            'companyId')
+        for product_id in element.products or []
+    ]
+    with transaction.atomic():
+        product_discounts.delete()
+        ProductDiscount.objects.bulk_create(rows)
+    if elements_ids is None:
+        set_synced(portal, PRODUCT_DISCOUNTS_SYNC_NAME, timezone.now())
+
+
+def get_entity_types(portal: Portals,
+                     smart_processes_ids: Iterable[int]) -> dict[int, int]:
+    """Идентификаторы типов сущностей смарт процессов.
+
+    Типы, которых нет в памяти процесса и в хранилище, запрашиваются одним
+    пакетом. Возвращает словарь {id смарт процесса: id типа сущности}.
+    """
+    with _lock:
+        entity_types = {
+            smart_process_id: _entity_types[(portal.pk, smart_process_id)]
+            for smart_process_id in smart_processes_ids
+            if (portal.pk, smart_process_id) in _entity_types
+        }
+    missing = set(smart_processes_ids) - entity_types.keys()
+    entity_types.update(SmartProcessElement.objects.filter(
+        portal=portal, smart_process_id__in=missing).values_list(
+        'smart_process_id', 'entity_type_id').distinct())
+    smart_processes = [SmartProcessB24(portal, smart_process_id)
+                       for smart_process_id in missing - entity_types.keys()]
+    SmartProcessB24.prefetch(*smart_processes)
+    for smart_process in smart_processes:
+        entity_types[smart_process.id] = smart_process.entity_type_id
+    with _lock:
+        for smart_process_id, entity_type_id in entity_types.items():
+            _entity_types[(portal.pk, smart_process_id)] = entity_type_id
+    return entity_types
+
+
+def prune_smart_processes(portal_id: int,
+                          settings_portal: SettingsPortal) -> None:
+    """Функция удаления из хранилища смарт процессов, которых больше нет в
+    настройках портала.
+
+    Если смарт процесс стал использоваться для скидок на товар, а товары
+    его элементов не сохранялись, он будет загружен заново полностью.
+    Индекс скидок на товары перестраивается при следующем обращении.
+    """
+    smart_processes = get_smart_processes(settings_portal)
+    SmartProcessElement.objects.filter(portal_id=portal_id).exclude(
+        smart_process_id__in=smart_processes).delete()
+    SyncState.objects.filter(
+        portal_id=portal_id, name__startswith=SYNC_NAME.format('')).exclude(
+        name__in=[SYNC_NAME.format(smart_process_id)
+                  for smart_process_id in smart_processes]).delete()
+    product_process_id = settings_portal.id_smart_process_discount_product
+    if SmartProcessElement.objects.filter(
+            portal_id=portal_id, smart_process_id=product_process_id,
+            products__isnull=True).exists():
+        SyncState.objects.filter(
+            portal_id=portal_id,
+            name=SYNC_NAME.format(product_process_id)).delete()
+    SyncState.objects.filter(
+        portal_id=portal_id, name=PRODUCT_DISCOUNTS_SYNC_NAME).delete()
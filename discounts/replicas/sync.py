@@ -0,0 +1,45 @@
+from collections.abc import Iterable
+
+from core.models import Portals
+from django.db import connections, models, router
+from django.utils import timezone
+
+from .models import SyncState
+
+# Запас на расхождение часовых поясов портала и приложения
+SYNC_OVERLAP = timezone.timedelta(days=1)
+
+
+def get_last_synced(portal: Portals, name: str):
+    """Дата последней синхронизации или None."""
+    return SyncState.objects.filter(portal=portal, name=name).values_list(
+        'synced', flat=True).first()
+
+
+def get_synced(portal: Portals, name: str):
+    """Дата последней синхронизации с запасом или None."""
+    synced = get_last_synced(portal, name)
+    return synced - SYNC_OVERLAP if synced else None
+
+
+def set_synced(portal: Portals, name: str, synced) -> None:
+    """Сохранить дату синхронизации."""
+    SyncState.objects.update_or_create(
+        portal=portal, name=name, defaults={'synced': synced})
+
+
+def upsert(model: type[models.Model], objs: Iterable[models.Model],
+           unique_fields: list[str], update_fields: list[str]) -> None:
+    """Сохранить записи копии, обновив уже существующие.
+
+    MySQL не позволяет указать поля конфликта: ON DUPLICATE KEY UPDATE
+    срабатывает по уникальным ключам таблицы, поэтому на нем unique_fields
+    не передаются. У моделей копий единственный уникальный ключ, кроме
+    первичного, совпадает с unique_fields.
+    """
+    connection = connections[router.db_for_write(model)]
+    if not connection.features.supports_update_conflicts_with_target:
+        unique_fields = None
+    model.objects.bulk_create(objs, update_conflicts=True,
+                              unique_fields=unique_fields,
+                              update_fields=update_fields)
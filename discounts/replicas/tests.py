@@ -0,0 +1,269 @@
+from unittest import mock
+
+from core.bitrix24.client import Bitrix24Client
+from core.models import Portals
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from settings.models import SettingsPortal
+
+from . import views
+from .events import requisite_changed
+from .models import (CatalogProduct, Company, NomenclatureGroup, Requisite,
+                     SyncState)
+from .nomenclature_groups import (get_nomenclature_groups_activity,
+                                  save_nomenclature_groups)
+from .requisites import refresh_requisite
+
+
+def create_portal(member_id: str = 'member') -> Portals:
+    """Портал с настройками для тестов."""
+    portal = Portals.objects.create(
+        member_id=member_id, name='test.bitrix24.ru', auth_id='auth',
+        refresh_id='refresh')
+    SettingsPortal.objects.create(
+        portal=portal,
+        code_accumulative_uni_list_is_active='PROPERTY_1',
+        accumulative_is_active_yes='Y',
+        code_sum_invoice_uni_list_is_active='PROPERTY_2',
+        sum_invoice_is_active_yes='Y',
+    )
+    return portal
+
+
+def uni_list_element(group_id: int, accumulative: str,
+                     sum_invoice: str) -> dict[str, any]:
+    return {'ID': str(group_id), 'PROPERTY_1': {'1': accumulative},
+            'PROPERTY_2': {'1': sum_invoice}}
+
+
+class UpsertTest(TestCase):
+    """Сохранение копий на настроенной БД."""
+
+    def setUp(self):
+        self.portal = create_portal()
+        self.settings_portal = self.portal.settingsportal
+
+    def test_insert_then_update(self):
+        save_nomenclature_groups(self.portal, self.settings_portal, [
+            uni_list_element(1, 'Y', 'Y'), uni_list_element(2, 'N', 'Y')])
+        groups_activity = save_nomenclature_groups(
+            self.portal, self.settings_portal, [
+                uni_list_element(1, 'N', 'Y'), uni_list_element(3, 'Y', 'N')])
+        self.assertEqual(groups_activity[1],
+                         {'accumulative': False, 'sum_invoice': True})
+        self.assertEqual(
+            sorted(NomenclatureGroup.objects.filter(
+                portal=self.portal).values_list(
+                'group_id', 'is_active_accumulative',
+                'is_active_sum_invoice')),
+            [(1, False, True), (2, False, True), (3, True, False)])
+
+    def test_portals_do_not_conflict(self):
+        other_portal = create_portal('other')
+        save_nomenclature_groups(self.portal, self.settings_portal,
+                                 [uni_list_element(1, 'Y', 'Y')])
+        save_nomenclature_groups(other_portal, other_portal.settingsportal,
+                                 [uni_list_element(1, 'N', 'N')])
+        self.assertEqual(NomenclatureGroup.objects.filter(group_id=1).count(),
+                         2)
+
+    def test_no_conflict_target_without_support(self):
+        """На MySQL поля конфликта не передаются."""
+        with mock.patch.object(
+                connection.features, 'supports_update_conflicts_with_target',
+                False), mock.patch.object(
+                NomenclatureGroup.objects, 'bulk_create') as bulk_create:
+            save_nomenclature_groups(self.portal, self.settings_portal,
+                                     [uni_list_element(1, 'Y', 'Y')])
+        self.assertIsNone(bulk_create.call_args.kwargs['unique_fields'])
+        self.assertTrue(bulk_create.call_args.kwargs['update_conflicts'])
+
+
+class NomenclatureGroupsActivityTest(TestCase):
+    """Активность номенклатурных групп при ошибке Битрикс24."""
+
+    def setUp(self):
+        self.portal = create_portal()
+        self.settings_portal = self.portal.settingsportal
+
+    def test_failed_refresh_keeps_stale_groups(self):
+        save_nomenclature_groups(self.portal, self.settings_portal,
+                                 [uni_list_element(1, 'Y', 'N')])
+        NomenclatureGroup.objects.update(
+            updated=timezone.now() - timezone.timedelta(days=30))
+        with mock.patch.object(Bitrix24Client, 'call_batch', return_value={
+                'result': {'result': [], 'result_error': {'group_0': {
+                    'error': 'QUERY_LIMIT_EXCEEDED',
+                    'error_description': 'Too many requests'}}}}):
+            groups_activity = get_nomenclature_groups_activity(
+                self.portal, self.settings_portal, [1, 2])
+        self.assertEqual(groups_activity,
+                         {1: {'accumulative': True, 'sum_invoice': False}})
+        self.assertTrue(NomenclatureGroup.objects.filter(group_id=1).exists())
+
+
+class SettingsPortalChangedTest(TestCase):
+    """Сброс копий при изменении настроек портала."""
+
+    def setUp(self):
+        self.portal = create_portal()
+        self.settings_portal = self.portal.settingsportal
+        NomenclatureGroup.objects.create(portal=self.portal, group_id=1)
+        CatalogProduct.objects.create(portal=self.portal, product_id=1,
+                                      nomenclature_group_id=1)
+        for name in ('nomenclature_groups', 'catalog_products'):
+            SyncState.objects.create(portal=self.portal, name=name,
+                                     synced=timezone.now())
+
+    def get_state(self) -> tuple[int, int, list[str]]:
+        return (NomenclatureGroup.objects.count(),
+                CatalogProduct.objects.count(),
+                sorted(SyncState.objects.values_list('name', flat=True)))
+
+    def test_unrelated_setting_keeps_replicas(self):
+        self.settings_portal.run_in_background = True
+        self.settings_portal.save()
+        self.assertEqual(self.get_state(), (
+            1, 1, ['catalog_products', 'nomenclature_groups']))
+
+    def test_catalog_setting_resets_catalog(self):
+        self.settings_portal.code_nomenclature_group_id = 'PROPERTY_9'
+        self.settings_portal.save()
+        self.assertEqual(self.get_state(), (1, 0, ['nomenclature_groups']))
+
+    def test_uni_list_setting_resets_nomenclature_groups(self):
+        self.settings_portal.accumulative_is_active_yes = 'Да'
+        self.settings_portal.save()
+        self.assertEqual(self.get_state(), (0, 1, ['catalog_products']))
+
+
+class EventAuthTest(TestCase):
+    """Обработчик событий принимает только события этого приложения."""
+
+    def setUp(self):
+        self.portal = create_portal()
+        Portals.objects.filter(pk=self.portal.pk).update(events_token='secret')
+        self.handler = mock.Mock()
+        patcher = mock.patch.dict(views.HANDLERS,
+                                  {'ONCRMPRODUCTUPDATE': self.handler})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def send(self, token: str or None, application_token: str) -> int:
+        url = reverse('replicas:event')
+        if token is not None:
+            url += '?token=' + token
+        return self.client.post(url, {
+            'event': 'ONCRMPRODUCTUPDATE',
+            'data[FIELDS][ID]': '1',
+            'auth[member_id]': 'member',
+            'auth[application_token]': application_token,
+        }).status_code
+
+    def test_wrong_events_token_is_rejected(self):
+        self.assertEqual(self.send(None, 'app'), 403)
+        self.assertEqual(self.send('wrong', 'app'), 403)
+        self.handler.assert_not_called()
+        self.assertEqual(Portals.objects.get().application_token, '')
+
+    def test_application_token_is_pinned(self):
+        self.assertEqual(self.send('secret', 'app'), 200)
+        self.assertEqual(Portals.objects.get().application_token, 'app')
+        self.assertEqual(self.send('secret', 'other'), 403)
+        self.assertEqual(self.send('secret', 'app'), 200)
+        self.assertEqual(self.handler.call_count, 2)
+
+    def test_portal_without_events_token_is_rejected(self):
+        Portals.objects.update(events_token='')
+        self.assertEqual(self.send('', 'app'), 403)
+        self.handler.assert_not_called()
+
+
+class FakePortalCall:
+    """Ответы REST API Битрикс24 на реквизиты в формате портала."""
+
+    def __init__(self, requisites: list[dict[str, any]]):
+        self.requisites = requisites
+        self.methods = []
+
+    def __call__(self, method, params=None):
+        self.methods.append(method)
+        if method == 'crm.requisite.get':
+            found = [requisite for requisite in self.requisites
+                     if int(requisite['ID']) == int(params['id'])]
+            if not found:
+                return {'error': '', 'error_description': 'Not found'}
+            return {'result': found[0]}
+        if method == 'crm.requisite.list':
+            return {'result': [
+                requisite for requisite in self.requisites
+                if int(requisite['ID']) == int(params['filter']['ID'])]}
+        return {'error': 'ERROR_METHOD_NOT_FOUND',
+                'error_description': method}
+
+
+class RefreshRequisiteTest(TestCase):
+    """Обновление реквизита в индексе."""
+
+    def setUp(self):
+        self.portal = create_portal()
+        Requisite.objects.create(portal=self.portal, requisite_id=7,
+                                 entity_type_id=4, entity_id=5,
+                                 inn='7700000000')
+
+    def patch_call(self, requisites: list[dict[str, any]]) -> None:
+        patcher = mock.patch.object(Bitrix24Client, 'call',
+                                    FakePortalCall(requisites))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_deleted_requisite_is_removed(self):
+        self.patch_call([])
+        self.assertIsNone(refresh_requisite(self.portal, 7))
+        self.assertFalse(Requisite.objects.exists())
+
+    def test_changed_requisite_is_saved(self):
+        self.patch_call([{'ID': '7', 'ENTITY_TYPE_ID': '4', 'ENTITY_ID': '6',
+                          'RQ_INN': '7800000000'}])
+        self.assertEqual(refresh_requisite(self.portal, 7)['ENTITY_ID'], '6')
+        self.assertEqual(
+            list(Requisite.objects.values_list('entity_id', 'inn')),
+            [(6, '7800000000')])
+
+
+class RequisiteChangedTest(TestCase):
+    """Событие реквизита сбрасывает кэш компаний до обновления индекса."""
+
+    def setUp(self):
+        self.portal = create_portal()
+        Requisite.objects.create(portal=self.portal, requisite_id=7,
+                                 entity_type_id=4, entity_id=5,
+                                 inn='7700000000')
+        Company.objects.create(portal=self.portal, company_id=5,
+                               inn='7700000000', requisite_id=3)
+
+    def send(self, requisites: list[dict[str, any]] or None) -> None:
+        call = FakePortalCall(requisites or [])
+        if requisites is None:
+            call = mock.Mock(side_effect=RuntimeError('QUERY_LIMIT_EXCEEDED'))
+        with mock.patch.object(Bitrix24Client, 'call', call):
+            requisite_changed(self.portal, self.portal.settingsportal,
+                              {'data[FIELDS][ID]': '7'})
+
+    def test_deleted_requisite(self):
+        self.send([])
+        self.assertFalse(Company.objects.exists())
+        self.assertFalse(Requisite.objects.exists())
+
+    def test_refresh_failure_still_invalidates(self):
+        with self.assertRaises(RuntimeError):
+            self.send(None)
+        self.assertFalse(Company.objects.exists())
+
+    def test_requisite_moved_to_other_company(self):
+        Company.objects.create(portal=self.portal, company_id=6)
+        self.send([{'ID': '7', 'ENTITY_TYPE_ID': '4', 'ENTITY_ID': '6',
+                    'RQ_INN': '7700000000'}])
+        self.assertFalse(Company.objects.exists())
@@ -0,0 +1,9 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'replicas'
+
+urlpatterns = [
+    path('event/', views.event, name='event'),
+]
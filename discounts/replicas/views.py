@@ -0,0 +1,67 @@
+import hmac
+import logging
+from http import HTTPStatus
+
+from core.models import Portals
+from django.core.exceptions import ObjectDoesNotExist
+from django.http import HttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from settings.cache import get_portal_settings, invalidate
+
+from .events import HANDLERS
+
+logger = logging.getLogger(__name__)
+
+
+def is_event_authentic(portal: Portals, request) -> bool:
+    """Проверить, что событие отправлено Битрикс24 этому приложению.
+
+    Адрес обработчика, установленный командой bindevents, содержит токен
+    портала. Битрикс24 не возвращает токен приложения при установке
+    обработчиков, поэтому он сохраняется из первого события с верным токеном
+    обработчика, а события с другим токеном приложения отклоняются.
+    """
+    events_token = request.GET.get('token') or ''
+    application_token = request.POST.get('auth[application_token]') or ''
+    if (not portal.events_token or not application_token
+            or not hmac.compare_digest(events_token, portal.events_token)):
+        return False
+    if not portal.application_token:
+        if Portals.objects.filter(pk=portal.pk, application_token='').update(
+                application_token=application_token):
+            invalidate(portal.member_id)
+            return True
+        portal.application_token = Portals.objects.values_list(
+            'application_token', flat=True).get(pk=portal.pk)
+    return hmac.compare_digest(application_token, portal.application_token)
+
+
+@csrf_exempt
+def event(request):
+    """View-функция обработчика событий Битрикс24.
+
+    Обработчики берут из события только id объектов и перечитывают сами
+    объекты из Битрикс24, поэтому данные события не влияют на содержимое
+    локальных копий.
+    """
+    if request.method != 'POST':
+        return HttpResponse(status=HTTPStatus.BAD_REQUEST)
+    handler = HANDLERS.get((request.POST.get('event') or '').upper())
+    if handler is None:
+        return HttpResponse(status=200)
+    try:
+        portal, settings_portal = get_portal_settings(
+            request.POST.get('auth[member_id]'))
+    except ObjectDoesNotExist:
+        return HttpResponse(status=200)
+    if not is_event_authentic(portal, request):
+        logger.warning('Событие %s портала %s отклонено: неверный токен',
+                       request.POST.get('event'), portal.name)
+        return HttpResponse(status=HTTPStatus.FORBIDDEN)
+    portal.check_auth()
+    try:
+        handler(portal, settings_portal, request.POST)
+    except (RuntimeError, KeyError, ValueError) as ex:
+        logger.error('Ошибка обработки события %s: %s',
+                     request.POST.get('event'), ex)
+    return HttpResponse(status=200)
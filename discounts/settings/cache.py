@@ -0,0 +1,66 @@
+import threading
+import time
+
+from core.models import Portals
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import SettingsPortal
+
+CACHE_TTL: int = 300
+VERSION_KEY: str = 'settings_portal_version:{}'
+
+_entries: dict[str, tuple[int, float, SettingsPortal]] = {}
+_entries_lock = threading.Lock()
+
+
+def get_portal_settings(member_id: str) -> tuple[Portals, SettingsPortal]:
+    """Получить портал и его настройки по member_id.
+
+    Объекты хранятся в памяти процесса и перечитываются из БД только при
+    смене версии в кэше Django или по истечении CACHE_TTL. Вызывающий код
+    получает копии, которые можно изменять.
+    """
+    version = cache.get(VERSION_KEY.format(member_id), 0)
+    with _entries_lock:
+        entry = _entries.get(member_id)
+    if entry and entry[0] == version and entry[1] > time.monotonic():
+        settings_portal = entry[2]
+    else:
+        settings_portal = SettingsPortal.objects.select_related(
+            'portal').get(portal__member_id=member_id)
+        with _entries_lock:
+            _entries[member_id] = (
+                version, time.monotonic() + CACHE_TTL, settings_portal)
+    portal = _copy(settings_portal.portal)
+    settings_portal = _copy(settings_portal)
+    settings_portal.portal = portal
+    return portal, settings_portal
+
+
+def invalidate(member_id: str) -> None:
+    """Сбросить закэшированные объекты портала во всех процессах."""
+    with _entries_lock:
+        _entries.pop(member_id, None)
+    try:
+        cache.incr(VERSION_KEY.format(member_id))
+    except ValueError:
+        cache.set(VERSION_KEY.format(member_id), 1, None)
+
+
+def _copy(obj):
+    """Копия объекта модели без общих с оригиналом полей."""
+    return obj.__class__.from_db(
+        obj._state.db, [field.attname for field in obj._meta.concrete_fields],
+        [getattr(obj, field.attname) for field in obj._meta.concrete_fields])
+
+
+@receiver([post_save, post_delete], sender=Portals)
+def portal_changed(sender, instance, **kwargs):
+    invalidate(instance.member_id)
+
+
+@receiver([post_save, post_delete], sender=SettingsPortal)
+def settings_portal_changed(sender, instance, **kwargs):
+    invalidate(instance.portal.member_id)
@@ -184,6 +184,55 @@ class SettingsPortal(models.Model):
         max_length=20,
         default='ufCrm3_0000000000',
     )
+    nomenclature_groups_ttl = models.PositiveIntegerField(
+        verbose_name='Срок актуальности номенклатурных групп, сек.',
+        help_text='Через сколько секунд сохраненная активность номенклатурной '
+                  'группы перечитывается из универсального списка, если она '
+                  'не была обновлена событием или командой синхронизации.',
+        default=86400,
+    )
+    smart_processes_ttl = models.PositiveIntegerField(
+        verbose_name='Срок актуальности правил скидок, сек.',
+        help_text='Через сколько секунд сохраненные элементы смарт процессов '
+                  'со скидками дополнительно сверяются с Битрикс24 по дате '
+                  'изменения, если они не были обновлены событием или '
+                  'командой синхронизации.',
+        default=3600,
+    )
+    companies_ttl = models.PositiveIntegerField(
+        verbose_name='Срок актуальности типа и ИНН компаний, сек.',
+        help_text='Через сколько секунд сохраненные тип и ИНН компании '
+                  'перечитываются из Битрикс24, если они не были сброшены '
+                  'событием изменения компании или реквизита.',
+        default=3600,
+    )
+    inn_index_verify = models.BooleanField(
+        verbose_name='Проверять отсутствие ИНН в Битрикс24',
+        help_text='Если компания с ИНН не найдена в локальном индексе '
+                  'реквизитов, активити "Проверка компании по ИНН" '
+                  'дополнительно ищет ее в Битрикс24.',
+        default=False,
+    )
+    run_in_background = models.BooleanField(
+        verbose_name='Выполнять активити в фоне',
+        help_text='Активити "Расчет скидок" и "Передача объемов в БД" '
+                  'ставятся в очередь заданий и выполняются командой '
+                  'runjobs, обработчик сразу отвечает Битрикс24.',
+        default=False,
+    )
+    jobs_max_running = models.PositiveSmallIntegerField(
+        verbose_name='Максимум одновременных фоновых заданий',
+        help_text='Сколько заданий портала выполняется одновременно. '
+                  'Остальные задания портала ждут в очереди и не занимают '
+                  'обработчики других порталов.',
+        default=2,
+    )
+    jobs_weight = models.PositiveSmallIntegerField(
+        verbose_name='Вес портала в очереди заданий',
+        help_text='При нехватке обработчиков свободные места делятся между '
+                  'порталами пропорционально весу.',
+        default=1,
+    )
     portal = models.OneToOneField(
         Portals,
         verbose_name='Портал',
@@ -198,3 +247,7 @@ class SettingsPortal(models.Model):
 
     def __str__(self):
         return 'Настройки для портала {}'.format(self.portal.name)
+
+    def get_select_product(self) -> list[str]:
+        """Поля товара каталога, используемые при расчете."""
+        return [self.code_nomenclature_group_id]
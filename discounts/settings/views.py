@@ -1,15 +1,17 @@
 from activities.models import Activity
 from core.bitrix24.bitrix24 import ActivityB24
-from core.models import Portals
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404, render
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from django.http import Http404, HttpResponse
+from django.shortcuts import render
 from django.views.decorators.clickjacking import xframe_options_exempt
 from django.views.decorators.csrf import csrf_exempt
 from openpyxl import Workbook
 from volumes.models import Volume
 
+from .cache import get_portal_settings
 from .forms import SettingsPortalForm
-from .models import SettingsPortal
 
 
 @xframe_options_exempt
@@ -26,11 +28,12 @@ def index(request):
             'error_description': 'Неизвестный тип запроса'
         })
 
-    portal: Portals = get_object_or_404(Portals, member_id=member_id)
+    try:
+        portal, settings_portal = get_portal_settings(member_id)
+    except ObjectDoesNotExist:
+        raise Http404
     portal.check_auth()
 
-    settings_portal = get_object_or_404(SettingsPortal, portal=portal)
-
     activities: Activity = Activity.objects.all()
 
     try:
@@ -70,7 +73,9 @@ def index(request):
 def export_volumes_2_excel(request):
     """Метод экспорта всех объемов в файл excel."""
 
-    volumes = Volume.objects.all()
+    volumes = Volume.objects.annotate(
+        shards_volume=Coalesce(Sum('shards__volume'), 0,
+                               output_field=Volume.volume.field))
 
     response = HttpResponse(
         content_type='application/vnd.openxmlformats-officedocument.'
@@ -84,8 +89,8 @@ def export_volumes_2_excel(request):
 
     columns = [
         'pk',
-        'nom_group_id',
         'company_id',
+        'inn',
         'volume'
     ]
 
@@ -100,9 +105,9 @@ def export_volumes_2_excel(request):
 
         row = [
             volume.pk,
-            volume.nomenclature_group_id,
             volume.company_id,
-            volume.volume,
+            volume.inn,
+            volume.volume + volume.shards_volume,
         ]
 
         for col_num, cell_value in enumerate(row, 1):
@@ -1,12 +1,34 @@
 from django.contrib import admin
 
-from .models import Volume
+from .models import Volume, VolumeShard
 
 
 class VolumeAdmin(admin.ModelAdmin):
-    list_display = ('pk', 'company_id', 'inn', 'volume', 'portal')
+    list_display = ('pk', 'company_id', 'inn', 'volume', 'shards_count',
+                    'portal')
     list_filter = ('portal',)
     search_fields = ('company_id', 'inn')
 
+    def get_readonly_fields(self, request, obj=None):
+        # Объем существующей компании изменяется только через Volume.add
+        return ('volume',) if obj else ()
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            super().save_model(request, obj, form, change)
+        elif form.changed_data:
+            # Сохраняются только измененные поля, чтобы не перезаписать
+            # объем, добавленный параллельными запросами
+            obj.save(update_fields=form.changed_data)
+        if 'shards_count' in form.changed_data:
+            obj.merge_shards()
+
+
+class VolumeShardAdmin(admin.ModelAdmin):
+    list_display = ('pk', 'parent', 'number', 'volume')
+    list_filter = ('parent__portal',)
+    search_fields = ('parent__company_id', 'parent__inn')
+
 
 admin.site.register(Volume, VolumeAdmin)
+admin.site.register(VolumeShard, VolumeShardAdmin)
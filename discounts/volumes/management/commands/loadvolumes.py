@@ -1,6 +1,7 @@
 import csv
 import decimal
 
+from core.models import Portals
 from django.core.management.base import BaseCommand
 from volumes.models import Volume
 
@@ -9,16 +10,19 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         with open("/home/bitrix/ext_www/skidkipril.plazma-t.ru/static/data/upload_1.csv", "r", encoding="utf-8") as csvfile:
             reader = csv.DictReader(csvfile)
+            portals = {}
             for row in reader:
-                obj, created = Volume.objects.get_or_create(
-                    company_id=row['company_id'],
-                    portal_id=row['portal_id'],
-                    defaults={'volume': row['volume'], 'inn': row['inn']}
-                )
+                if row['portal_id'] not in portals:
+                    portals[row['portal_id']] = Portals.objects.get(
+                        pk=row['portal_id'])
+                portal = portals[row['portal_id']]
+                volumes = Volume.objects.filter(
+                    portal=portal, company_id=row['company_id'])
+                existed = volumes.exists()
+                Volume.add(portal, int(row['company_id']),
+                           decimal.Decimal(row['volume']), row['inn'] or None)
 
-                if not created:
+                if existed:
                     with open("/home/bitrix/ext_www/skidkipril.plazma-t.ru/static/data/result.txt", "a", encoding="utf-8") as resultfile:
-                        resultfile.write(f'{obj.pk = }: {obj.volume} + {row["volume"]} = ')
-                        obj.volume += decimal.Decimal(row['volume'])
-                        obj.save()
-                        resultfile.write(f'{obj.volume}\n')
+                        resultfile.write(f'{volumes.get().pk = }: + {row["volume"]} = ')
+                        resultfile.write(f'{volumes.get().get_total()}\n')
@@ -1,5 +1,9 @@
+import decimal
+import random
+
 from core.models import Portals
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Sum
 
 
 class Volume(models.Model):
@@ -19,6 +23,13 @@ class Volume(models.Model):
         max_digits=16,
         decimal_places=2,
     )
+    shards_count = models.PositiveSmallIntegerField(
+        verbose_name='Число частей счетчика',
+        help_text='Для компаний с частыми одновременными передачами объема: '
+                  'объем добавляется в случайную из частей, чтобы запросы '
+                  'не ждали друг друга. 0 - добавлять в сам объем',
+        default=0,
+    )
     portal = models.ForeignKey(
         Portals,
         verbose_name='Портал',
@@ -30,3 +41,98 @@ class Volume(models.Model):
         verbose_name = 'Объем'
         verbose_name_plural = 'Объемы'
         unique_together = ['portal', 'company_id']
+
+    def __str__(self):
+        return '{} {}'.format(self.portal, self.company_id)
+
+    @classmethod
+    def add(cls, portal: Portals, company_id: int, amount: decimal.Decimal,
+            inn: str or None = None) -> None:
+        """Метод атомарного добавления суммы к объему компании.
+
+        Объем увеличивается одним UPDATE в БД без чтения и записи всей
+        строки, поэтому одновременные запросы не теряют изменений. Если
+        объема компании нет, он создается; IntegrityError возникает, только
+        если ИНН уже принадлежит другой компании.
+        """
+        volumes = cls.objects.filter(portal=portal, company_id=company_id)
+        volume = volumes.values('pk', 'shards_count').first()
+        if volume and volume['shards_count']:
+            VolumeShard.add(volume['pk'],
+                            random.randrange(volume['shards_count']), amount)
+            return
+        if volumes.update(volume=F('volume') + amount):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(portal=portal, company_id=company_id,
+                                   volume=amount, inn=inn)
+        except IntegrityError:
+            # Объем создан параллельным запросом
+            if not volumes.update(volume=F('volume') + amount):
+                raise
+
+    def get_total(self) -> decimal.Decimal:
+        """Метод получения объема с учетом частей счетчика."""
+        shards = self.shards.aggregate(total=Sum('volume'))['total']
+        return self.volume + (shards or 0)
+
+    def merge_shards(self) -> None:
+        """Метод переноса в объем частей с номерами от shards_count.
+
+        Нужен после уменьшения числа частей. Запрос, прочитавший прежнее
+        число частей, может после переноса снова создать такую часть: ее
+        объем учитывается в get_total и переносится при следующем вызове.
+        """
+        with transaction.atomic():
+            shards = list(self.shards.select_for_update().filter(
+                number__gte=self.shards_count))
+            if not shards:
+                return
+            VolumeShard.objects.filter(
+                pk__in=[shard.pk for shard in shards]).delete()
+            Volume.objects.filter(pk=self.pk).update(volume=F('volume') + sum(
+                shard.volume for shard in shards))
+
+
+class VolumeShard(models.Model):
+    """Модель части счетчика накопленного объема компании"""
+    parent = models.ForeignKey(
+        Volume,
+        verbose_name='Объем',
+        related_name='shards',
+        on_delete=models.CASCADE
+    )
+    number = models.PositiveSmallIntegerField(
+        verbose_name='Номер части'
+    )
+    volume = models.DecimalField(
+        verbose_name='Объем части',
+        max_digits=16,
+        decimal_places=2,
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = 'Часть объема'
+        verbose_name_plural = 'Части объемов'
+        unique_together = ['parent', 'number']
+
+    def __str__(self):
+        return '{} #{}'.format(self.parent, self.number)
+
+    @classmethod
+    def add(cls, parent_id: int, number: int,
+            amount: decimal.Decimal) -> None:
+        """Метод атомарного добавления суммы к части счетчика."""
+        shards = cls.objects.filter(parent_id=parent_id, number=number)
+        if shards.update(volume=F('volume') + amount):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(parent_id=parent_id, number=number,
+                                   volume=amount)
+        except IntegrityError:
+            # Часть создана параллельным запросом
+            if not shards.update(volume=F('volume') + amount):
+                raise
@@ -0,0 +1,155 @@
+import decimal
+import io
+import threading
+from types import SimpleNamespace
+from unittest import mock
+
+from core.models import Portals
+from django.contrib.admin.sites import site
+from django.db import IntegrityError, connection
+from django.db.models import QuerySet
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from openpyxl import load_workbook
+from settings.views import export_volumes_2_excel
+
+from .models import Volume, VolumeShard
+
+
+def create_portal() -> Portals:
+    return Portals.objects.create(
+        member_id='member', name='test.bitrix24.ru', auth_id='auth',
+        refresh_id='refresh')
+
+
+class VolumeAddTest(TestCase):
+    """Добавление суммы к объему компании."""
+
+    def setUp(self):
+        self.portal = create_portal()
+
+    def test_create_then_add(self):
+        Volume.add(self.portal, 1, decimal.Decimal('10.50'), '7700000000')
+        Volume.add(self.portal, 1, decimal.Decimal('5.25'))
+        volume = Volume.objects.get()
+        self.assertEqual(volume.volume, decimal.Decimal('15.75'))
+        self.assertEqual(volume.inn, '7700000000')
+
+    def test_created_by_parallel_request(self):
+        Volume.objects.create(portal=self.portal, company_id=1, volume=100)
+        update = QuerySet.update
+        calls = []
+
+        def update_after_create(queryset, **kwargs):
+            # Первый UPDATE выполнен до создания объема параллельным запросом
+            calls.append(kwargs)
+            return update(queryset, **kwargs) if len(calls) > 1 else 0
+
+        with mock.patch.object(QuerySet, 'update', update_after_create):
+            Volume.add(self.portal, 1, decimal.Decimal(10))
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(Volume.objects.get().volume, decimal.Decimal(110))
+
+    def test_inn_of_other_company(self):
+        Volume.add(self.portal, 1, decimal.Decimal(10), '7700000000')
+        with self.assertRaises(IntegrityError):
+            Volume.add(self.portal, 2, decimal.Decimal(10), '7700000000')
+
+    def test_sharded_add(self):
+        volume = Volume.objects.create(portal=self.portal, company_id=1,
+                                       volume=10, shards_count=4)
+        for _ in range(20):
+            Volume.add(self.portal, 1, decimal.Decimal(1))
+        volume.refresh_from_db()
+        self.assertEqual(volume.volume, 10)
+        self.assertTrue(all(shard.number < 4 for shard in volume.shards.all()))
+        self.assertEqual(volume.get_total(), 30)
+
+    def test_lost_shard_raises(self):
+        volume = Volume.objects.create(portal=self.portal, company_id=1,
+                                       volume=0)
+        with mock.patch.object(VolumeShard.objects, 'create',
+                               side_effect=IntegrityError('duplicate')):
+            with self.assertRaises(IntegrityError):
+                VolumeShard.add(volume.pk, 0, decimal.Decimal(1))
+
+    def test_merge_shards(self):
+        volume = Volume.objects.create(portal=self.portal, company_id=1,
+                                       volume=10, shards_count=4)
+        for number in range(4):
+            VolumeShard.objects.create(parent=volume, number=number,
+                                       volume=number + 1)
+        volume.shards_count = 2
+        volume.save()
+        volume.merge_shards()
+        volume.refresh_from_db()
+        self.assertEqual(volume.volume, 17)
+        self.assertEqual(
+            sorted(volume.shards.values_list('number', flat=True)), [0, 1])
+        self.assertEqual(volume.get_total(), 20)
+
+    def test_admin_keeps_added_volume(self):
+        volume = Volume.objects.create(portal=self.portal, company_id=1,
+                                       volume=10)
+        # Объем добавлен после того, как админка прочитала строку
+        Volume.add(self.portal, 1, decimal.Decimal(3))
+        volume.inn = '7700000000'
+        site._registry[Volume].save_model(
+            None, volume, SimpleNamespace(changed_data=['inn']), True)
+        volume.refresh_from_db()
+        self.assertEqual((volume.volume, volume.inn), (13, '7700000000'))
+
+    def test_export_includes_shards(self):
+        volume = Volume.objects.create(portal=self.portal, company_id=1,
+                                       volume=10, shards_count=2,
+                                       inn='7700000000')
+        VolumeShard.objects.create(parent=volume, number=0, volume=5)
+        VolumeShard.objects.create(parent=volume, number=1, volume=2)
+        Volume.objects.create(portal=self.portal, company_id=2, volume=1)
+        response = export_volumes_2_excel(RequestFactory().get('/'))
+        rows = list(load_workbook(io.BytesIO(response.content)).active.values)
+        self.assertEqual(sorted(row[1:] for row in rows[1:]),
+                         [(1, '7700000000', 17), (2, None, 1)])
+
+
+class ConcurrentVolumeAddTest(TransactionTestCase):
+    """Одновременные добавления не теряют изменений."""
+
+    THREADS: int = 8
+    ADDS: int = 10
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('SQLite в памяти блокирует таблицу без ожидания')
+
+    def run_threads(self, portal: Portals) -> None:
+        errors = []
+
+        def add():
+            try:
+                for _ in range(self.ADDS):
+                    Volume.add(portal, 1, decimal.Decimal(1))
+            except Exception as ex:
+                errors.append(ex)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_concurrent_adds(self):
+        portal = create_portal()
+        self.run_threads(portal)
+        self.assertEqual(Volume.objects.get().get_total(),
+                         self.THREADS * self.ADDS)
+
+    def test_concurrent_sharded_adds(self):
+        portal = create_portal()
+        Volume.objects.create(portal=portal, company_id=1, volume=0,
+                              shards_count=3)
+        self.run_threads(portal)
+        self.assertEqual(Volume.objects.get().get_total(),
+                         self.THREADS * self.ADDS)